@@ -10,6 +10,8 @@ To run this script:
 
 """
 
+import os
+
 from hepqpr.qallse.cli.func import *
 
 # ==== BUILD CONFIG TODO change it
@@ -27,8 +29,12 @@ output_prefix = 'evt{event}-ds{ds}-'
 model_class = QallseD0  # model class to use
 extra_config = dict()  # model config
 
+async_dump = True  # write the files in the background, while building the next event
+cache_dir = None  # if set, reuse the QUBOs already built with the same config (see hepqpr.qallse.qubo_cache)
+
 dump_config = dict(
-    xplets_kwargs=dict(),  # use json or "pickle"
+    qubo_format='pickle',  # pickle, npz or raw (see dumper.qubo_formats)
+    xplets_format='pickle',  # pickle, json or npz (columnar, can be loaded back with dumper.load_model)
     qubo_kwargs=dict(w_marker=None, c_marker=None)  # save the real coefficients VS generic placeholders
 )
 
@@ -39,6 +45,10 @@ init_logging(logging.DEBUG, sys.stdout)
 # ==== build model
 
 if __name__ == '__main__':
+    from hepqpr.qallse.qubo_cache import QuboCache, build_qubo
+
+    cache = QuboCache(cache_dir) if cache_dir is not None else None
+    writer = dumper.AsyncWriter() if async_dump else None
     mat = []
 
     for event in events:
@@ -50,29 +60,46 @@ if __name__ == '__main__':
             dw = DataWrapper.from_path(path)
             doublets = pd.read_csv(path.replace('-hits.csv', '-doublets.csv'))
 
-            # build model
+            # build model (or load it from the cache)
             with time_this() as time_info:
                 model = model_class(dw, **extra_config)
-                model.build_model(doublets)
+            entry = build_qubo(model, doublets, cache=cache, qubo_kwargs=dump_config['qubo_kwargs'],
+                               xplets_format=dump_config['xplets_format'])
+            # cpu_time and wall_time: creation of the model and build_model (on a cache hit, the time measured when
+            # the entry was built). qubo_*_time: generation of the QUBO and serialization of the xplets
+            time_info = [t + b for t, b in zip(time_info, entry['build_time'])] + entry['qubo_time']
 
             # dump model to a file
-            Q = dumper.dump_model(
-                model,
-                output_path=output_path,
-                prefix=output_prefix.format(event=event, ds=ds),
-                **dump_config
-            )
+            prefix = output_prefix.format(event=event, ds=ds)
+            Q = entry['qubo']
+            # the files are serialized here, so that the writer only does I/O
+            qubo_format = dump_config['qubo_format']
+            write_args = [
+                (dumper.write_serialized_qubo, dumper.serialize_qubo(Q, qubo_format),
+                 dict(fname=os.path.join(output_path, f'{prefix}qubo.{qubo_format}'))),
+                (dumper.dump_xplets, entry['xplets'],
+                 dict(output_path=output_path, prefix=prefix, format=dump_config['xplets_format']))]
+            for fn, arg, kwargs in write_args:
+                if writer is not None:
+                    writer.submit(fn, arg, **kwargs)
+                else:
+                    fn(arg, **kwargs)
 
             # gather stats
+            stats = entry['stats']
             mat.append(
                 [
                     event, ds,
-                    len(model.qubo_doublets),
-                    len(model.qubo_triplets),
-                    len(model.quadruplets),
+                    stats['n_doublets'],
+                    stats['n_triplets'],
+                    stats['n_qplets'],
                     len(Q)
-                ] + time_info)
+                ] + time_info + [entry['cache_hit']])
 
-        headers = 'event,percent,n_doublets,n_triplets,n_qplets,q,cpu_time,wall_time'
+        headers = 'event,percent,n_doublets,n_triplets,n_qplets,q,cpu_time,wall_time,qubo_cpu_time,qubo_wall_time,' \
+                  'cache_hit'
         stats = pd.DataFrame(mat, columns=headers.split(','))
         stats.to_csv('build_qubo.csv', index=False)
+
+    if writer is not None:
+        writer.close()  # wait for the last files
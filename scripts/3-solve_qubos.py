@@ -23,11 +23,13 @@ loglevel = logging.DEBUG
 events = [1000]
 dss = [10]
 repeat = 1
+parallel = False  # neal only: do the repeats in parallel (solve_neal_parallel) and only keep the best sample
 
 data_path = '/tmp/hpt-collapse/ds{ds}/event00000{event}-hits.csv'  # path to the datasets
 
-qubo_path = '/tmp'  # path where the qubos are pickled
+qubo_path = '/tmp'  # path where the qubos are saved
 qubo_prefix = 'evt{event}-ds{ds}-'  # prefix for the qubo files
+qubo_format = 'pickle'  # format of the qubo files: pickle, npz or raw (see dumper.qubo_formats)
 output_path = '/tmp/'  # where to serialize the responses
 output_prefix = qubo_prefix  # prefix for serialized responses
 
@@ -45,13 +47,12 @@ def run_one(event, ds):
     # load data
     path = data_path.format(event=event, ds=ds)
     dw = DataWrapper.from_path(path)
-    qubo_filepath = op.join(qubo_path, qubo_prefix.format(event=event, ds=ds) + 'qubo.pickle')
+    qubo_filepath = op.join(qubo_path, qubo_prefix.format(event=event, ds=ds) + f'qubo.{qubo_format}')
 
-    with open(qubo_filepath, 'rb') as f:
-        Q = pickle.load(f)
+    Q = dumper.load_qubo(qubo_filepath)
     en0 = dw.compute_energy(Q)
 
-    for i in range(repeat):
+    for i in range(1 if parallel else repeat):
         # set seed
         seed = random.randint(0, 1 << 30)
         solver_config['seed'] = seed
@@ -59,7 +60,9 @@ def run_one(event, ds):
         # build model
         with time_this() as time_info:
             with time_this() as qtime_info:
-                if solver == 'neal':
+                if solver == 'neal' and parallel:
+                    response = solve_neal_parallel(Q, n_runs=repeat, **solver_config)
+                elif solver == 'neal':
                     response = solve_neal(Q, **solver_config)
                 elif solver == 'qbsolv':
                     response = solve_qbsolv(Q, **solver_config)
@@ -2,10 +2,14 @@
 from .qallse import Qallse
 from .qallse_mp import QallseMp
 from .qallse_d0 import QallseD0
+from .qallse_doublets import QallseDoublets
 
 # other
 from .data_structures import *
 from .utils import *
 from .track_recreater import TrackRecreaterD
 from .data_wrapper import DataWrapper
+from .qallse_base import QuboBudgetExceeded
 from .dumper import dump_model
+from .qubo_cache import QuboCache
+from .qubo_template import QuboTemplate
@@ -0,0 +1,337 @@
+"""
+This module contains a simulated annealing sampler written with NumPy only, working directly on a sparse (CSR)
+representation of the QUBO. It is a drop-in alternative to neal.
+
+All the reads (replicas) are annealed in lockstep. The variables are partitioned using a greedy colouring of the
+QUBO graph: variables of the same colour share no coupler, so a whole colour can be updated at once for all the
+replicas (Metropolis updates, one sweep = one pass over all the colours). The variables are stored sorted by colour,
+so that a colour is a contiguous block of the states. The energy changes of a colour are recomputed from the states
+of the neighbours (a gather, in float32, whose cost does not depend on the number of flips), and each state has
+its own xorshift random generator, advanced with a few integer operations per sweep.
+
+.. note::
+
+    On the same beta schedule, it runs about as fast as neal with 100 reads and 1.5 to 2 times slower with 10 reads
+    (QUBOs of ~8000 variables from D0 and Qallse, 1000 sweeps: 16s vs 15s and 4.0s vs 2.1s on D0). Its default
+    beta range (:py:meth:`CsrQubo.beta_range`) ignores the rounding errors in the weights, which makes the
+    sweeps count: 100 sweeps give the same energies as neal with its defaults and 1000 sweeps, in less time
+    (10 reads: 0.4s vs 0.8s on D0, 0.7s vs 0.9s on Qallse).
+
+Example usage:
+
+.. code::
+
+    response = VectorizedAnnealer().sample_qubo(Q, num_reads=10, seed=42)
+    final_doublets, final_tracks = process_response(response)
+
+The CSR representation can be reused between calls, e.g. to sample the same QUBO with other seeds:
+
+.. code::
+
+    csr = CsrQubo.from_qubo(Q)  # or CsrQubo.from_arrays(*qubo_to_arrays(Q))
+    responses = [VectorizedAnnealer().sample(csr, seed=seed) for seed in range(10)]
+
+The response is a `dimod.SampleSet`, sorted by energy, that can be used like the response of neal.
+"""
+
+import logging
+import time
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from .type_alias import *
+from .utils import qubo_to_arrays
+
+logger = logging.getLogger(__name__)
+
+
+def _csr_dot(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, X: np.ndarray) -> np.ndarray:
+    # Compute X @ M.T for a CSR matrix M and a 2D array X (one row per replica).
+    # The products are padded with a zero column, so that reduceat also works with empty rows.
+    products = np.zeros((X.shape[0], len(indices) + 1))
+    np.multiply(X[:, indices], data, out=products[:, :-1])
+    sums = np.add.reduceat(products, indptr[:-1], axis=1)
+    sums[:, indptr[:-1] == indptr[1:]] = 0
+    return sums
+
+
+class CsrQubo:
+    """
+    A QUBO as a vector of linear coefficients and a symmetric matrix of couplers in CSR format
+    (`indptr`, `indices`, `data`, as in `scipy.sparse.csr_matrix`).
+    """
+
+    def __init__(self, variables: List[str], linear: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 data: np.ndarray, offset: float = 0.):
+        """
+        :param variables: the variable names
+        :param linear: the linear coefficient of each variable
+        :param indptr: the CSR row pointers of the couplers
+        :param indices: the CSR column indices of the couplers
+        :param data: the CSR values of the couplers. Each coupler appears twice, once in each row.
+        :param offset: a constant added to the energies
+        """
+        self.variables = variables
+        self.linear, self.indptr, self.indices, self.data = linear, indptr, indices, data
+        self.offset = offset
+        self._colors, self._colored = None, None
+
+    def __len__(self):
+        return len(self.variables)
+
+    @classmethod
+    def from_qubo(cls, Q: TQubo) -> 'CsrQubo':
+        """Create a CSR QUBO from a QUBO dictionary."""
+        return cls.from_arrays(*qubo_to_arrays(Q))
+
+    @classmethod
+    def from_arrays(cls, names: np.ndarray, rows: np.ndarray, cols: np.ndarray, values: np.ndarray) -> 'CsrQubo':
+        """Create a CSR QUBO from the arrays of :py:meth:`hepqpr.qallse.utils.qubo_to_arrays`."""
+        n = len(names)
+        values = np.asarray(values, dtype=np.float64)
+        diag = rows == cols
+        linear = np.bincount(rows[diag], weights=values[diag], minlength=n)
+
+        # both (i, j) and (j, i), sorted by row
+        r = np.concatenate([rows[~diag], cols[~diag]])
+        c = np.concatenate([cols[~diag], rows[~diag]])
+        d = np.concatenate([values[~diag], values[~diag]])
+        order = np.argsort(r, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(r, minlength=n), out=indptr[1:])
+
+        variables = [v.decode() if isinstance(v, bytes) else str(v) for v in names.tolist()]
+        return cls(variables, linear, indptr, c[order].astype(np.int64), d[order])
+
+    @property
+    def colors(self) -> List[np.ndarray]:
+        """A greedy colouring of the QUBO graph: a list of arrays of variable indices, without couplers between
+        variables of the same array. Computed on the first access."""
+        if self._colors is None:
+            self._colors = self._greedy_coloring()
+        return self._colors
+
+    def colored(self) -> Tuple['CsrQubo', np.ndarray, np.ndarray]:
+        """
+        Return a copy of this QUBO with the variables sorted by colour (see :py:attr:`colors`), so that each
+        colour is a contiguous range of variables. Computed on the first call.
+
+        :return: the sorted QUBO, the permutation (position in the sorted QUBO -> index in this one) and the
+            bounds of the colours (colour `c` is `bounds[c]:bounds[c+1]`)
+        """
+        if self._colored is None:
+            perm = np.concatenate(self.colors) if len(self) else np.zeros(0, dtype=np.int64)
+            inverse = np.empty_like(perm)
+            inverse[perm] = np.arange(len(perm))
+            lengths = np.diff(self.indptr)[perm]
+            indptr = np.zeros(len(perm) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            positions = np.repeat(self.indptr[perm] - indptr[:-1], lengths) + np.arange(indptr[-1])
+            colored = CsrQubo([self.variables[i] for i in perm.tolist()], self.linear[perm], indptr,
+                              inverse[self.indices[positions]], self.data[positions], self.offset)
+            bounds = np.cumsum([0] + [len(c) for c in self.colors])
+            colored._colors = [np.arange(bounds[c], bounds[c + 1]) for c in range(len(bounds) - 1)]
+            self._colored = colored, perm, bounds
+        return self._colored
+
+    def local_fields(self, X: np.ndarray) -> np.ndarray:
+        """
+        Compute the energy change of setting each variable to 1 given the others, for each state.
+
+        :param X: an array of states, shape (number of states, number of variables)
+        :return: an array with the same shape as `X`
+        """
+        return self.linear + _csr_dot(self.indptr, self.indices, self.data, X)
+
+    def energies(self, X: np.ndarray) -> np.ndarray:
+        """
+        Compute the energy of states.
+
+        :param X: an array of states, shape (number of states, number of variables)
+        :return: the energy of each state
+        """
+        X = np.asarray(X, dtype=np.float64)
+        couplings = _csr_dot(self.indptr, self.indices, self.data, X)
+        # each coupler is counted twice
+        return X @ self.linear + (X * couplings).sum(axis=1) / 2 + self.offset
+
+    def beta_range(self, warm=False):
+        """
+        Compute a default range of inverse temperatures, using the same heuristic as neal: at the start, the
+        largest energy change is accepted with a probability of 50%, at the end the smallest energy change with
+        a probability of 1%.
+
+        :param warm: if set, compute a range for a warm start (i.e. from a good initial state): the start
+            temperature is much lower, so that the median coupler change is accepted with a probability of 5%.
+            The initial state is then refined instead of being randomized.
+        """
+        abs_data = np.abs(self.data)
+        max_delta = np.abs(self.linear) + np.add.reduceat(np.append(abs_data, 0), self.indptr[:-1]) * \
+            (self.indptr[:-1] != self.indptr[1:])
+        coefficients = np.concatenate([np.abs(self.linear), abs_data])
+        # ignore the rounding errors, e.g. weights of 1e-13 instead of 0
+        coefficients = coefficients[coefficients > 1e-9 * (coefficients.max() if len(coefficients) else 0)]
+        if len(coefficients) == 0:
+            return 0.1, 1.
+        beta_end = np.log(100) / coefficients.min()
+        if warm and len(abs_data):
+            return min(np.log(20) / np.median(abs_data), beta_end), beta_end
+        return np.log(2) / max_delta.max(), beta_end
+
+    def states_to_array(self, states, num_states=None) -> np.ndarray:
+        """
+        Convert states to an array in the order of :py:attr:`variables`. Missing variables are set to 0.
+
+        :param states: a sample (dictionary), a list of samples, a `dimod.SampleSet` or an array of shape
+            (number of variables) or (number of states, number of variables)
+        :param num_states: if set, repeat the states to get exactly that many
+        :return: an array of shape (number of states, number of variables)
+        """
+        if isinstance(states, dict):
+            states = [states]
+        elif hasattr(states, 'samples'):  # SampleSet
+            states = list(states.samples())
+        if not isinstance(states, np.ndarray) and len(states) and hasattr(states[0], 'get'):
+            states = [[sample.get(v, 0) for v in self.variables] for sample in states]
+        states = np.atleast_2d(np.asarray(states, dtype=np.int8))
+        if states.shape[1] != len(self):
+            raise ValueError(f'States of {states.shape[1]} variables, expected {len(self)}')
+        if num_states is not None:
+            states = np.resize(states, (num_states, len(self)))
+        return states
+
+    def _greedy_coloring(self):
+        # Colour the variables with the most couplers first, using the smallest colour unused by the neighbours.
+        # Each colour is sorted by decreasing number of couplers (see _coupler_columns).
+        n = len(self)
+        degrees = np.diff(self.indptr)
+        colors = np.full(n, -1, dtype=np.int64)
+        indptr, indices = self.indptr.tolist(), self.indices
+        order = np.argsort(-degrees, kind='stable')
+        for i in order.tolist():
+            used = set(colors[indices[indptr[i]:indptr[i + 1]]].tolist())
+            c = 0
+            while c in used:
+                c += 1
+            colors[i] = c
+        return [order[colors[order] == c] for c in range(colors.max() + 1)] if n > 0 else []
+
+    def _coupler_columns(self, start: int, end: int) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+        # Split the couplers of the variables start:end, sorted by decreasing number of couplers, in columns:
+        # column p holds the p-th coupler of the first k variables, i.e. of those with more than p couplers.
+        # Returns the list of (k, neighbours, weights), the weights as a float32 column vector.
+        lengths = np.diff(self.indptr[start:end + 1])
+        columns = []
+        for p in range(lengths.max() if end > start else 0):
+            k = int(np.count_nonzero(lengths > p))
+            positions = self.indptr[start:start + k] + p
+            columns.append((k, self.indices[positions], self.data[positions].astype(np.float32)[:, None]))
+        return columns
+
+
+class VectorizedAnnealer:
+    """A simulated annealing sampler, running all the reads at once with NumPy. See the module documentation for
+    its performance compared to neal."""
+
+    #: Supported beta schedules
+    schedule_types = ['geometric', 'linear']
+
+    def sample_qubo(self, Q: Union[TQubo, CsrQubo], **kwargs):
+        """
+        Sample a QUBO. See :py:meth:`sample` for the parameters.
+
+        :param Q: the QUBO, as a dictionary or a :py:class:`CsrQubo`
+        :return: a `dimod.SampleSet`, sorted by energy
+        """
+        if not isinstance(Q, CsrQubo):
+            Q = CsrQubo.from_qubo(Q)
+        return self.sample(Q, **kwargs)
+
+    def sample(self, csr: CsrQubo, num_reads=10, num_sweeps=1000, beta_range=None, beta_schedule_type='geometric',
+               beta_schedule=None, seed=None, initial_states=None):
+        """
+        Sample a QUBO.
+
+        :param csr: the QUBO
+        :param num_reads: the number of replicas, annealed in parallel
+        :param num_sweeps: the number of sweeps (Metropolis updates of all the variables)
+        :param beta_range: the initial and final inverse temperatures. Default to :py:meth:`CsrQubo.beta_range`
+            (warm if initial states are given).
+        :param beta_schedule_type: how to interpolate the inverse temperatures, see :py:attr:`schedule_types`
+        :param beta_schedule: the inverse temperature of each sweep. If set, overrides all the other beta
+            parameters and `num_sweeps`.
+        :param seed: the seed of the random generator
+        :param initial_states: the states to start from (see :py:meth:`CsrQubo.states_to_array`), repeated to get
+            `num_reads` states. Default to random states.
+        :return: a `dimod.SampleSet`, sorted by energy
+        """
+        import dimod
+
+        if beta_schedule is None:
+            if beta_range is None:
+                beta_range = csr.beta_range(warm=initial_states is not None)
+            if beta_schedule_type == 'geometric':
+                beta_schedule = np.geomspace(*beta_range, num=num_sweeps)
+            elif beta_schedule_type == 'linear':
+                beta_schedule = np.linspace(*beta_range, num=num_sweeps)
+            else:
+                raise ValueError(f'Invalid beta schedule type {beta_schedule_type}, '
+                                 f'expected one of {self.schedule_types}')
+        beta_schedule = np.asarray(beta_schedule, dtype=np.float64)
+
+        start_time = time.process_time()
+        rng = np.random.RandomState(seed)
+        # work on the variables sorted by colour, so that the states and fields of a colour are contiguous (views)
+        colored, perm, bounds = csr.colored()
+        blocks = [(start, end, colored.linear[start:end, None].astype(np.float32),
+                   colored._coupler_columns(start, end))
+                  for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+        # states, their signs (1 if the state is 0, -1 otherwise) and random streams, one column per read
+        if initial_states is None:
+            X = rng.randint(0, 2, size=(len(csr), num_reads)).astype(np.int8)
+        else:
+            X = np.ascontiguousarray(csr.states_to_array(initial_states, num_reads)[:, perm].T)
+        S = (1 - 2 * X).astype(np.float32)
+        U = rng.randint(1, 2 ** 32, size=(len(csr), num_reads), dtype=np.uint64).astype(np.uint32)
+        shifted = np.empty_like(U)
+
+        for beta in beta_schedule.tolist():
+            minus_beta = np.float32(-beta)
+            for start, end, linear, columns in blocks:
+                # energy change of flipping each variable of the colour, from the current states of the others
+                delta = np.repeat(linear, num_reads, axis=1)
+                for k, neighbours, weights in columns:
+                    delta[:k] += weights * X.take(neighbours, axis=0)
+                delta *= S[start:end]
+                # Metropolis criterion: a change is accepted with a probability min(1, exp(-beta * delta))
+                delta *= minus_beta
+                np.minimum(delta, 0, out=delta)
+                probabilities = np.exp(delta, out=delta)
+                accepted = np.flatnonzero(self._xorshift(U[start:end], shifted[start:end]) <= probabilities)
+                X[start:end].reshape(-1)[accepted] ^= 1
+                S[start:end].reshape(-1)[accepted] *= -1
+
+        X = X[np.argsort(perm)]
+        energies = csr.energies(X.T)
+        order = np.argsort(energies, kind='stable')
+        exec_time = time.process_time() - start_time
+        logger.debug(f'Annealed {num_reads} reads of {len(csr)} variables ({len(bounds) - 1} colours) '
+                     f'in {exec_time:.2f}s, best energy: {energies[order[0]] if num_reads else None}.')
+
+        return dimod.SampleSet.from_samples(
+            (X.T[order], csr.variables), dimod.BINARY, energies[order],
+            info=dict(beta_range=(beta_schedule[0], beta_schedule[-1]) if len(beta_schedule) else None,
+                      num_sweeps=len(beta_schedule), num_colors=len(bounds) - 1))
+
+    @staticmethod
+    def _xorshift(U: np.ndarray, shifted: np.ndarray) -> np.ndarray:
+        # Advance the xorshift32 generators in U (non-zero uint32) and return uniform numbers in (0, 1].
+        # One generator per state is much cheaper than drawing from a RandomState.
+        np.left_shift(U, 13, out=shifted)
+        U ^= shifted
+        np.right_shift(U, 17, out=shifted)
+        U ^= shifted
+        np.left_shift(U, 5, out=shifted)
+        U ^= shifted
+        return U.astype(np.float32) * np.float32(2. ** -32)
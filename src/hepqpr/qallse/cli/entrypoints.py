@@ -32,6 +32,14 @@ class GlobalOptions:
     def get_output_path(self, filename):
         return op.join(self.output_path, self.prefix + filename)
 
+    def get_qubo_path(self):
+        # default QUBO path: the first existing file in <output-path>, using any supported format
+        from hepqpr.qallse.dumper import qubo_formats
+        for fmt in qubo_formats:
+            fname = self.get_output_path(f'qubo.{fmt}')
+            if op.exists(fname): return fname
+        return self.get_output_path('qubo.pickle')
+
 
 # ------
 
@@ -70,30 +78,81 @@ def cli(ctx, debug, hits_path, output_path, prefix):
               help='Model to use.')
 @click.option('-e', '--extra', type=str, multiple=True, metavar='key=value',
               help='Override default model configuration.')
+@click.option('-s', '--sectors', type=(int, int), default=(1, 1), metavar='<phi eta>',
+              help='Number of phi and eta sectors to build in parallel.')
+@click.option('-j', '--jobs', type=int, default=None, metavar='int',
+              help='Number of processes to use when building sectors.')
+@click.option('--chunk-size', type=int, default=None, metavar='int',
+              help='Generate quadruplets by chunks of <int> triplets, using less memory.')
+@click.option('--scratch-dir', type=click.Path(file_okay=False), default=None, metavar='directory',
+              help='With --chunk-size, store the quadruplets in <directory> instead of in memory.')
+@click.option('--max-vars', type=int, default=None, metavar='int',
+              help='Tighten the cuts until the QUBO has at most <int> variables.')
+@click.option('--max-couplers', type=int, default=None, metavar='int',
+              help='Tighten the cuts until the QUBO has at most <int> couplers.')
+@click.option('--early-abort', is_flag=True, default=False,
+              help='Fail as soon as the QUBO is known to exceed --max-vars/--max-couplers.')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default=None, metavar='directory',
+              help='Reuse the QUBOs built previously with the same inputs, stored in <directory>.')
+@click.option('--cache-size', type=int, default=1024, metavar='int',
+              help='With --cache-dir, maximum size of the cache in MB.')
+@click.option('-q', '--qubo', default=None, metavar='filepath',
+              help='Where to save the QUBO. The extension sets the format (.pickle, .npz or .raw). '
+                   'Default to <output_path>/<prefix>qubo.pickle')
+@click.option('--compress', is_flag=True, default=False,
+              help='Compress the QUBO (.npz only).')
+@click.option('--float32', is_flag=True, default=False,
+              help='Store the QUBO coefficients as float32 (.npz and .raw only).')
+@click.option('--xplets-format', type=click.Choice(['pickle', 'json', 'npz']), default='pickle',
+              help='Format of the xplets file. npz is columnar and can be loaded back (see dumper.load_model).')
 @click.pass_obj
-def cli_build(ctx, add_missing, cls, extra):
+def cli_build(ctx, add_missing, cls, extra, sectors, jobs, chunk_size, scratch_dir, max_vars, max_couplers,
+              early_abort, cache_dir, cache_size, qubo, compress, float32, xplets_format):
     '''
     Generate the QUBO.
 
     The QUBO and the xplets used by it are saved as pickle files in the current directory
-    (use --output-path and --prefix options to change it).
+    (use --output-path and --prefix options to change it). Use <qubo> to save the QUBO elsewhere or
+    in a binary format: .npz (optionally compressed) or .raw (a directory of arrays, that can be memory-mapped).
 
     <add-missing> will add any true missing doublet to the input, ensuring an input recall of 100%.
     <cls> lets you choose which model to use: qallse_d0 (default), qallse, qallse_mp, etc.
     <extra> are key=values corresponding to configuration options of the model, (e.g. -e qubo_conflict_strength=0.5).
+    <sectors> splits the hits into phi and eta sectors built in parallel using <jobs> processes
+    (e.g. -s 8 1). The resulting QUBO is the same.
+    <max-vars> and <max-couplers> set a budget on the QUBO size: the cuts of the model are tightened until
+    the QUBO fits, and the configuration updates applied are printed.
+    <cache-dir> stores the QUBOs built, so that building the same model on the same inputs again
+    just loads it. The least recently used QUBOs are evicted when the cache exceeds <cache-size> MB.
     '''
     from hepqpr.qallse import dumper
+    from hepqpr.qallse.qubo_cache import QuboCache
+    if qubo is not None and op.splitext(qubo.rstrip('/'))[1][1:] not in dumper.qubo_formats:
+        print(f'Unknown QUBO format: {qubo}. Supported extensions: {", ".join(dumper.qubo_formats)}')
+        sys.exit(1)
     extra_config = extra_to_dict(extra)
     ModelClass = qallse_class_from_string('.' + cls)
     model = ModelClass(ctx.dw, **extra_config)
+    cache = QuboCache(cache_dir, max_size=cache_size << 20) if cache_dir is not None else None
 
-    build_model(ctx.path, model, add_missing)
-    dumper.dump_model(model, ctx.output_path, ctx.prefix, qubo_kwargs=dict(w_marker=None, c_marker=None))
-    print('Wrote qubo to', ctx.get_output_path("qubo.pickle"))
+    try:
+        entry = build_model(ctx.path, model, add_missing, cache=cache, phi_sectors=sectors[0], eta_sectors=sectors[1],
+                            n_jobs=jobs, qplet_chunk_size=chunk_size, scratch_dir=scratch_dir,
+                            max_qubo_vars=max_vars, max_qubo_couplers=max_couplers, early_abort=early_abort,
+                            xplets_format=xplets_format)
+        if qubo is None: qubo = ctx.get_output_path('qubo.pickle')
+        dumper.save_qubo(entry['qubo'], qubo, compress=compress, dtype=np.float32 if float32 else np.float64)
+        dumper.dump_xplets(entry['xplets'], ctx.output_path, ctx.prefix, format=xplets_format)
+    except QuboBudgetExceeded as e:
+        print(e)
+        sys.exit(1)
+    if len(model.qubo_budget_updates):
+        print('Config updated to fit the QUBO budget:', model.qubo_budget_updates)
+    print('Wrote qubo to', qubo)
 
 @cli.command('qbsolv')
 @click.option('-q', '--qubo', default=None, metavar='filepath',
-              help='Path a the pickled QUBO.')
+              help='Path to the QUBO (.pickle, .npz or .raw).')
 @click.option('-dw', '--dwave-conf', default=None, type=str, metavar='filepath',
               help='Path to a dwave.conf. If set, use a D-Wave as the sub-QUBO solver.')
 @click.option('-v', '--verbosity', type=click.IntRange(-1, 6), default=-1, metavar='int',
@@ -103,8 +162,18 @@ def cli_build(ctx, add_missing, cls, extra):
 @click.option('-e', '--extra', type=str, multiple=True, metavar='key=<value:int>',
               help='Additional options to qbsolv. '
                    'Allowed keys: seed, num_repeats, (+If D-Wave: num_reads).')
+@click.option('--split', is_flag=True, default=False,
+              help='Solve the connected components of the QUBO separately (not with a D-Wave).')
+@click.option('-j', '--jobs', type=int, default=None, metavar='int',
+              help='With --split, number of processes to use.')
+@click.option('--presolve', is_flag=True, default=False,
+              help='Fix and merge variables with an obvious optimal value before solving.')
+@click.option('-t', '--time-budget', type=float, default=None, metavar='seconds',
+              help='Run rounds until the time budget is spent or the energy stops improving (not with --split or a D-Wave).')
+@click.option('--max-stall', type=int, default=5, metavar='int',
+              help='With --time-budget, stop after that many rounds without improvement.')
 @click.pass_obj
-def cli_qbsolv(ctx, qubo, dwave_conf, verbosity, logfile, extra):
+def cli_qbsolv(ctx, qubo, dwave_conf, verbosity, logfile, extra, split, jobs, presolve, time_budget, max_stall):
     '''
     Sample a QUBO using qbsolv (!slower!) and a D-Wave (optional).
 
@@ -112,16 +181,20 @@ def cli_qbsolv(ctx, qubo, dwave_conf, verbosity, logfile, extra):
     in simulation. To use a D-Wave, set the <dw> option to
     a valid dwave configuration file (see https://cloud.dwavesys.com/leap/).
 
-    <qubo> is the path to the pickled qubo (default to <output-path>/<prefix>qubo.pickle).
+    <qubo> is the path to the qubo (default to <output-path>/<prefix>qubo.<pickle|npz|raw>).
     <verbosity> and <extra> are passed to qbsolv. <logfile> will redirect all qbsolv output to
     a file (see also the parse_qbsolv script).
+    <split> solves the independent parts of the QUBO in parallel, using <jobs> processes.
+    <presolve> reduces the QUBO before solving it (see hepqpr.qallse.presolve).
+    <time-budget> restarts qbsolv until the budget is spent or <max-stall> restarts bring no improvement.
+    The energy after each restart is saved in the response info (see cli.func.solve_anytime).
     '''
+    from hepqpr.qallse.dumper import load_qubo
     try:
-        if qubo is None: qubo = ctx.get_output_path('qubo.pickle')
-        with open(qubo, 'rb') as f:
-            Q = pickle.load(f)
+        if qubo is None: qubo = ctx.get_qubo_path()
+        Q = load_qubo(qubo)
     except:
-        print(f'Failed to load QUBO. Are you sure {qubo} is a pickled qubo file ?')
+        print(f'Failed to load QUBO. Are you sure {qubo} is a qubo file ?')
         sys.exit(-1)
 
     qbsolv_kwargs = extra_to_dict(extra, typ=int)
@@ -129,9 +202,19 @@ def cli_qbsolv(ctx, qubo, dwave_conf, verbosity, logfile, extra):
     qbsolv_kwargs['verbosity'] = verbosity
 
     if dwave_conf is not None:
-        response = solve_dwave(Q, dwave_conf, **qbsolv_kwargs)
+        solve, qbsolv_kwargs = solve_dwave, dict(qbsolv_kwargs, conf_file=dwave_conf)
+    elif split:
+        solve, qbsolv_kwargs = solve_components, dict(qbsolv_kwargs, solver='qbsolv', n_jobs=jobs)
+    elif time_budget is not None:
+        solve, qbsolv_kwargs = solve_anytime, dict(qbsolv_kwargs, solver='qbsolv', time_budget=time_budget,
+                                                   max_stall=max_stall)
     else:
-        response = solve_qbsolv(Q, **qbsolv_kwargs)
+        solve = solve_qbsolv
+
+    if presolve:
+        response = solve_presolved(Q, solve, **qbsolv_kwargs)
+    else:
+        response = solve(Q, **qbsolv_kwargs)
 
     print_stats(ctx.dw, response, Q)
     if ctx.output_path is not None:
@@ -143,26 +226,56 @@ def cli_qbsolv(ctx, qubo, dwave_conf, verbosity, logfile, extra):
 @cli.command('neal',
              help='Sample a QUBO using neal.')
 @click.option('-q', '--qubo', default=None, metavar='filepath',
-              help='Path to the pickled QUBO. Default to <output_path>/<prefix>qubo.pickle')
+              help='Path to the QUBO (.pickle, .npz or .raw). Default to <output_path>/<prefix>qubo.pickle')
 @click.option('-s', '--seed', default=None, type=int, metavar='int',
               help='Seed to use.')
+@click.option('--split', is_flag=True, default=False,
+              help='Solve the connected components of the QUBO separately.')
+@click.option('-j', '--jobs', type=int, default=None, metavar='int',
+              help='With --split, number of processes to use.')
+@click.option('--presolve', is_flag=True, default=False,
+              help='Fix and merge variables with an obvious optimal value before solving.')
+@click.option('--warm-start', is_flag=True, default=False,
+              help='Start from the strongest chains of the QUBO instead of random states.')
+@click.option('-t', '--time-budget', type=float, default=None, metavar='seconds',
+              help='Run rounds until the time budget is spent or the energy stops improving (not with --split).')
+@click.option('--max-stall', type=int, default=5, metavar='int',
+              help='With --time-budget, stop after that many rounds without improvement.')
 @click.pass_obj
-def cli_neal(ctx, qubo, seed):
+def cli_neal(ctx, qubo, seed, split, jobs, presolve, warm_start, time_budget, max_stall):
     '''
     Solve a QUBO using neal (!fast!)
 
     neal (https://github.com/dwavesystems/dwave-neal) is a simulated annealing sampler.
     It is faster than qbsolv by two order of magnitude with similar (if not better) results.
+
+    <split> solves the independent parts of the QUBO in parallel, using <jobs> processes.
+    <presolve> reduces the QUBO before solving it (see hepqpr.qallse.presolve).
+    <warm-start> starts the reads from a good solution (see hepqpr.qallse.utils.qubo_initial_state).
+    <time-budget> samples in rounds until the budget is spent or <max-stall> rounds bring no improvement.
+    The energy after each round is saved in the response info (see cli.func.solve_anytime).
     '''
+    from hepqpr.qallse.dumper import load_qubo
     try:
-        if qubo is None: qubo = ctx.get_output_path('qubo.pickle')
-        with open(qubo, 'rb') as f:
-            Q = pickle.load(f)
+        if qubo is None: qubo = ctx.get_qubo_path()
+        Q = load_qubo(qubo)
     except:
-        print(f'Failed to load QUBO. Are you sure {qubo} is a pickled qubo file ?')
+        print(f'Failed to load QUBO. Are you sure {qubo} is a qubo file ?')
         sys.exit(-1)
 
-    response = solve_neal(Q, seed=seed)
+    if split:
+        solve, kwargs = solve_components, dict(solver='neal', n_jobs=jobs, seed=seed)
+    elif time_budget is not None:
+        solve, kwargs = solve_anytime, dict(solver='neal', time_budget=time_budget, max_stall=max_stall, seed=seed)
+    else:
+        solve, kwargs = solve_neal, dict(seed=seed)
+    if warm_start:
+        kwargs['initial_state'] = qubo_initial_state(Q)
+
+    if presolve:
+        response = solve_presolved(Q, solve, **kwargs)
+    else:
+        response = solve(Q, **kwargs)
     print_stats(ctx.dw, response, Q)
     if ctx.output_path is not None:
         oname = ctx.get_output_path('neal_response.pickle')
@@ -170,6 +283,196 @@ def cli_neal(ctx, qubo, seed):
         print(f'Wrote response to {oname}')
 
 
+@cli.command('anneal')
+@click.option('-q', '--qubo', default=None, metavar='filepath',
+              help='Path to the QUBO (.pickle, .npz or .raw). Default to <output_path>/<prefix>qubo.pickle')
+@click.option('-s', '--seed', default=None, type=int, metavar='int',
+              help='Seed to use.')
+@click.option('-r', '--reads', default=10, type=int, metavar='int',
+              help='Number of reads, annealed in parallel.')
+@click.option('--sweeps', default=1000, type=int, metavar='int',
+              help='Number of sweeps.')
+@click.option('--schedule', default='geometric', type=click.Choice(['geometric', 'linear']),
+              help='Interpolation of the inverse temperatures.')
+@click.option('--beta-range', type=(float, float), default=None, metavar='<start end>',
+              help='Initial and final inverse temperatures. Default to a heuristic based on the coefficients.')
+@click.option('--split', is_flag=True, default=False,
+              help='Solve the connected components of the QUBO separately.')
+@click.option('-j', '--jobs', type=int, default=None, metavar='int',
+              help='With --split, number of processes to use.')
+@click.option('--presolve', is_flag=True, default=False,
+              help='Fix and merge variables with an obvious optimal value before solving.')
+@click.option('--warm-start', is_flag=True, default=False,
+              help='Start from the strongest chains of the QUBO instead of random states.')
+@click.option('-t', '--time-budget', type=float, default=None, metavar='seconds',
+              help='Run rounds until the time budget is spent or the energy stops improving (not with --split).')
+@click.option('--max-stall', type=int, default=5, metavar='int',
+              help='With --time-budget, stop after that many rounds without improvement.')
+@click.pass_obj
+def cli_anneal(ctx, qubo, seed, reads, sweeps, schedule, beta_range, split, jobs, presolve, warm_start, time_budget,
+               max_stall):
+    '''
+    Solve a QUBO using the built-in simulated annealing sampler, an alternative to neal.
+
+    The sampler only depends on numpy (see hepqpr.qallse.annealer). All the <reads>
+    are annealed at once, using <sweeps> Metropolis updates of all the variables. With 100 reads, it is
+    as fast as neal for the same number of sweeps. Its default beta range usually needs far fewer
+    sweeps than neal's (100 instead of 1000).
+
+    <split> solves the independent parts of the QUBO in parallel, using <jobs> processes.
+    <presolve> reduces the QUBO before solving it (see hepqpr.qallse.presolve).
+    <warm-start> starts the reads from a good solution (see hepqpr.qallse.utils.qubo_initial_state).
+    <time-budget> samples in rounds until the budget is spent or <max-stall> rounds bring no improvement.
+    The energy after each round is saved in the response info (see cli.func.solve_anytime).
+
+    Without <split>, <presolve> and <warm-start>, the QUBO is loaded as arrays, memory-mapped with
+    the raw format, instead of a dictionary.
+    '''
+    Q = _load_qubo(ctx, qubo, arrays=not (split or presolve or warm_start))
+
+    kwargs = dict(seed=seed, num_reads=reads, num_sweeps=sweeps, beta_schedule_type=schedule, beta_range=beta_range)
+    if warm_start:
+        kwargs['initial_state'] = qubo_initial_state(Q)
+    if split:
+        solve, kwargs = solve_components, dict(kwargs, solver='annealer', n_jobs=jobs)
+    elif time_budget is not None:
+        solve, kwargs = solve_anytime, dict(kwargs, solver='annealer', time_budget=time_budget, max_stall=max_stall)
+    else:
+        solve = solve_annealer
+
+    if presolve:
+        response = solve_presolved(Q, solve, **kwargs)
+    else:
+        response = solve(Q, **kwargs)
+    print_stats(ctx.dw, response, Q)
+    if ctx.output_path is not None:
+        oname = ctx.get_output_path('anneal_response.pickle')
+        with open(oname, 'wb') as f: pickle.dump(response, f)
+        print(f'Wrote response to {oname}')
+
+
+@cli.command('greedy')
+@click.option('-q', '--qubo', default=None, metavar='filepath',
+              help='Path to the QUBO (.pickle, .npz or .raw). Default to <output_path>/<prefix>qubo.pickle')
+@click.option('--presolve', is_flag=True, default=False,
+              help='Fix and merge variables with an obvious optimal value before solving.')
+@click.pass_obj
+def cli_greedy(ctx, qubo, presolve):
+    '''
+    Solve a QUBO using a greedy descent (!fastest!).
+
+    Starting from an empty solution, the greedy solver applies the move decreasing
+    the energy the most until no move decreases it (see hepqpr.qallse.local_search).
+    It is deterministic and follows the tracks from their strongest quadruplets.
+
+    <presolve> reduces the QUBO before solving it (see hepqpr.qallse.presolve).
+    '''
+    _local_search(ctx, qubo, presolve, 'greedy')
+
+
+@cli.command('tabu')
+@click.option('-q', '--qubo', default=None, metavar='filepath',
+              help='Path to the QUBO (.pickle, .npz or .raw). Default to <output_path>/<prefix>qubo.pickle')
+@click.option('-T', '--tenure', type=int, default=None, metavar='int',
+              help='Number of iterations a flipped variable stays tabu. Default to min(20, n/4).')
+@click.option('--max-iter', type=int, default=None, metavar='int',
+              help='Maximum number of iterations. Default to 100 times the number of variables.')
+@click.option('--max-stall', type=int, default=None, metavar='int',
+              help='Stop after that many iterations without improvement. Default to the number of variables.')
+@click.option('--presolve', is_flag=True, default=False,
+              help='Fix and merge variables with an obvious optimal value before solving.')
+@click.option('--warm-start', is_flag=True, default=False,
+              help='Start from the strongest chains of the QUBO instead of the greedy solution.')
+@click.pass_obj
+def cli_tabu(ctx, qubo, tenure, max_iter, max_stall, presolve, warm_start):
+    '''
+    Solve a QUBO using a tabu search.
+
+    The tabu search starts from the greedy solution and applies the best flip at each
+    iteration, forbidding to undo a flip for <tenure> iterations (see hepqpr.qallse.local_search).
+    It is deterministic.
+
+    <presolve> reduces the QUBO before solving it (see hepqpr.qallse.presolve).
+    '''
+    _local_search(ctx, qubo, presolve, 'tabu', warm_start=warm_start, tenure=tenure, max_iter=max_iter,
+                  max_stall=max_stall)
+
+
+def _local_search(ctx, qubo, presolve, solver, warm_start=False, **kwargs):
+    # Common part of the greedy and tabu commands.
+    Q = _load_qubo(ctx, qubo, arrays=not (presolve or warm_start))
+
+    if warm_start:
+        kwargs['initial_state'] = qubo_initial_state(Q)
+    with time_this() as time_info:
+        if presolve:
+            response = solve_presolved(Q, solve_local_search, solver=solver, **kwargs)
+        else:
+            response = solve_local_search(Q, solver=solver, **kwargs)
+    print(f'TIME   -- cpu (s): {time_info[0]:.4f}, wall (s): {time_info[1]:.4f}')
+    print_stats(ctx.dw, response, Q)
+    if ctx.output_path is not None:
+        oname = ctx.get_output_path(f'{solver}_response.pickle')
+        with open(oname, 'wb') as f: pickle.dump(response, f)
+        print(f'Wrote response to {oname}')
+
+
+def _load_qubo(ctx, qubo, arrays=False):
+    # Load the QUBO of the anneal, greedy and tabu commands. With arrays, skip the dictionary: the arrays of the
+    # raw format are memory-mapped and converted directly to a CsrQubo.
+    from hepqpr.qallse.dumper import load_qubo, load_qubo_arrays
+    from hepqpr.qallse.annealer import CsrQubo
+    try:
+        if qubo is None: qubo = ctx.get_qubo_path()
+        return CsrQubo.from_arrays(*load_qubo_arrays(qubo, mmap_mode='r')) if arrays else load_qubo(qubo)
+    except:
+        print(f'Failed to load QUBO. Are you sure {qubo} is a qubo file ?')
+        sys.exit(-1)
+
+
+@cli.command('portfolio')
+@click.option('-q', '--qubo', default=None, metavar='filepath',
+              help='Path to the QUBO (.pickle, .npz or .raw). Default to <output_path>/<prefix>qubo.pickle')
+@click.option('-S', '--solver', 'solvers', multiple=True,
+              type=click.Choice(['neal', 'qbsolv', 'annealer', 'greedy', 'tabu']),
+              help='Solver to race (repeat the option). Default to greedy, tabu, neal and qbsolv.')
+@click.option('-d', '--deadline', type=float, default=60, metavar='seconds',
+              help='Time after which the solvers still running are cancelled, if one succeeded.')
+@click.option('-t', '--timeout', type=float, default=None, metavar='seconds',
+              help='Time after which all the solvers are cancelled, even if none succeeded. Default to 2 * deadline.')
+@click.option('-s', '--seed', default=None, type=int, metavar='int',
+              help='Seed to use.')
+@click.pass_obj
+def cli_portfolio(ctx, qubo, solvers, deadline, timeout, seed):
+    '''
+    Race several solvers on a QUBO and keep the best solution.
+
+    Each solver runs in its own process. At the <deadline>, the solvers still running
+    are cancelled and the best response found so far wins (see cli.func.solve_portfolio).
+    If no solver succeeded yet, the first to succeed before the <timeout> wins.
+    '''
+    from hepqpr.qallse.dumper import load_qubo
+    try:
+        if qubo is None: qubo = ctx.get_qubo_path()
+        Q = load_qubo(qubo)
+    except:
+        print(f'Failed to load QUBO. Are you sure {qubo} is a qubo file ?')
+        sys.exit(-1)
+
+    solvers = [(name, dict()) for name in solvers] if len(solvers) else None
+    response = solve_portfolio(Q, solvers, deadline=deadline, seed=seed, timeout=timeout)
+    portfolio = response.info['portfolio']
+    for r in portfolio['results']:
+        details = f'energy: {r["energy"]:.4f}, wall time (s): {r["time"]:.4f}' if r['status'] == 'done' else ''
+        print(f'SOLVER -- {r["solver"]:8s} {r["status"]:9s} {details}')
+    print(f'          winner: {portfolio["winner"][0]}')
+    print_stats(ctx.dw, response, Q)
+    if ctx.output_path is not None:
+        oname = ctx.get_output_path('portfolio_response.pickle')
+        with open(oname, 'wb') as f: pickle.dump(response, f)
+        print(f'Wrote response to {oname}')
+
+
 @cli.command('quickstart',
              context_settings=dict(ignore_unknown_options=True, allow_extra_args=True))
 @click.pass_context
@@ -189,8 +492,10 @@ def cli_quickstart(ctx):
     '''
 
     def _chain():
-        ctx.forward(cli_build)
-        ctx.invoke(cli_neal)
+        # parse the extra arguments as build options (ctx.forward only passes the quickstart's own options)
+        with cli_build.make_context('build', list(ctx.args), parent=ctx) as build_ctx:
+            ctx.invoke(cli_build, **build_ctx.params)
+        ctx.invoke(cli_neal, qubo=build_ctx.params['qubo'])
 
     if ctx.obj.output_path is None:
         import tempfile
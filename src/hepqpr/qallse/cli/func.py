@@ -35,7 +35,8 @@ def time_this():
 
 # ======= model building
 
-def build_model(path, model, add_missing):
+def build_model(path, model, add_missing, cache=None, qubo_kwargs=None, **build_kwargs):
+    from hepqpr.qallse.qubo_cache import build_qubo
     doublets = pd.read_csv(path + '-doublets.csv')
 
     # prepare doublets
@@ -46,18 +47,53 @@ def build_model(path, model, add_missing):
         p, r, ms = model.dataw.compute_score(doublets)
         print(f'INPUT -- precision (%): {p * 100:.4f}, recall (%): {r * 100:.4f}, missing: {len(ms)}')
 
-    # build the qubo
-    model.build_model(doublets=doublets)
+    # build the qubo (or load it from the cache)
+    return build_qubo(model, doublets, cache=cache, qubo_kwargs=qubo_kwargs, **build_kwargs)
 
 
 # ======= sampling
 
-def solve_neal(Q, seed=None, **kwargs):
+def _neal_supports(parameter):
+    # The pinned version of neal (see setup.py) predates some parameters, e.g. initial_states or interrupt_function.
+    from neal import SimulatedAnnealingSampler
+    return parameter in SimulatedAnnealingSampler().parameters
+
+
+def _warm_start(Q, initial_state, kwargs):
+    # Add the neal parameters to start all the reads from initial_state, restricted to the variables of Q,
+    # with a low initial temperature (see CsrQubo.beta_range). Ignored if neal does not support initial states.
+    from hepqpr.qallse.annealer import CsrQubo
+    if not _neal_supports('initial_states'):
+        logger.warning('This version of neal does not support initial states: ignoring the warm start.')
+        return kwargs
+    variables = dict.fromkeys(k for key in Q.keys() for k in key)
+    kwargs = dict(kwargs, initial_states=dict((v, initial_state.get(v, 0)) for v in variables),
+                  initial_states_generator='tile')
+    if kwargs.get('beta_range') is None and kwargs.get('beta_schedule') is None:
+        kwargs['beta_range'] = CsrQubo.from_qubo(Q).beta_range(warm=True)
+    return kwargs
+
+
+def solve_neal(Q, seed=None, initial_state=None, **kwargs):
+    """
+    Sample a QUBO using neal.
+
+    :param Q: the QUBO
+    :param seed: the seed to use
+    :param initial_state: if set, a sample to start all the reads from (warm start), for example
+        :py:meth:`hepqpr.qallse.QallseBase.initial_state`. The default beta range is then adapted, so that fewer
+        sweeps are needed. Needs a version of neal supporting `initial_states` (newer than the one pinned in
+        setup.py), else the reads start from random states.
+    :param kwargs: other parameters passed to neal
+    :return: a dimod response
+    """
     from neal import SimulatedAnnealingSampler
     # generate seed for logging purpose
     if seed is None:
         import random
         seed = random.randint(0, 1 << 31)
+    if initial_state is not None:
+        kwargs = _warm_start(Q, initial_state, kwargs)
     # run neal
     start_time = time.process_time()
     response = SimulatedAnnealingSampler().sample_qubo(Q, seed=seed, **kwargs)
@@ -66,6 +102,117 @@ def solve_neal(Q, seed=None, **kwargs):
     return response
 
 
+def solve_annealer(Q, seed=None, initial_state=None, **kwargs):
+    """
+    Sample a QUBO using the built-in sampler (see :py:class:`hepqpr.qallse.annealer.VectorizedAnnealer`).
+
+    :param Q: the QUBO, as a dictionary or a :py:class:`hepqpr.qallse.annealer.CsrQubo`
+    :param seed: the seed to use
+    :param initial_state: if set, a sample to start all the reads from (warm start)
+    :param kwargs: other parameters passed to :py:meth:`hepqpr.qallse.annealer.VectorizedAnnealer.sample`
+    :return: a dimod response
+    """
+    from hepqpr.qallse.annealer import VectorizedAnnealer
+    # generate seed for logging purpose
+    if seed is None:
+        import random
+        seed = random.randint(0, 1 << 31)
+    start_time = time.process_time()
+    response = VectorizedAnnealer().sample_qubo(Q, seed=seed, initial_states=initial_state, **kwargs)
+    exec_time = time.process_time() - start_time
+    logger.info(f'QUBO of size {len(Q)} sampled in {exec_time:.2f}s (ANNEALER, seed={seed}).')
+    return response
+
+
+def solve_local_search(Q, solver='tabu', **kwargs):
+    """
+    Solve a QUBO using a deterministic local search (see :py:mod:`hepqpr.qallse.local_search`).
+
+    :param Q: the QUBO, as a dictionary or a :py:class:`hepqpr.qallse.annealer.CsrQubo`
+    :param solver: either `greedy` or `tabu`
+    :param kwargs: other parameters passed to the solver
+    :return: a dimod response with one sample
+    """
+    from hepqpr.qallse.local_search import GreedySolver, TabuSolver
+    sampler = dict(greedy=GreedySolver, tabu=TabuSolver)[solver]()
+    with time_this() as time_info:
+        response = sampler.sample_qubo(Q, **kwargs)
+    logger.info(f'QUBO of size {len(Q)} solved in {time_info[0]:.2f}s (cpu), {time_info[1]:.2f}s (wall) '
+                f'({solver.upper()}, energy={response.first.energy:.4f}).')
+    return response
+
+
+# BQM shared by the workers of solve_neal_parallel, set once per process
+_worker_bqm = None
+
+
+def _init_neal_worker(bqm):
+    global _worker_bqm
+    _worker_bqm = bqm
+
+
+def _neal_run(seed, kwargs):
+    # Run neal once in a worker process (see solve_neal_parallel).
+    from neal import SimulatedAnnealingSampler
+    with time_this() as time_info:
+        response = SimulatedAnnealingSampler().sample(_worker_bqm, seed=seed, **kwargs)
+    return response, time_info
+
+
+def solve_neal_parallel(Q, n_runs=4, seed=None, n_jobs=None, split_reads=False, initial_state=None, **kwargs):
+    """
+    Run neal `n_runs` times with different seeds in a pool of processes and merge the responses.
+    The seed of each run is derived from `seed`, so the whole is reproducible whatever the number of processes.
+
+    :param Q: the QUBO
+    :param n_runs: the number of runs
+    :param seed: the seed used to derive the seeds of the runs
+    :param n_jobs: the number of processes to use. Default to the number of CPUs.
+    :param split_reads: if set, share `num_reads` between the runs instead of doing `num_reads` in each run
+    :param initial_state: if set, a sample to start all the reads from (see :py:meth:`solve_neal`)
+    :param kwargs: other parameters passed to neal
+    :return: a dimod response with the samples of all the runs, sorted by energy. `response.info['runs']` lists
+        the seed, the best energy, the CPU and the wall time of each run.
+    """
+    import dimod
+    from concurrent.futures import ProcessPoolExecutor
+
+    if seed is None:
+        import random
+        seed = random.randint(0, 1 << 31)
+    if initial_state is not None:
+        kwargs = _warm_start(Q, initial_state, kwargs)
+    # 31 bits, the maximum accepted by neal
+    seeds = np.random.RandomState(seed).randint(0, 1 << 31, size=n_runs).tolist()
+    tasks = [dict(kwargs) for _ in range(n_runs)]
+    if split_reads:
+        num_reads = kwargs.get('num_reads', 1)
+        if num_reads < n_runs:
+            raise ValueError(f'Cannot split {num_reads} reads between {n_runs} runs')
+        for i, task_kwargs in enumerate(tasks):
+            task_kwargs['num_reads'] = num_reads // n_runs + (i < num_reads % n_runs)
+
+    with time_this() as time_info:
+        # the BQM is built once, instead of once per run by sample_qubo
+        bqm = dimod.BinaryQuadraticModel.from_qubo(Q)
+        if n_jobs == 1 or n_runs == 1:
+            _init_neal_worker(bqm)
+            results = [_neal_run(s, t) for s, t in zip(seeds, tasks)]
+        else:
+            with ProcessPoolExecutor(n_jobs, initializer=_init_neal_worker, initargs=(bqm,)) as executor:
+                results = list(executor.map(_neal_run, seeds, tasks))
+
+        merged = dimod.concatenate([r for r, _ in results])
+        order = np.argsort(merged.record.energy, kind='stable')
+        runs = [dict(seed=s, energy=float(r.first.energy), cpu_time=t[0], wall_time=t[1])
+                for s, (r, t) in zip(seeds, results)]
+        response = dimod.SampleSet(merged.record[order], merged.variables, dict(runs=runs), merged.vartype)
+
+    logger.info(f'QUBO of size {len(Q)} sampled in {time_info[1]:.2f}s (wall) using {n_runs} runs '
+                f'(NEAL, seed={seed}, best energy={response.first.energy:.4f}).')
+    return response
+
+
 def solve_qbsolv(Q, logfile=None, seed=None, **kwargs):
     from hepqpr.qallse.other.stdout_redirect import capture_stdout
     from dwave_qbsolv import QBSolv
@@ -101,11 +248,244 @@ def solve_dwave(Q, conf_file, **kwargs):
     return solve_qbsolv(Q, solver=solver, **kwargs)
 
 
+def _solve_batch(solver, Q, kwargs):
+    # Solve one batch of components (see solve_components) in a worker process.
+    return dict(neal=solve_neal, qbsolv=solve_qbsolv, annealer=solve_annealer)[solver](Q, **kwargs)
+
+
+def solve_components(Q, solver='neal', n_jobs=None, min_batch_size=1000, seed=None, **kwargs):
+    """
+    Split the QUBO into connected components (see :py:meth:`hepqpr.qallse.utils.split_qubo`) and solve them in a
+    pool of processes. Small components are batched together, so that each batch has at least `min_batch_size`
+    variables. The best samples of each batch are merged into one response, which can be used like the response
+    of the solver itself (e.g. with :py:meth:`process_response`).
+
+    :param Q: the QUBO
+    :param solver: either `neal`, `qbsolv` or `annealer`
+    :param n_jobs: the number of processes to use. Default to the number of CPUs.
+    :param min_batch_size: the minimum number of variables of a batch of components
+    :param seed: the seed of the first batch, the next batches using seed+1, seed+2, etc.
+    :param kwargs: other parameters passed to the solver
+    :return: a dimod response with one sample
+    """
+    import dimod
+    from concurrent.futures import ProcessPoolExecutor
+
+    if seed is None:
+        import random
+        seed = random.randint(0, 1 << 30)
+
+    with time_this() as time_info:
+        batches, batch, batch_vars = [], dict(), set()
+        for component in split_qubo(Q):
+            batch.update(component)
+            batch_vars.update(k for key in component.keys() for k in key)
+            if len(batch_vars) >= min_batch_size:
+                batches.append(batch)
+                batch, batch_vars = dict(), set()
+        if len(batch):
+            batches.append(batch)
+
+        tasks = [(solver, batch, dict(kwargs, seed=seed + i)) for i, batch in enumerate(batches)]
+        if n_jobs == 1 or len(tasks) <= 1:
+            responses = [_solve_batch(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(n_jobs) as executor:
+                responses = list(executor.map(_solve_batch, *zip(*tasks)))
+
+        # the components are independent: the best sample is the union of the best samples of each batch
+        sample, energy = dict(), 0
+        for response in responses:
+            sample.update(response.first.sample)
+            energy += response.first.energy
+        response = dimod.SampleSet.from_samples(sample, dimod.BINARY, energy)
+
+    logger.info(f'QUBO of size {len(Q)} sampled in {time_info[1]:.2f}s (wall) using {len(batches)} batches '
+                f'of components ({solver.upper()}, seed={seed}).')
+    return response
+
+
+def solve_anytime(Q, solver='neal', time_budget=60., max_stall=5, min_improvement=1e-6, seed=None, **kwargs):
+    """
+    Solve a QUBO in rounds (reads for neal and the built-in annealer, restarts for qbsolv) until the time budget
+    is spent or the best energy stops improving. A round is only started if it is expected to end before the
+    deadline, based on the duration of the previous rounds. With neal, a round is also interrupted at the deadline
+    if the installed version supports it (`interrupt_function`, newer than the one pinned in setup.py).
+
+    The energy of each round is recorded in `response.info['trace']`, a dictionary with the columns `timestamp`
+    (seconds since the start), `energy` (best energy of the round) and `best_energy` (best energy so far).
+    See also :py:meth:`hepqpr.qallse.other.parse_qbsolv.plot_energies`.
+
+    :param Q: the QUBO
+    :param solver: either `neal`, `qbsolv` or `annealer`
+    :param time_budget: the maximum wall time in seconds
+    :param max_stall: stop after that many rounds without improvement of the best energy
+    :param min_improvement: energy decrease below which a round does not count as an improvement
+    :param seed: the seed of the first round, the next rounds using seed+1, seed+2, etc.
+    :param kwargs: other parameters passed to the solver, e.g. `num_reads` or `num_repeats`
+    :return: the response of the best round, with the `trace`, the number of `rounds` and the `stop_reason`
+        (`deadline` or `plateau`) in its info
+    """
+    solve = dict(neal=solve_neal, qbsolv=solve_qbsolv, annealer=solve_annealer)[solver]
+    if seed is None:
+        import random
+        seed = random.randint(0, 1 << 30)
+
+    start_time = time.perf_counter()
+    if solver == 'neal' and 'interrupt_function' not in kwargs and _neal_supports('interrupt_function'):
+        kwargs['interrupt_function'] = lambda: time.perf_counter() - start_time > time_budget
+
+    best, trace, n_stall = None, dict(timestamp=[], energy=[], best_energy=[]), 0
+    n_rounds, stop_reason = 0, 'deadline'
+    while True:
+        response = solve(Q, seed=(seed + n_rounds) % (1 << 31), **kwargs)
+        elapsed = time.perf_counter() - start_time
+        n_rounds += 1
+
+        energy = float(response.first.energy)
+        if best is None or energy < best.first.energy - min_improvement:
+            best, n_stall = response, 0
+        else:
+            n_stall += 1
+        trace['timestamp'].append(elapsed)
+        trace['energy'].append(energy)
+        trace['best_energy'].append(float(best.first.energy))
+
+        if n_stall >= max_stall:
+            stop_reason = 'plateau'
+            break
+        if elapsed + elapsed / n_rounds > time_budget:
+            break  # the next round would likely end after the deadline
+
+    best.info.update(trace=trace, rounds=n_rounds, stop_reason=stop_reason)
+    logger.info(f'QUBO of size {len(Q)} sampled in {elapsed:.2f}s (wall) using {n_rounds} rounds '
+                f'({solver.upper()}, seed={seed}, stopped on {stop_reason}, best energy={best.first.energy:.4f}).')
+    return best
+
+
+#: Default solvers of :py:meth:`solve_portfolio`: a list of (solver name, parameters)
+default_portfolio = [('greedy', dict()), ('tabu', dict()), ('neal', dict(num_reads=10)), ('qbsolv', dict())]
+
+
+def _portfolio_run(solver, Q, kwargs):
+    # Run one solver of the portfolio in a worker process.
+    with time_this() as time_info:
+        if solver in ['greedy', 'tabu']:
+            response = solve_local_search(Q, solver=solver, **kwargs)
+        else:
+            response = dict(neal=solve_neal, qbsolv=solve_qbsolv, annealer=solve_annealer)[solver](Q, **kwargs)
+    return response, time_info[1]
+
+
+def solve_portfolio(Q, solvers=None, deadline=60., seed=None, timeout=None):
+    """
+    Run several solvers concurrently (one process each) on the same QUBO and keep the best response.
+    All the solvers are awaited until the deadline, or until they are all finished. Then, as soon as one solver
+    succeeded, the solvers still running are killed and the best response among the successful ones wins (the
+    fastest in case of a tie). A failing solver does not end the race: if no solver succeeded at the deadline,
+    the first to succeed afterwards wins, unless the timeout is reached.
+
+    :param Q: the QUBO
+    :param solvers: a list of (solver name, parameters), the names being `neal`, `qbsolv`, `annealer`, `greedy`
+        or `tabu`. The same solver can be used several times. Default to :py:data:`default_portfolio`.
+    :param deadline: the wall time in seconds after which the running solvers are cancelled, if one succeeded
+    :param seed: the seed passed to the randomized solvers (unless set in their parameters)
+    :param timeout: the wall time in seconds after which all the solvers are cancelled, even if none succeeded.
+        Default to twice the deadline.
+    :return: the response of the winner. Its info contains a `portfolio` entry with the `winner` (name and index
+        in `solvers`) and the `results` of each solver: `status` (`done`, `failed` or `cancelled`), `energy` and
+        wall `time`.
+    :raise RuntimeError: if all the solvers failed or none succeeded before the timeout
+    """
+    import multiprocessing
+    import queue
+
+    if solvers is None:
+        solvers = default_portfolio
+    if seed is None:
+        import random
+        seed = random.randint(0, 1 << 30)
+    timeout = max(deadline, 2 * deadline if timeout is None else timeout)
+
+    def _callbacks(i):
+        # put the outcome of the i-th solver in the queue of finished solvers
+        return dict(callback=lambda result: finished.put((i, result, None)),
+                    error_callback=lambda err: finished.put((i, None, err)))
+
+    start_time = time.perf_counter()
+    finished = queue.Queue()
+    results = [dict(solver=name, status='cancelled', energy=None, time=None) for name, _ in solvers]
+    best = None
+    pool = multiprocessing.Pool(len(solvers))
+    try:
+        for i, (name, kwargs) in enumerate(solvers):
+            if name not in ['greedy', 'tabu']:
+                kwargs = dict(dict(seed=seed), **kwargs)
+            pool.apply_async(_portfolio_run, (name, Q, kwargs), **_callbacks(i))
+
+        for _ in range(len(solvers)):
+            # wait for all the solvers until the deadline, then only until one succeeded
+            remaining = (deadline if best is not None else timeout) - (time.perf_counter() - start_time)
+            try:
+                i, result, err = finished.get(timeout=max(0., remaining))
+            except queue.Empty:
+                break
+            name = solvers[i][0]
+            if err is not None:
+                logger.warning(f'Portfolio: {name} failed ({err}).')
+                results[i]['status'] = 'failed'
+                continue
+            response, exec_time = result
+            results[i].update(status='done', energy=float(response.first.energy), time=exec_time)
+            if best is None or results[i]['energy'] < best[2] - 1e-9 or \
+                    (results[i]['energy'] < best[2] + 1e-9 and exec_time < best[3]):
+                best = (i, response, results[i]['energy'], exec_time)
+    finally:
+        # kill the solvers still running
+        pool.terminate()
+        pool.join()
+
+    if best is None:
+        if all(r['status'] == 'failed' for r in results):
+            raise RuntimeError('All the solvers of the portfolio failed.')
+        raise RuntimeError(f'No solver of the portfolio succeeded before the timeout ({timeout}s).')
+    i, response, energy, _ = best
+    response.info['portfolio'] = dict(winner=(solvers[i][0], i), results=results)
+    exec_time = time.perf_counter() - start_time
+    logger.info(f'QUBO of size {len(Q)} sampled in {exec_time:.2f}s (wall) by a portfolio of {len(solvers)} '
+                f'solvers (winner: {solvers[i][0].upper()}, energy={energy:.4f}, seed={seed}, '
+                f'failed: {sum(1 for r in results if r["status"] == "failed")}, '
+                f'cancelled: {sum(1 for r in results if r["status"] == "cancelled")}).')
+    return response
+
+
+def solve_presolved(Q, solve, **kwargs):
+    """
+    Reduce the QUBO (see :py:class:`hepqpr.qallse.presolve.QuboPresolver`), solve the residual QUBO and expand the
+    response, so that it can be used like the response of the solver on the original QUBO.
+
+    :param Q: the QUBO
+    :param solve: the function solving the residual QUBO, e.g. :py:meth:`solve_neal` or :py:meth:`solve_components`
+    :param kwargs: other parameters passed to `solve`
+    :return: a dimod response
+    """
+    import dimod
+    from hepqpr.qallse.presolve import QuboPresolver
+
+    presolver = QuboPresolver(Q)
+    residual = presolver.presolve()
+    if len(residual) == 0:
+        return dimod.SampleSet.from_samples(presolver.expand_sample({}), dimod.BINARY, presolver.offset,
+                                            info=dict(presolve=presolver.stats))
+    return presolver.expand_response(solve(residual, **kwargs))
+
+
 # ======= results
 
 def process_response(response):
     sample = next(response.samples())
-    final_triplets = [Triplet.name_to_hit_ids(k) for k, v in sample.items() if v == 1]
+    # auxiliary variables are not xplets (see AUXILIARY_PREFIX)
+    final_triplets = [Triplet.name_to_hit_ids(k) for k, v in sample.items() if v == 1 and not is_auxiliary_variable(k)]
     all_doublets = tracks_to_xplets(final_triplets)
     final_tracks, final_doublets = TrackRecreaterD().process_results(all_doublets)
 
@@ -113,13 +493,23 @@ def process_response(response):
 
 
 def print_stats(dw, response, Q=None):
+    from hepqpr.qallse.annealer import CsrQubo
     final_doublets, final_tracks = process_response(response)
 
-    en0 = 0 if Q is None else dw.compute_energy(Q)
+    if Q is None:
+        en0 = 0
+    elif isinstance(Q, CsrQubo):
+        en0 = Q.energies(Q.states_to_array(dw.sample_variables(Q.variables)))[0]
+    else:
+        en0 = dw.compute_energy(Q)
     en = response.record.energy[0]
     print(f'SAMPLE -- energy: {en:.4f}, ideal: {en0:.4f} (diff: {en-en0:.6f})')
     occs = response.record.num_occurrences
     print(f'          best sample occurrence: {occs[0]}/{occs.sum()}')
+    if 'presolve' in response.info:
+        stats = response.info['presolve']
+        print(f'          presolve removed {stats["removed"]}/{stats["variables"]} variables '
+              f'(fixed: {stats["fixed"]}, merged: {stats["merged"]})')
 
     p, r, ms = dw.compute_score(final_doublets)
     print(f'SCORE  -- precision (%): {p * 100}, recall (%): {r * 100}, missing: {len(ms)}')
@@ -3,7 +3,9 @@ This module contains the definition of all the data structures used by our model
 as well as some useful type alias used throughout the project.
 """
 
+import copy
 import math
+from collections.abc import Sequence
 from typing import Set, Iterable
 
 import numpy as np
@@ -20,16 +22,40 @@ class Volayer:
 
     #: Define the mapping of `volume_id` and `layer_id` into one number (the index in the list)
     ordering = [(8, 2), (8, 4), (8, 6), (8, 8), (13, 2), (13, 4), (13, 6), (13, 8), (17, 2), (17, 4)]
+    # reverse lookup of ordering
+    _indexes = dict(zip(ordering, range(len(ordering))))
 
     @classmethod
     def get_index(cls, volayer: Tuple[int, int]) -> int:
         """Convert a couple `volume_id`, `layer_id` into a number (see :py:attr:`~ordering`)."""
-        return cls.ordering.index(tuple(volayer))
+        try:
+            return cls._indexes[tuple(volayer)]
+        except KeyError:
+            raise ValueError(f'{tuple(volayer)} is not in list') from None
+
+    @classmethod
+    def get_indexes(cls, volume_ids: np.ndarray, layer_ids: np.ndarray) -> np.ndarray:
+        """Vectorized version of :py:meth:~`get_index`. Unknown couples are mapped to -1."""
+        volume_ids, layer_ids = np.asarray(volume_ids, dtype=np.int64), np.asarray(layer_ids, dtype=np.int64)
+        (max_volume, max_layer) = np.max(cls.ordering, axis=0)
+        table = np.full((max_volume + 1, max_layer + 1), -1, dtype=np.int64)
+        for i, (volume_id, layer_id) in enumerate(cls.ordering):
+            table[volume_id, layer_id] = i
+        known = (volume_ids >= 0) & (volume_ids <= max_volume) & (layer_ids >= 0) & (layer_ids <= max_layer)
+        indexes = np.full(volume_ids.shape, -1, dtype=np.int64)
+        indexes[known] = table[volume_ids[known], layer_ids[known]]
+        return indexes
 
     @classmethod
     def difference(cls, volayer1, volayer2) -> int:
         """Return the distance between two volayers."""
-        return cls.ordering.index(volayer2) - cls.ordering.index(volayer1)
+        return cls.get_index(volayer2) - cls.get_index(volayer1)
+
+
+#: Compact representation of a quadruplet, used when quadruplets are generated by chunks
+#: (see :py:meth:`hepqpr.qallse.QallseBase.build_model`): the indexes of the two triplets in the model's list of
+#: triplets, the coupling strength and the volayer span.
+qplet_record_dtype = np.dtype([('t1', np.int64), ('t2', np.int64), ('strength', np.float64), ('volayer_span', np.int8)])
 
 
 class Xplet:
@@ -77,6 +103,18 @@ class Xplet:
     def __repr__(self):
         return self.__str__()
 
+    def detached_copy(self, **attrs):
+        """
+        Return a shallow copy of this xplet, with the given attributes overridden and empty inner/outer
+        connections. Geometric properties are copied as-is, not recomputed.
+        """
+        xplet = copy.copy(self)
+        xplet.__dict__.update(attrs)
+        if hasattr(self, 'inner'):
+            xplet.inner, xplet.outer = [], []
+            xplet.inner_kept, xplet.outer_kept = set(), set()
+        return xplet
+
     def to_dict(self):
         d = dict(name=str(self), hits=self.hit_ids())
         for k, v in self.__dict__.items():
@@ -95,8 +133,11 @@ class Hit(Xplet):
 
         #: The hit id
         self.hit_id: int = int(self.hit_id)
-        #: The volayer
-        self.volayer: int = Volayer.get_index((int(self.volume_id), int(self.layer_id)))
+        #: The dense index of the hit (0 to N-1) in its :py:class:`hepqpr.qallse.DataWrapper`
+        self.hit_index: int = int(kwargs.get('hit_index', -1))
+        #: The volayer (precomputed by :py:class:`hepqpr.qallse.DataWrapper`, if available)
+        self.volayer: int = int(kwargs['volayer']) if kwargs.get('volayer', -1) >= 0 else \
+            Volayer.get_index((int(self.volume_id), int(self.layer_id)))
 
         #: The coordinates in the X-Y plane, i.e. `(x,y)`
         self.coord_2d: Tuple[float, float] = np.array([self.x, self.y])
@@ -108,6 +149,12 @@ class Hit(Xplet):
         self.inner_tplets: List[Triplet] = []
         self.outer_tplets: List[Triplet] = []
 
+    def detached_copy(self, **attrs):
+        hit = super().detached_copy(**attrs)
+        hit.hits = [hit]
+        hit.inner_tplets, hit.outer_tplets = [], []
+        return hit
+
     def __str__(self):
         return str(self.hit_id)  # to avoid recursion
 
@@ -137,6 +184,10 @@ class Doublet(Xplet):
         #: The 3D vector of this doublet, i.e. `(∆x,∆y,∆z)`
         self.coord_3d = hit_end.coord_3d - hit_start.coord_3d
 
+    def detached_copy(self, h1: Hit, h2: Hit, **attrs):
+        """Copy this doublet, using `h1` and `h2` (copies of its own hits) as hits."""
+        return super().detached_copy(hits=[h1, h2], h1=h1, h2=h2, **attrs)
+
 
 class Triplet(Xplet):
     """A triplet is composed of two doublets, where the first ends at the start of the other."""
@@ -166,6 +217,10 @@ class Triplet(Xplet):
         """Return the ordered list of doublets composing this triplet."""
         return [self.d1, self.d2]
 
+    def detached_copy(self, d1: Doublet, d2: Doublet, **attrs):
+        """Copy this triplet, using `d1` and `d2` (copies of its own doublets) as doublets."""
+        return super().detached_copy(hits=[d1.h1, d2.h1, d2.h2], d1=d1, d2=d2, **attrs)
+
 
 class Quadruplet(Xplet):
     """A quadruplet is composed of two triplets having two hits (or one doublet) in common."""
@@ -193,3 +248,62 @@ class Quadruplet(Xplet):
     def doublets(self) -> List[Doublet]:
         """Return the ordered list of doublets composing this triplet."""
         return self.t1.doublets() + [self.t2.d2]
+
+    def detached_copy(self, t1: Triplet, t2: Triplet, **attrs):
+        """Copy this quadruplet, using `t1` and `t2` (copies of its own triplets) as triplets."""
+        return super().detached_copy(hits=t1.hits + [t2.hits[-1]], t1=t1, t2=t2, **attrs)
+
+
+class QuadrupletRecords(Sequence):
+    """
+    A read-only sequence of quadruplets stored as records (see :py:data:`qplet_record_dtype`).
+    The quadruplets are created on access and are neither kept nor connected to their triplets.
+    Use :py:meth:~`iter_records` to read the records without creating any quadruplet.
+    """
+
+    #: Number of records read at once, so that memory-mapped records are read block by block instead of being
+    #: loaded as a whole (see `scratch_dir` in :py:meth:`hepqpr.qallse.QallseBase.build_model`)
+    block_size = 1 << 16
+
+    def __init__(self, records: np.ndarray, triplets: List[Triplet], **columns: np.ndarray):
+        """
+        :param records: the records, an array of :py:data:`qplet_record_dtype` (can be memory-mapped)
+        :param triplets: the triplets of the model, indexed by the records
+        :param columns: extra attributes to set on the quadruplets, one value per record
+        """
+        self.records = records
+        self.triplets = triplets
+        self.columns = columns
+
+    def iter_blocks(self) -> Iterable[Tuple[int, np.ndarray]]:
+        """Iterate over the records by blocks of :py:attr:~`block_size`, as tuples `(offset, block)`."""
+        for start in range(0, len(self.records), self.block_size):
+            yield start, self.records[start:start + self.block_size]
+
+    def iter_records(self, *fields: str) -> Iterable[tuple]:
+        """Iterate over the given fields of the records (or extra columns), as tuples of Python values."""
+        for start, block in self.iter_blocks():
+            yield from zip(*[
+                (block[f] if f in qplet_record_dtype.names else self.columns[f][start:start + len(block)]).tolist()
+                for f in fields])
+
+    def _new_quadruplet(self, t1, t2, strength, *values):
+        qplet = Quadruplet(self.triplets[t1], self.triplets[t2])
+        qplet.strength = strength
+        qplet.__dict__.update(zip(self.columns.keys(), values))
+        return qplet
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return QuadrupletRecords(self.records[item], self.triplets,
+                                     **dict((k, v[item]) for k, v in self.columns.items()))
+        record = self.records[item]
+        return self._new_quadruplet(int(record['t1']), int(record['t2']), float(record['strength']),
+                                    *[v[item].item() for v in self.columns.values()])
+
+    def __iter__(self):
+        for values in self.iter_records('t1', 't2', 'strength', *self.columns.keys()):
+            yield self._new_quadruplet(*values)
@@ -1,11 +1,12 @@
-from typing import List, Optional, Union
+from typing import Iterable, List, Optional, Union
 
 import numpy as np
 import pandas as pd
 from trackml.score import score_event
 
+from .data_structures import Volayer
 from .type_alias import TQubo, TDimodSample, TXplet, XpletType, TDoublet
-from .utils import truth_to_xplets, track_to_xplets, diff_rows
+from .utils import truth_to_xplets, diff_rows, is_auxiliary_variable, AUXILIARY_PREFIX
 
 
 class DataWrapper:
@@ -29,10 +30,12 @@ class DataWrapper:
             df['idx'] = df.hit_id.values
             df.set_index('idx', inplace=True)
 
-        # add radius information
+        # add dense index, radius and volayer information
+        hits['hit_index'] = np.arange(len(hits))
         hits['r'] = np.linalg.norm(hits[['x', 'y']].values.T, axis=0)
+        hits['volayer'] = Volayer.get_indexes(hits.volume_id.values, hits.layer_id.values)
 
-        # keep a lookup of real doublets: '{hit_id_1}_{hit_id_2}' -> [hit_id_1, hit_id_2]
+        # keep a lookup of real doublets: (hit_id_1, hit_id_2) -> XpletType
         df = hits.join(truth, lsuffix='_')
         self._doublets = truth_to_xplets(hits, df[df.weight > 0], x=2)
         self._unfocused = truth_to_xplets(hits, df[df.weight == 0], x=2)
@@ -41,9 +44,24 @@ class DataWrapper:
             [(self._get_dkey(*d), XpletType.REAL) for d in self._doublets] +
             [(self._get_dkey(*d), XpletType.REAL_UNFOCUSED) for d in self._unfocused]
         )
+        # same lookup, by dense index: a hit has at most one real doublet starting from it (the next hit of its
+        # track), so it is enough to store the end of this doublet and its type
+        self._real_next, self._real_type = [-1] * len(hits), [XpletType.FAKE] * len(hits)
+        for (h1, h2), xplet_type in zip(self.get_hit_indexes(list(self._lookup.keys())).tolist(),
+                                        self._lookup.values()):
+            self._real_next[h1], self._real_type[h1] = h2, xplet_type
 
     def _get_dkey(self, h1, h2):
-        return f'{h1}_{h2}'
+        return int(h1), int(h2)
+
+    def get_hit_indexes(self, hit_ids: Union[List, np.ndarray]) -> np.ndarray:
+        """
+        Convert hit ids into dense indexes, i.e. positions (0 to N-1) in :py:attr:~`hits` (column `hit_index`).
+        Unknown ids give -1. The models use the dense indexes internally (see :py:meth:~`is_real_hits`),
+        the hit ids are only used in their outputs (xplet names, QUBO variables).
+        """
+        hit_ids = np.asarray(hit_ids, dtype=np.int64)
+        return self.hits.index.get_indexer(hit_ids.ravel()).reshape(hit_ids.shape)
 
     def get_unfocused_doublets(self) -> List[TDoublet]:
         return self._unfocused
@@ -58,30 +76,53 @@ class DataWrapper:
 
     def is_real_doublet(self, doublet: TDoublet) -> XpletType:
         """Test whether a doublet is real, i.e. part of a real track."""
-        key = self._get_dkey(*doublet)
-        return self._lookup.get(key, XpletType.FAKE)
+        return self._lookup.get((doublet[0], doublet[1]), XpletType.FAKE)
 
     def is_real_xplet(self, xplet: TXplet) -> XpletType:
         """Test whether an xplet is real, i.e. a sub-track of a real track."""
-        doublets = track_to_xplets(xplet, x=2)
-        if len(doublets) == 0:
+        if len(xplet) < 2:
             raise Exception(f'Got a subtrack with no doublets in it "{xplet}"')
 
-        xplet_type = set(self.is_real_doublet(s) for s in doublets)
-        return XpletType.FAKE if len(xplet_type) > 1 else xplet_type.pop()
+        # all doublets must be of the same type, else the xplet is fake
+        xplet_type = self._lookup.get((xplet[0], xplet[1]), XpletType.FAKE)
+        for i in range(1, len(xplet) - 1):
+            if xplet_type == XpletType.FAKE: break
+            if self._lookup.get((xplet[i], xplet[i + 1]), XpletType.FAKE) != xplet_type:
+                return XpletType.FAKE
+        return xplet_type
+
+    def is_real_hits(self, hits: List['Hit']) -> XpletType:
+        """
+        Same as :py:meth:~`is_real_xplet`, but for the hits of an xplet (see :py:class:`hepqpr.qallse.data_structures.Hit`).
+        The lookup uses their dense indexes (see :py:meth:~`get_hit_indexes`), which is much faster.
+        """
+        real_next, real_type = self._real_next, self._real_type
+        i, j = hits[0].hit_index, hits[1].hit_index
+        xplet_type = real_type[i] if real_next[i] == j else XpletType.FAKE
+        for h in hits[2:]:
+            if xplet_type == XpletType.FAKE: break
+            if real_next[j] != h.hit_index or real_type[j] != xplet_type:
+                return XpletType.FAKE
+            j = h.hit_index
+        return xplet_type
 
     # =============== QUBO and energy checking
 
     def sample_qubo(self, Q: TQubo) -> TDimodSample:
         """
         Compute the ideal solution for a given QUBO. Here, ideal means correct, but I doesn't guarantee that
-        the energy is minimal.
+        the energy is minimal. Auxiliary variables (see :py:data:`hepqpr.qallse.utils.AUXILIARY_PREFIX`) are
+        set if the xplet they stand for is real.
         """
+        return self.sample_variables(k1 for (k1, k2) in Q.keys() if k1 == k2)
+
+    def sample_variables(self, variables: Iterable[str]) -> TDimodSample:
+        """Compute the ideal value of the given variables, see :py:meth:`sample_qubo`."""
         sample = dict()
-        for (k1, k2), v in Q.items():
-            if k1 == k2:
-                subtrack = list(map(int, k1.split('_')))
-                sample[k1] = int(self.is_real_xplet(subtrack) != XpletType.FAKE)
+        for v in variables:
+            name = v[len(AUXILIARY_PREFIX):] if is_auxiliary_variable(v) else v
+            subtrack = list(map(int, name.split('_')))
+            sample[v] = int(self.is_real_xplet(subtrack) != XpletType.FAKE)
         return sample
 
     def compute_energy(self, Q: TQubo, sample: Optional[TDimodSample] = None) -> float:
@@ -157,15 +198,27 @@ class DataWrapper:
         """Encode a solution into a dataframe following the structure of a trackml submission."""
         hit_ids = self.hits.hit_id.values
         n_rows = len(hit_ids)
-        sub_data = np.column_stack(([event_id] * n_rows, hit_ids, np.zeros(n_rows)))
+        track_ids = np.zeros(n_rows)
+        if len(tracks):
+            indexes = self.get_hit_indexes(np.concatenate(tracks))
+            labels = np.repeat(np.arange(1, len(tracks) + 1), [len(t) for t in tracks])
+            track_ids[indexes[indexes >= 0]] = labels[indexes >= 0]
+        sub_data = np.column_stack(([event_id] * n_rows, hit_ids, track_ids))
         submission = pd.DataFrame(
             data=sub_data, columns=["event_id", "hit_id", "track_id"], index=hit_ids, dtype=int)
-        for idx, track in enumerate(tracks):
-            submission.loc[track, 'track_id'] = idx + 1
         return submission
 
     # =============== class utils
 
+    def subset(self, hit_ids: List[int]) -> 'DataWrapper':
+        """
+        Create a new wrapper restricted to the given hits, e.g. to mimic a subsampled event. The truth weights
+        are normalised again, so that the TrackML score of the subset ranges from 0 to 1.
+        """
+        hits, truth = self.hits.loc[hit_ids].copy(), self.truth.loc[hit_ids].copy()
+        truth.weight = truth.weight / truth.weight.sum()
+        return self.__class__(hits=hits, truth=truth)
+
     @classmethod
     def from_path(cls, path):
         """
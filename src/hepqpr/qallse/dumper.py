@@ -19,15 +19,54 @@ Example usage:
     xplets = dumper.xplets_to_serializable_dict(model)
     dumper.dump_xplets(xplets, format='json') # use json, so you can view the actual format
 
+QUBOs can be saved in three formats, chosen by the file extension (see :py:meth:`save_qubo` and :py:meth:`load_qubo`):
+
+* `.pickle`: the QUBO dictionary, pickled;
+* `.npz`: a numpy archive with the variable names (stored once), the int32 indexes of the variables of each entry
+  and the coefficients (float64 or float32). It can be compressed;
+* `.raw`: a directory with the same arrays as `.npy` files, that can be memory-mapped. To avoid building the QUBO
+  dictionary, load the arrays with :py:meth:`load_qubo_arrays`.
+
+Xplets can be saved as a dictionary (`pickle` or `json`, see :py:meth:`xplets_to_serializable_dict`) or as
+columns (`npz`, see :py:meth:`xplets_to_columns`). The columnar format contains all the xplets of the model and
+can be loaded back into a model with :py:meth:`load_model`:
+
+.. code::
+
+    dumper.dump_xplets(model, format='npz')
+    # later, without building the model again
+    model = dumper.load_model('xplets.npz', DataWrapper.from_path('/data/path/eventx'))
+    Q = model.to_qubo()
+
+Files can be written in the background with an :py:class:`AsyncWriter`, so that building the next model overlaps
+with writing the previous one:
+
+.. code::
+
+    with dumper.AsyncWriter() as writer:
+        for event in events:
+            model = QallseD0(DataWrapper.from_path(event))
+            model.build_model()
+            dumper.dump_model(model, prefix=f'{event}-', writer=writer)
+    # all the files are written here
+
 """
+import atexit
+import gc
+import io
 import json
+import os
 import pickle
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 from json import JSONEncoder
+from typing import Tuple, Union
 from os.path import join as path_join
 
 from .data_structures import *
 from .qallse_base import QallseBase
+from .utils import qubo_to_arrays, arrays_to_qubo
 
 
 # ---- custom Json encoder to handle special types
@@ -46,6 +85,38 @@ class _XpletsJsonEncoder(JSONEncoder):
 _default_opath = '.'
 _default_prefix = ''
 
+#: Supported QUBO formats (file extensions)
+qubo_formats = ['pickle', 'npz', 'raw']
+# names of the arrays in the npz and raw formats
+_qubo_arrays = ['names', 'rows', 'cols', 'values']
+
+
+# number of _gc_paused blocks currently entered, and whether the garbage collector was enabled before the first one
+_gc_pauses, _gc_was_enabled = 0, True
+
+
+@contextmanager
+def _gc_paused():
+    # Pause the garbage collector, which would otherwise run many times while creating or walking
+    # the (cyclic) xplets structures, without finding anything to collect.
+    # The collector is global to the process, so it is only paused on the main thread: a background writer
+    # (see AsyncWriter) must not pause it while the main thread builds models. Nested blocks are counted, so that
+    # only the outermost one enables the collector again.
+    global _gc_pauses, _gc_was_enabled
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    if _gc_pauses == 0:
+        _gc_was_enabled = gc.isenabled()
+        gc.disable()
+    _gc_pauses += 1
+    try:
+        yield
+    finally:
+        _gc_pauses -= 1
+        if _gc_pauses == 0 and _gc_was_enabled:
+            gc.enable()
+
 
 @contextmanager
 def use_markers(model, w_marker=None, c_marker='c'):
@@ -110,39 +181,345 @@ def xplets_to_serializable_dict(model):
     return dict(xplets)
 
 
-def dump_qubo(model, output_path=_default_opath, prefix=_default_prefix, **markers):
+def xplets_to_columns(model) -> Dict[str, np.ndarray]:
+    """
+    Convert all the xplets of a built model into tables of columns, one table per kind of xplet.
+    Xplets reference the hits, doublets or triplets they are made of by index, and the numeric attributes
+    shared by all the xplets of a table (geometry, weights, strengths...) are stored as columns.
+    The class and configuration of the model are stored as json in the `meta` array.
+
+    :param model: an implementation of :py:class:`hepqpr.qallse.QallseBase`, built
+    :return: a dictionary of arrays, named `<table>.<column>`, that can be saved with `numpy.savez`
     """
-    Pickle a QUBO using specific markers. See also :py:meth:`use_markers`. The default filename is
+    with _gc_paused():
+        return _xplets_to_columns(model)
+
+
+def _xplets_to_columns(model):
+    # with quadruplets records, the quadruplets are not connected to their triplets (see QallseBase.build_model)
+    if model.qplet_records is None:
+        quadruplets = list(dict.fromkeys([q for t in model.triplets for q in t.outer] + model.quadruplets))
+        selected = model.quadruplets
+    else:
+        # only the selected quadruplets are saved, created from the records (see QuadrupletRecords)
+        quadruplets = selected = list(model.quadruplets)
+    doublets_index = dict((d, i) for i, d in enumerate(model.doublets))
+    triplets_index = dict((t, i) for i, t in enumerate(model.triplets))
+    quadruplets_index = dict((q, i) for i, q in enumerate(quadruplets))
+
+    columns = {
+        'doublet.hits': np.array([(d.h1.hit_id, d.h2.hit_id) for d in model.doublets], dtype=np.int64),
+        'triplet.doublets': np.array([(doublets_index[t.d1], doublets_index[t.d2]) for t in model.triplets],
+                                     dtype=np.int32),
+        'quadruplet.triplets': np.array([(triplets_index[q.t1], triplets_index[q.t2]) for q in quadruplets],
+                                        dtype=np.int32),
+        'quadruplet.selected': np.array([quadruplets_index[q] for q in selected], dtype=np.int32),
+        'model.initial_doublets': np.asarray(model._initial_doublets, dtype=np.int64),
+        'model.hard_cuts_stats': np.array(model.hard_cuts_stats, dtype=str),
+    }
+    for table, xplets in [('doublet', model.doublets), ('triplet', model.triplets), ('quadruplet', quadruplets)]:
+        for column, values in _attributes_to_columns(xplets).items():
+            columns[f'{table}.{column}'] = values
+    if model.qplet_records is not None:
+        columns['model.qplet_records'] = np.asarray(model.qplet_records)
+
+    cls = type(model)
+    columns['meta'] = np.array(json.dumps(dict(
+        cls=f'{cls.__module__}.{cls.__qualname__}',
+        config=model.config.as_dict(),
+        qubo_budget_updates=model.qubo_budget_updates,
+    ), default=repr))
+    return columns
+
+
+def load_model(fname, dataw, model_class=None):
+    """
+    Load a model from xplets saved in the columnar format (see :py:meth:`xplets_to_columns`).
+    The xplets are restored with their attributes and connections, without recomputing their geometry or
+    applying the cuts again. The model is ready for :py:meth:`hepqpr.qallse.QallseBase.to_qubo`.
+
+    :param fname: the path to the `npz` file
+    :param dataw: the dataset of the event (the hits must be the ones used to build the model)
+    :param model_class: the class of the model. Default to the class of the model saved.
+    :return: a new model
+    """
+    with _gc_paused():
+        return _load_model(fname, dataw, model_class)
+
+
+def _load_model(fname, dataw, model_class):
+    import importlib
+    with np.load(fname) as npz:
+        columns = dict(npz.items())
+    meta = json.loads(str(columns['meta']))
+    if model_class is None:
+        module, _, name = meta['cls'].rpartition('.')
+        model_class = getattr(importlib.import_module(module), name)
+    model = model_class(dataw, **meta['config'])
+
+    xplet_columns = dict((table, dict()) for table in ['doublet', 'triplet', 'quadruplet'])
+    for name, values in columns.items():
+        table, _, column = name.partition('.')
+        if table in xplet_columns and column not in ['hits', 'doublets', 'triplets', 'selected']:
+            xplet_columns[table][column] = values
+
+    hits = model.hits
+    doublets = []
+    for (h1, h2), attrs in zip(columns['doublet.hits'].tolist(), _columns_to_attributes(xplet_columns['doublet'])):
+        h1, h2 = hits[h1], hits[h2]
+        d = _new_xplet(Doublet, [h1, h2], attrs, h1=h1, h2=h2)
+        h1.outer.append(d)
+        h2.inner.append(d)
+        doublets.append(d)
+
+    triplets = []
+    for (d1, d2), attrs in zip(columns['triplet.doublets'].tolist(), _columns_to_attributes(xplet_columns['triplet'])):
+        d1, d2 = doublets[d1], doublets[d2]
+        t = _new_xplet(Triplet, [d1.h1, d2.h1, d2.h2], attrs, d1=d1, d2=d2)
+        d1.outer.append(t)
+        d2.inner.append(t)
+        triplets.append(t)
+
+    connect = 'model.qplet_records' not in columns
+    quadruplets = []
+    for (t1, t2), attrs in zip(columns['quadruplet.triplets'].tolist(),
+                               _columns_to_attributes(xplet_columns['quadruplet'])):
+        t1, t2 = triplets[t1], triplets[t2]
+        q = _new_xplet(Quadruplet, t1.hits + [t2.hits[-1]], attrs, connected=False, t1=t1, t2=t2)
+        if connect:
+            t1.outer.append(q)
+            t2.inner.append(q)
+        quadruplets.append(q)
+
+    model.doublets, model.triplets = doublets, triplets
+    model.quadruplets = [quadruplets[i] for i in columns['quadruplet.selected'].tolist()]
+    model.qplet_records = columns.get('model.qplet_records')
+    model._initial_doublets = columns['model.initial_doublets']
+    model.hard_cuts_stats = columns['model.hard_cuts_stats'].tolist()
+    model.qubo_budget_updates = meta['qubo_budget_updates']
+    model._qplet_chunk_size, model._scratch_dir = None, None
+    model._qubo_parts, model._qubo_budget = None, None
+    # the configuration is the one the xplets were built with: nothing to rebuild (see QallseBase.rebuild)
+    model.config.pop_updated_stages(default=model.stages[0])
+    # the quadruplets left after the selection are the ones used in the QUBO
+    for qplet in model.quadruplets:
+        model._register_qubo_quadruplet(qplet)
+
+    model.logger.info(f'Model loaded from {fname}. doublets: {len(model.doublets)}/{len(model.qubo_doublets)}, '
+                      f'triplets: {len(model.triplets)}/{len(model.qubo_triplets)}, '
+                      f'quadruplets: {len(model.quadruplets)}')
+    return model
+
+
+def _attributes_to_columns(xplets) -> Dict[str, np.ndarray]:
+    # Convert the numeric attributes shared by all the xplets into columns. Structural attributes (hits, xplets,
+    # connections) and attributes that can't be stored in an array (e.g. tuples of varying shape) are skipped.
+    if len(xplets) == 0:
+        return dict()
+    names = set.intersection(*[set(x.__dict__.keys()) for x in xplets])
+    columns = dict()
+    for name in sorted(names):
+        if name in ['hits', 'h1', 'h2', 'd1', 'd2', 't1', 't2'] or name.startswith(('inner', 'outer')):
+            continue
+        try:
+            values = np.array([getattr(x, name) for x in xplets])
+        except ValueError:
+            continue
+        if values.dtype.kind in 'biuf':
+            columns[name] = values
+    return columns
+
+
+def _columns_to_attributes(columns: Dict[str, np.ndarray]):
+    # Inverse of _attributes_to_columns: yield a dictionary of attributes per xplet.
+    names = list(columns.keys())
+    # scalars are converted to python types, vectors are kept as numpy arrays (like coord_2d)
+    values = [columns[n].tolist() if columns[n].ndim == 1 else list(columns[n]) for n in names]
+    for row in zip(*values):
+        yield dict(zip(names, row))
+
+
+def _new_xplet(cls, hits, attrs, connected=True, **xplets):
+    # Create an xplet with the given hits, attributes and sub-xplets, without calling its constructor.
+    # If connected, also create the (empty) lists and sets of inner and outer xplets.
+    xplet = cls.__new__(cls)
+    xplet.hits = hits
+    if connected:
+        xplet.inner, xplet.outer = [], []
+        xplet.inner_kept, xplet.outer_kept = set(), set()
+    xplet.__dict__.update(xplets)
+    xplet.__dict__.update(attrs)
+    return xplet
+
+
+def serialize_xplets(model, format='pickle', **lib_kwargs) -> bytes:
+    """
+    Serialize the xplets of a model, in the format used by :py:meth:`dump_xplets`.
+
+    :param model: an implementation of :py:class:`hepqpr.qallse.QallseBase`, built
+    :param format: either `pickle`, `json` or `npz`
+    :param lib_kwargs: extra arguments to pass to json/pickle.
+    :return: the content of the xplets file
+    """
+    if format == 'pickle':
+        return pickle.dumps(xplets_to_serializable_dict(model), **lib_kwargs)
+    if format == 'json':
+        return json.dumps(xplets_to_serializable_dict(model), cls=_XpletsJsonEncoder, **lib_kwargs).encode()
+    if format == 'npz':
+        buffer = io.BytesIO()
+        np.savez(buffer, **xplets_to_columns(model))
+        return buffer.getvalue()
+    raise Exception(f'Unknown format: {format}')
+
+
+def dump_qubo(model, output_path=_default_opath, prefix=_default_prefix, format='pickle', **markers):
+    """
+    Save a QUBO using specific markers. See also :py:meth:`use_markers`. The default filename is
     `qubo.pickle`.
 
     :param model: an implementation of :py:class:`~hepqpr.qallse.QallseBase`
     :param output_path: the output directory
     :param prefix: a prefix to use in the filename
+    :param format: one of :py:attr:`qubo_formats`. Binary formats don't support markers.
     :param markers: see :py:meth:`use_markers`
     :return: the generated QUBO
     """
     with use_markers(model, **markers) as altered_model:
         Q = altered_model.to_qubo()
-        with open(path_join(output_path, prefix + 'qubo.pickle'), 'wb') as f:
-            pickle.dump(Q, f)
+        write_qubo(Q, output_path, prefix, format)
     return Q
 
+
+def write_qubo(Q, output_path=_default_opath, prefix=_default_prefix, format='pickle', **save_kwargs):
+    """
+    Save an existing QUBO, for example one loaded from a :py:class:`hepqpr.qallse.qubo_cache.QuboCache`.
+    The filename is the same as in :py:meth:`dump_qubo`.
+
+    :param Q: the QUBO
+    :param output_path: the output directory
+    :param prefix: a prefix to use in the filename
+    :param format: one of :py:attr:`qubo_formats`
+    :param save_kwargs: extra arguments to pass to :py:meth:`save_qubo`
+    :return: the path to the file
+    """
+    fname = path_join(output_path, f'{prefix}qubo.{format}')
+    save_qubo(Q, fname, **save_kwargs)
+    return fname
+
+
+def save_qubo(Q, fname, compress=False, dtype=np.float64):
+    """
+    Save a QUBO to a file. The format is chosen using the extension of `fname` (see :py:attr:`qubo_formats`).
+
+    :param Q: the QUBO
+    :param fname: the path to the file (or to the directory for the `raw` format)
+    :param compress: if set, compress the `npz` format (using zlib)
+    :param dtype: type of the coefficients in binary formats, `np.float64` or `np.float32`
+    """
+    write_serialized_qubo(serialize_qubo(Q, _qubo_format(fname), compress, dtype), fname)
+
+
+def serialize_qubo(Q, format='pickle', compress=False, dtype=np.float64) -> Union[bytes, Dict[str, np.ndarray]]:
+    """
+    Serialize a QUBO in the format used by :py:meth:`save_qubo`.
+
+    :param Q: the QUBO
+    :param format: one of :py:attr:`qubo_formats`
+    :param compress: see :py:meth:`save_qubo`
+    :param dtype: see :py:meth:`save_qubo`
+    :return: the content of the file, or the arrays of the `raw` format (one `.npy` file each)
+    """
+    if format == 'pickle':
+        return pickle.dumps(Q)
+    if format not in qubo_formats:
+        raise ValueError(f'Unknown QUBO format: {format}. Supported formats: {", ".join(qubo_formats)}')
+
+    try:
+        arrays = dict(zip(_qubo_arrays, qubo_to_arrays(Q, dtype=dtype)))
+    except (TypeError, ValueError) as err:
+        raise ValueError(f'The {format} format only supports numeric coefficients (no markers)') from err
+
+    if format == 'npz':
+        buffer = io.BytesIO()
+        (np.savez_compressed if compress else np.savez)(buffer, **arrays)
+        return buffer.getvalue()
+    if compress:
+        raise ValueError('The raw format can\'t be compressed, since it is memory-mappable')
+    return arrays
+
+
+def write_serialized_qubo(data, fname):
+    """Write the output of :py:meth:`serialize_qubo` to `fname`, for example from an :py:class:`AsyncWriter`."""
+    if isinstance(data, bytes):
+        with open(fname, 'wb') as f:
+            f.write(data)
+        return
+    os.makedirs(fname, exist_ok=True)
+    for name, array in data.items():
+        np.save(path_join(fname, name + '.npy'), array)
+
+
+def load_qubo(fname) -> TQubo:
+    """
+    Load a QUBO saved by :py:meth:`save_qubo`. The format is chosen using the extension of `fname`.
+
+    :param fname: the path to the file (or to the directory for the `raw` format)
+    :return: the QUBO
+    """
+    if _qubo_format(fname) == 'pickle':
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
+    return arrays_to_qubo(*load_qubo_arrays(fname))
+
+
+def load_qubo_arrays(fname, mmap_mode=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load a QUBO saved by :py:meth:`save_qubo` as arrays (see :py:meth:`hepqpr.qallse.utils.qubo_to_arrays`),
+    without building the dictionary, e.g. for :py:meth:`hepqpr.qallse.annealer.CsrQubo.from_arrays`.
+
+    :param fname: the path to the file (or to the directory for the `raw` format)
+    :param mmap_mode: for the `raw` format, memory-map the arrays instead of reading them
+        (see `numpy.load`). Ignored by the other formats.
+    :return: the variable names, the indexes of the first and second variable of each entry and the coefficients
+    """
+    format = _qubo_format(fname)
+    if format == 'pickle':
+        with open(fname, 'rb') as f:
+            return qubo_to_arrays(pickle.load(f))
+    if format == 'npz':
+        with np.load(fname) as npz:
+            return tuple(npz[name] for name in _qubo_arrays)
+    return tuple(np.load(path_join(fname, name + '.npy'), mmap_mode=mmap_mode) for name in _qubo_arrays)
+
+
+def _qubo_format(fname):
+    # Get the format of a QUBO file from its extension.
+    format = fname.rstrip('/\\').rsplit('.', 1)[-1]
+    if format not in qubo_formats:
+        raise ValueError(f'Unknown QUBO format: {fname}. Supported extensions: {", ".join(qubo_formats)}')
+    return format
+
+
 def dump_xplets(obj, output_path=_default_opath, prefix=_default_prefix,
                 format='pickle', **lib_kwargs):
     """
     Save the output of :py:meth:`xplets_to_serializable_dict` to disk.
 
-    :param obj: the dict of xplet or a Qallse model
+    :param obj: the dict of xplet, a Qallse model or the xplets already serialized in the given format
+        (bytes, see :py:meth:`serialize_xplets`)
     :param output_path: the output directory
     :param prefix: a prefix to use in the filename
-    :param format: either `pickle` or `json`
+    :param format: either `pickle`, `json` or `npz` (the latter only from a model or bytes)
     :param lib_kwargs: extra arguments to pass to json/pickle.
     """
     if isinstance(obj, QallseBase):
-        obj = xplets_to_serializable_dict(obj)
+        obj = serialize_xplets(obj, format, **lib_kwargs)
 
     fname = path_join(output_path, f'{prefix}xplets.{format}')
-    if format == 'pickle':
+    if isinstance(obj, bytes):
+        with open(fname, 'wb') as f:
+            f.write(obj)
+    elif format == 'pickle':
         with open(fname, 'wb') as f:
             pickle.dump(obj, f, **lib_kwargs)
     elif format == 'json':
@@ -153,12 +530,95 @@ def dump_xplets(obj, output_path=_default_opath, prefix=_default_prefix,
 
 
 def dump_model(model, output_path=_default_opath, prefix=_default_prefix,
-               xplets_kwargs=None, qubo_kwargs=None):
+               xplets_kwargs=None, qubo_kwargs=None, writer: 'AsyncWriter' = None):
     """
     Calls :py:meth:`dump_qubo` and :py:meth:`dump_xplets`.
+
+    If a writer is given, the QUBO and the xplets are generated and serialized on the calling thread, which holds
+    the GIL anyway: only the file writes are done by the writer, and overlap with what the caller does next.
+    The model can be modified as soon as this returns.
     """
-    kwargs = qubo_kwargs or dict()
-    Q = dump_qubo(model, output_path, prefix, **kwargs)
-    kwargs = xplets_kwargs or dict()
-    dump_xplets(model, output_path, prefix, **kwargs)
+    if writer is None:
+        kwargs = qubo_kwargs or dict()
+        Q = dump_qubo(model, output_path, prefix, **kwargs)
+        kwargs = xplets_kwargs or dict()
+        dump_xplets(model, output_path, prefix, **kwargs)
+        return Q
+
+    kwargs = dict(qubo_kwargs or dict())
+    format = kwargs.pop('format', 'pickle')
+    with use_markers(model, **kwargs) as altered_model:
+        Q = altered_model.to_qubo()
+    writer.submit(write_serialized_qubo, serialize_qubo(Q, format), path_join(output_path, f'{prefix}qubo.{format}'))
+    kwargs = dict(xplets_kwargs or dict())
+    xplets = serialize_xplets(model, **kwargs)
+    writer.submit(dump_xplets, xplets, output_path, prefix, format=kwargs.get('format', 'pickle'))
     return Q
+
+
+class AsyncWriter:
+    """
+    Write files in a background thread. Tasks are executed in order. When `max_pending` tasks are waiting,
+    :py:meth:`submit` blocks until one is done, bounding the memory held by the pending artefacts.
+
+    Pending tasks are always flushed: when exiting the `with` block (even on error), on :py:meth:`close` and
+    at interpreter exit.
+    """
+
+    def __init__(self, max_pending=4):
+        """
+        :param max_pending: maximum number of tasks submitted but not done yet
+        """
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qallse-writer')
+        self._slots = threading.Semaphore(max_pending)
+        self._futures = []
+        self._closed = False
+        atexit.register(self.close)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Schedule `fn(*args, **kwargs)`, for example `dump_xplets(serialize_xplets(model), ...)`. The function runs
+        in a thread: to overlap with the caller, it should mostly do I/O, which releases the GIL.
+
+        :return: a future, holding the result or the exception raised by `fn`
+        """
+        if self._closed:
+            raise RuntimeError('The writer is closed')
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+        return future
+
+    def flush(self):
+        """Wait for all the tasks submitted so far and raise the first exception, if any."""
+        futures, self._futures = self._futures, []
+        errors = [f.exception() for f in futures]
+        errors = [e for e in errors if e is not None]
+        if len(errors):
+            raise errors[0]
+
+    def close(self, raise_errors=True):
+        """Flush and stop the background thread. Calling it again does nothing."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if raise_errors:
+                self.flush()
+            else:
+                for f in self._futures: f.exception()
+        finally:
+            self._executor.shutdown(wait=True)
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # don't hide the original exception with a write error
+        self.close(raise_errors=exc_type is None)
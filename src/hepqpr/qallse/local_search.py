@@ -0,0 +1,233 @@
+"""
+This module contains two deterministic classical solvers, much cheaper than simulated annealing:
+
+* :py:class:`GreedySolver`: a steepest descent starting from the empty solution. It repeatedly applies the move
+  that decreases the energy the most, until no move decreases it. The moves are single flips and, since the linear
+  weights of the models are positive, the activation of both ends of an inclusion coupler. On the models' QUBOs,
+  this first turns on the pairs of triplets with the strongest quadruplets, then follows the tracks: the inclusion
+  couplers make the neighbours of the selected triplets more and more attractive, and the conflicts keep their
+  rivals out.
+  With `qubo_conflict_mode='star'` (see :py:class:`hepqpr.qallse.qallse.Config`), a triplet is only worth turning
+  on together with the auxiliary variables of its doublets: the moves turning variables on also turn on their
+  auxiliary neighbours, if it decreases the energy (i.e. if no conflicting auxiliary variable is set).
+* :py:class:`TabuSolver`: a tabu search starting from the greedy solution (or any initial state). At each
+  iteration, it applies the best single flip, even if it increases the energy, but a flipped variable cannot be
+  flipped back for `tenure` iterations, unless it leads to a new best solution (aspiration).
+
+Both keep the local fields of the variables up to date incrementally (see :py:class:`hepqpr.qallse.annealer.CsrQubo`),
+so a flip only costs a pass over the couplers of the flipped variable.
+
+Example usage:
+
+.. code::
+
+    response = GreedySolver().sample_qubo(Q)
+    response = TabuSolver().sample_qubo(Q, max_stall=1000)
+    final_doublets, final_tracks = process_response(response)
+
+The responses are `dimod.SampleSet` with one sample.
+"""
+
+import heapq
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Union
+
+import numpy as np
+
+from .annealer import CsrQubo
+from .type_alias import *
+from .utils import find_auxiliary_variables
+
+logger = logging.getLogger(__name__)
+
+
+class LocalSearchSolver(ABC):
+    """Base class of the local search solvers."""
+
+    def sample_qubo(self, Q: Union[TQubo, CsrQubo], **kwargs):
+        """
+        Solve a QUBO. See :py:meth:`sample` for the parameters.
+
+        :param Q: the QUBO, as a dictionary or a :py:class:`hepqpr.qallse.annealer.CsrQubo`
+        :return: a `dimod.SampleSet` with one sample
+        """
+        if not isinstance(Q, CsrQubo):
+            Q = CsrQubo.from_qubo(Q)
+        return self.sample(Q, **kwargs)
+
+    def sample(self, csr: CsrQubo, **kwargs):
+        """
+        Solve a QUBO.
+
+        :param csr: the QUBO
+        :return: a `dimod.SampleSet` with one sample
+        """
+        import dimod
+        start_time = time.process_time()
+        x, info = self._solve(csr, **kwargs)
+        energy = csr.energies(x[np.newaxis])[0]
+        exec_time = time.process_time() - start_time
+        logger.debug(f'{type(self).__name__} done in {exec_time:.2f}s, energy: {energy:.4f}, {info}.')
+        return dimod.SampleSet.from_samples((x[np.newaxis], csr.variables), dimod.BINARY, [energy], info=info)
+
+    @abstractmethod
+    def _solve(self, csr: CsrQubo, **kwargs):
+        # [ABSTRACT] Return the solution (an int8 array) and a dictionary of info about the run.
+        pass
+
+    def _flip(self, csr: CsrQubo, x: np.ndarray, fields: np.ndarray, i: int) -> slice:
+        # Flip x[i], update the local fields of its neighbours and return their position in the CSR arrays.
+        diff = 1 - 2 * int(x[i])
+        x[i] ^= 1
+        row = slice(csr.indptr[i], csr.indptr[i + 1])
+        # a neighbour can appear several times if the QUBO has both (i, j) and (j, i)
+        np.add.at(fields, csr.indices[row], diff * csr.data[row])
+        return row
+
+
+class GreedySolver(LocalSearchSolver):
+    """Steepest descent from the empty solution, see the module documentation."""
+
+    def sample(self, csr: CsrQubo, max_flips=None, auxiliary=None):
+        """
+        Solve a QUBO.
+
+        :param csr: the QUBO
+        :param max_flips: stop after that many flips. Default to no limit.
+        :param auxiliary: the names of the auxiliary variables, turned on along with their neighbours, for example
+            :py:meth:`hepqpr.qallse.QallseBase.auxiliary_variables`. Default to the auxiliary variables of the
+            `star` conflict mode found in the QUBO (see :py:meth:`hepqpr.qallse.utils.find_auxiliary_variables`).
+        :return: a `dimod.SampleSet` with one sample
+        """
+        return super().sample(csr, max_flips=max_flips, auxiliary=auxiliary)
+
+    def _solve(self, csr: CsrQubo, max_flips=None, auxiliary=None):
+        n = len(csr)
+        x = np.zeros(n, dtype=np.int8)
+        fields = csr.linear.copy()
+
+        # couplers (summing the duplicates, e.g. both (i, j) and (j, i))
+        couplers = dict()
+        rows = np.repeat(np.arange(n), np.diff(csr.indptr))
+        for i, j, v in zip(rows.tolist(), csr.indices.tolist(), csr.data.tolist()):
+            if i < j: couplers[(i, j)] = couplers.get((i, j), 0) + v
+        if auxiliary is None:
+            auxiliary = find_auxiliary_variables((csr.variables[i], csr.variables[j]) for (i, j) in couplers.keys())
+        auxiliary = set(auxiliary)
+        is_aux = np.array([v in auxiliary for v in csr.variables], dtype=bool)
+        # partners: inclusion couplers between regular variables, helpers: inclusion couplers to auxiliary variables
+        partners, helpers = [[] for _ in range(n)], [[] for _ in range(n)]
+        for (i, j), v in couplers.items():
+            if v >= 0 or is_aux[i] and is_aux[j]:
+                continue
+            if is_aux[i] or is_aux[j]:
+                i, j = (j, i) if is_aux[i] else (i, j)
+                helpers[i].append((j, v))
+            else:
+                partners[i].append(j)
+                partners[j].append(i)
+
+        def _coupler(i, j):
+            return couplers.get((min(i, j), max(i, j)), 0)
+
+        def _move(i, j):
+            # energy change and variables flipped by flipping i, or by turning on both i and j (j >= 0).
+            # Regular variables are turned on along with the auxiliary variables they make favourable.
+            if j < 0 and (x[i] or is_aux[i]): return (1 - 2 * int(x[i])) * fields[i], [i]
+            if j >= 0 and (x[i] or x[j]): return np.inf, []
+            flipped = [i] if j < 0 else [i, j]
+            delta = fields[i] if j < 0 else fields[i] + fields[j] + _coupler(i, j)
+            aux_fields = dict()
+            for k in flipped:
+                for a, v in helpers[k]:
+                    if not x[a]: aux_fields[a] = aux_fields.get(a, fields[a]) + v
+            for a in sorted(aux_fields):
+                # the auxiliary variables of a move can conflict with each other
+                field = aux_fields[a] + sum(_coupler(a, b) for b in flipped if is_aux[b])
+                if field < 0:
+                    delta += field
+                    flipped.append(a)
+            return delta, flipped
+
+        def _push(i):
+            # (re)schedule the moves involving i, if they decrease the energy
+            for j in [-1] + partners[i]:
+                delta, _ = _move(i, j)
+                if delta < 0: heapq.heappush(heap, (delta, i, j))
+
+        heap = []
+        for i in range(n):
+            _push(i)
+        n_flips = 0
+        while len(heap) and (max_flips is None or n_flips < max_flips):
+            delta, i, j = heapq.heappop(heap)
+            current, flipped = _move(i, j)
+            if delta != current:
+                continue  # outdated, the up-to-date move was pushed when the fields changed
+            neighbours = set()
+            for k in flipped:
+                neighbours.update(csr.indices[self._flip(csr, x, fields, k)].tolist())
+                neighbours.add(k)
+            # the moves of a variable also depend on the fields of its auxiliary variables
+            for k in [k for k in neighbours if is_aux[k]]:
+                neighbours.update(csr.indices[csr.indptr[k]:csr.indptr[k + 1]].tolist())
+            n_flips += len(flipped)
+            for k in neighbours:
+                _push(k)
+        return x, dict(num_flips=n_flips, num_auxiliary=int(is_aux.sum()))
+
+
+class TabuSolver(LocalSearchSolver):
+    """Tabu search, see the module documentation."""
+
+    def sample(self, csr: CsrQubo, initial_state=None, tenure=None, max_iter=None, max_stall=None):
+        """
+        Solve a QUBO.
+
+        :param csr: the QUBO
+        :param initial_state: the start solution, as a sample or an array of 0/1 in the order of `csr.variables`
+            (see :py:meth:`hepqpr.qallse.annealer.CsrQubo.states_to_array`). Default to the solution of
+            :py:class:`GreedySolver`.
+        :param tenure: the number of iterations a flipped variable is tabu. Default to min(20, n/4), with n the
+            number of variables.
+        :param max_iter: the maximum number of iterations. Default to 100 times the number of variables.
+        :param max_stall: stop after that many iterations without improvement of the best solution.
+            Default to the number of variables.
+        :return: a `dimod.SampleSet` with the best sample found
+        """
+        return super().sample(csr, initial_state=initial_state, tenure=tenure, max_iter=max_iter,
+                              max_stall=max_stall)
+
+    def _solve(self, csr: CsrQubo, initial_state=None, tenure=None, max_iter=None, max_stall=None):
+        n = len(csr)
+        if tenure is None: tenure = max(1, min(20, n // 4))
+        if max_iter is None: max_iter = 100 * n
+        if max_stall is None: max_stall = n
+
+        if initial_state is None:
+            initial_state, _ = GreedySolver()._solve(csr)
+        x = csr.states_to_array(initial_state, 1)[0]
+        fields = csr.local_fields(x[np.newaxis])[0]
+        energy = best_energy = csr.energies(x[np.newaxis])[0]
+        best_x = x.copy()
+        tabu_until = np.zeros(n, dtype=np.int64)
+
+        it, last_improvement = 0, 0
+        while n > 0 and it < max_iter and it - last_improvement < max_stall:
+            delta = (1 - 2 * x) * fields
+            # tabu moves are only allowed if they lead to a new best solution (aspiration)
+            forbidden = (tabu_until > it) & (energy + delta >= best_energy - 1e-12)
+            delta[forbidden] = np.inf
+            i = int(np.argmin(delta))
+            if np.isinf(delta[i]):
+                break  # everything is tabu
+            energy += delta[i]
+            self._flip(csr, x, fields, i)
+            tabu_until[i] = it + tenure + 1
+            it += 1
+            if energy < best_energy - 1e-12:
+                best_energy, best_x[:], last_improvement = energy, x, it
+
+        return best_x, dict(num_iterations=it, tenure=tenure)
@@ -7,7 +7,7 @@ def filter_doublets(hits, doublets, max_holes):
     doublets = doublets.copy()
 
     # compute doublet spans
-    hits['volayer'] = hits[['volume_id', 'layer_id']].apply(lambda serie: Volayer.get_index(serie.tolist()), axis=1)
+    hits['volayer'] = Volayer.get_indexes(hits.volume_id.values, hits.layer_id.values)
     doublets['span'] = hits.volayer.get(doublets.end).values - hits.volayer.get(doublets.start).values
 
     # filter
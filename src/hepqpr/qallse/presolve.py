@@ -0,0 +1,198 @@
+"""
+This module contains an exact preprocessing of QUBOs, to apply between :py:meth:`hepqpr.qallse.QallseBase.to_qubo`
+and a sampler. It removes the variables whose optimal value can be deduced from the coefficients, so that the
+sampler gets a smaller residual QUBO. The samples of the residual QUBO are then expanded back into samples of the
+original QUBO, with the same energy.
+
+Example usage:
+
+.. code::
+
+    presolver = QuboPresolver(Q)
+    residual = presolver.presolve()
+    response = SimulatedAnnealingSampler().sample_qubo(residual)
+    response = presolver.expand_response(response)
+    print(response.info['presolve'])  # e.g. {'variables': 7544, 'removed': 297, 'fixed': 297, 'merged': 0}
+
+Two reductions are applied until none is possible (see Boros & Hammer, *Pseudo-Boolean optimization*, 2002):
+
+* *fixing*: with `a_i` the linear coefficient of `x_i` and `b_ij` its couplers, the energy never increases when
+  setting `x_i = 0` if `a_i + Σ min(0, b_ij) >= 0`, nor when setting `x_i = 1` if `a_i + Σ max(0, b_ij) <= 0`.
+  For example, a triplet with only inclusion (negative) couplers is always part of the solution.
+* *contraction*: if `x_i` can be set to 1 when `x_j = 1` and to 0 when `x_j = 0` (same criteria, restricted to
+  the couplers other than `b_ij`), then `x_i = x_j` in an optimal solution and `x_i` is merged into `x_j`.
+  This merges chains of triplets without conflicts into single variables.
+
+There is always an optimal solution of the original QUBO that respects all the reductions, so the optimal energy
+is unchanged.
+
+On the QUBOs of the models, the reduction is modest: a few percent of the variables are fixed (e.g. 297 of 7544
+for QallseMp on a dense event), and merges are rare since most triplets have conflicts.
+"""
+
+import logging
+import time
+from typing import Dict
+
+from .type_alias import *
+
+logger = logging.getLogger(__name__)
+
+
+class QuboPresolver:
+    """Reduce a QUBO by fixing and merging variables, and expand samples of the residual QUBO."""
+
+    def __init__(self, Q: TQubo):
+        """
+        :param Q: the QUBO to reduce
+        """
+        self.Q = Q
+        #: Constant energy of the reductions, to add to the energy of the residual QUBO
+        self.offset = 0
+        #: Fixed variables, mapped to their value
+        self.fixed: Dict[str, int] = dict()
+        #: Merged variables, mapped to the variable they are equal to
+        self.merged: Dict[str, str] = dict()
+        #: Number of variables of the original QUBO
+        self.n_variables = 0
+
+    def presolve(self) -> TQubo:
+        """
+        Apply the reductions.
+
+        :return: the residual QUBO, only containing the variables that are neither fixed nor merged.
+        """
+        start_time = time.process_time()
+        self.offset, self.fixed, self.merged = 0, dict(), dict()
+
+        # linear coefficients and adjacency (with symmetric couplers)
+        self._linear, self._adj = dict(), dict()
+        for (k1, k2), v in self.Q.items():
+            for k in (k1, k2):
+                if k not in self._adj:
+                    self._linear[k], self._adj[k] = 0, dict()
+            if k1 == k2:
+                self._linear[k1] += v
+            else:
+                self._adj[k1][k2] = self._adj[k1].get(k2, 0) + v
+                self._adj[k2][k1] = self._adj[k1][k2]
+        self.n_variables = len(self._adj)
+
+        queue, queued = list(self._adj.keys()), set(self._adj.keys())
+        while len(queue):
+            var = queue.pop()
+            queued.discard(var)
+            neighbours = self._reduce(var)
+            for n in neighbours:
+                if n not in queued:
+                    queue.append(n)
+                    queued.add(n)
+
+        # residual QUBO
+        residual = dict()
+        for k, couplers in self._adj.items():
+            residual[(k, k)] = self._linear[k]
+            for k2, v in couplers.items():
+                if (k2, k) not in residual:
+                    residual[(k, k2)] = v
+        del self._linear, self._adj
+
+        exec_time = time.process_time() - start_time
+        logger.info(f'QUBO presolved in {exec_time:.2f}s. Size: {len(self.Q)} -> {len(residual)}, '
+                    f'variables: {self.n_variables} -> {self.n_variables - len(self.fixed) - len(self.merged)}, '
+                    f'fixed: {len(self.fixed)}, merged: {len(self.merged)}, offset: {self.offset}')
+        return residual
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """
+        The size reduction of the last call to :py:meth:~`presolve`: the number of variables of the original QUBO,
+        the number of variables removed, and how many of them were fixed and merged.
+        """
+        return dict(variables=self.n_variables, removed=len(self.fixed) + len(self.merged),
+                    fixed=len(self.fixed), merged=len(self.merged))
+
+    def expand_sample(self, sample: TDimodSample) -> TDimodSample:
+        """
+        Expand a sample of the residual QUBO into a sample of the original QUBO.
+
+        :param sample: the sample of the residual QUBO, behaving like a dictionary
+        :return: the sample of the original QUBO, as a dictionary
+        """
+        full = dict(sample)
+        full.update(self.fixed)
+        for var in self.merged.keys():
+            self._expand(var, full)
+        return full
+
+    def expand_response(self, response):
+        """
+        Expand all the samples of a response of the residual QUBO, adding the constant offset to the energies.
+        The info of the response is kept, and the size reduction (see :py:attr:~`stats`) is added as `presolve`.
+
+        :param response: a `dimod.SampleSet`
+        :return: a `dimod.SampleSet` for the original QUBO
+        """
+        import dimod
+        samples, energies, occurrences = [], [], []
+        for sample, energy, num_occurrences in response.data(['sample', 'energy', 'num_occurrences']):
+            samples.append(self.expand_sample(sample))
+            energies.append(energy + self.offset)
+            occurrences.append(num_occurrences)
+        return dimod.SampleSet.from_samples(samples, dimod.BINARY, energies, num_occurrences=occurrences,
+                                            info=dict(response.info, presolve=self.stats))
+
+    # ---------------------------------------------
+
+    def _reduce(self, var):
+        # Try to fix or merge var. Return the neighbours of var if a reduction was applied, an empty list otherwise.
+        if var not in self._adj:
+            return []
+        a, couplers = self._linear[var], self._adj[var]
+        neg = sum(v for v in couplers.values() if v < 0)
+        pos = sum(v for v in couplers.values() if v > 0)
+
+        if a + neg >= 0:
+            return self._fix(var, 0)
+        if a + pos <= 0:
+            return self._fix(var, 1)
+        for other, v in couplers.items():
+            # var = 1 when other = 1, var = 0 when other = 0
+            if v < 0 and a + v + pos <= 0 and a + neg - v >= 0:
+                return self._merge(var, other)
+        return []
+
+    def _fix(self, var, value):
+        # Remove var from the QUBO, substituting its value.
+        couplers = self._adj.pop(var)
+        for other, v in couplers.items():
+            del self._adj[other][var]
+            self._linear[other] += v * value
+        self.offset += self._linear.pop(var) * value
+        self.fixed[var] = value
+        return list(couplers.keys())
+
+    def _merge(self, var, into):
+        # Remove var from the QUBO, substituting x_var = x_into.
+        couplers = self._adj.pop(var)
+        self._linear[into] += self._linear.pop(var) + couplers.pop(into)
+        del self._adj[into][var]
+        for other, v in couplers.items():
+            del self._adj[other][var]
+            merged = self._adj[into].get(other, 0) + v
+            if merged == 0:
+                self._adj[into].pop(other, None)
+                self._adj[other].pop(into, None)
+            else:
+                self._adj[into][other] = self._adj[other][into] = merged
+        self.merged[var] = into
+        return list(couplers.keys()) + [into]
+
+    def _expand(self, var, full):
+        # Set the value of a merged variable (and of the variables it is merged into) in the full sample.
+        chain = []
+        while var not in full:
+            chain.append(var)
+            var = self.merged[var]
+        for v in chain:
+            full[v] = full[var]
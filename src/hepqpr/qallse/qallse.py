@@ -1,11 +1,25 @@
+import bisect
+import itertools
+from typing import Optional
+
 import pandas as pd
 
 from .data_structures import *
 from .qallse_base import ConfigBase, QallseBase
-from .utils import pd_read_csv_array
+from .utils import pd_read_csv_array, angle_diff, AUXILIARY_PREFIX
 
 
 class Config(ConfigBase):
+    _stages = dict(
+        max_layer_span='doublets', prune_doublets='doublets',
+        tplet_max_curv='triplets', tplet_max_drz='triplets',
+        qplet_max_dcurv='quadruplets', qplet_max_strength='quadruplets',
+        num_multiplier='quadruplets', xy_relative_strength='quadruplets', xy_power='quadruplets',
+        rz_power='quadruplets', volayer_power='quadruplets', strength_bounds='quadruplets',
+        qubo_bias_weight='qubo_weights', qubo_conflict_strength='qubo_conflicts',
+        qubo_conflict_mode='qubo_conflicts', qubo_conflict_aux_bias='qubo_conflicts',
+    )
+
     cheat = False
 
     # === Hard cut
@@ -15,6 +29,12 @@ class Config(ConfigBase):
     #: any xplet will at most miss (max_layer_span - 1) layers
     max_layer_span = 2
 
+    #: If set, doublets that can't be part of any quadruplet, i.e. of a chain of three doublets within the
+    #: layer span and `tplet_max_drz` limits, are removed before creating the triplets. They would only
+    #: produce triplets that are never used in the QUBO. Real doublets removed this way are reported in the
+    #: hard cuts stats.
+    prune_doublets = False
+
     #: Maximum radius of curvature for a triplet. The curvature is computed using
     #: the *Mengel curvature*.
     tplet_max_curv = 5E-3
@@ -33,6 +53,16 @@ class Config(ConfigBase):
     #: Quadratic coupling strength associated to two conflicting triplets in the QUBO.
     #: Set it to 1 (other things being equal) to avoid conflicts.
     qubo_conflict_strength = 1
+    #: Formulation of the exclusion couplers. With `pairs`, all the pairs of triplets using conflicting doublets
+    #: (two inner or two outer doublets of the same hit) are coupled. With `star`, each conflicting doublet gets an
+    #: auxiliary variable, named like the doublet with the prefix :py:data:`hepqpr.qallse.utils.AUXILIARY_PREFIX`,
+    #: that should be set when one of its triplets is. Only the
+    #: auxiliary variables of a hit are coupled together, and each triplet is coupled to the auxiliary variables of
+    #: its doublets. This needs far fewer couplers, and conflict-free samples keep the same energy (plus the
+    #: bias of the auxiliary variables).
+    qubo_conflict_mode = 'pairs'
+    #: Linear weight of the auxiliary variables of the `star` conflict mode, so that unused doublets are not set.
+    qubo_conflict_aux_bias = 0.01
 
     # === strength computation
 
@@ -51,6 +81,12 @@ class Config(ConfigBase):
     #: value of the bound.
     strength_bounds = None
 
+    def pop_updated_stages(self, default: str):
+        # when doublets are pruned, they also depend on the R-Z angle cut of triplets
+        if self.prune_doublets and 'tplet_max_drz' in self._updated:
+            self._updated = self._updated | {'prune_doublets'}
+        return super().pop_updated_stages(default)
+
 
 class Config1GeV(Config):
     tplet_max_curv = 8E-4  # (vs 5E-3)
@@ -61,6 +97,8 @@ class Config1GeV(Config):
 class Qallse(QallseBase):
     config: Config  # for proper autocompletion in PyCharm
 
+    qubo_budget_steps = [dict(qplet_max_strength=s) for s in [-0.25, -0.3, -0.35, -0.4, -0.5]]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -78,6 +116,12 @@ class Qallse(QallseBase):
         super().build_model(*args, **kwargs)
         # add stats information to the logs
         self.log_build_stats()
+        return self
+
+    def rebuild(self, *args, **kwargs):
+        ret = super().rebuild(*args, **kwargs)
+        self.log_build_stats()
+        return ret
 
     def log_build_stats(self):
         """ Log information about real doublets/triplets/quadruplets dropped during model building"""
@@ -93,13 +137,160 @@ class Qallse(QallseBase):
 
     # --------------- early cuts
 
+    def _prune_doublets(self):
+        # Remove the doublets that are not part of a chain of three doublets, where each pair of consecutive
+        # doublets respects the layer span and R-Z angle cuts of triplets (see _is_invalid_triplet). A doublet is
+        # part of such a chain if it has both an inner and an outer continuation (middle), or if one of its
+        # continuations is a middle. Removed doublets are part of no chain, so removing them can't break one:
+        # there is no need to iterate.
+        if not self.config.prune_doublets or len(self.doublets) == 0:
+            return
+
+        hit_ids = np.array([(d.h1.hit_id, d.h2.hit_id) for d in self.doublets])
+        volayers = np.array([(d.h1.volayer, d.h2.volayer) for d in self.doublets])
+        rz_angles = np.array([d.rz_angle for d in self.doublets])
+
+        # all pairs of consecutive doublets (a, b), i.e. the triplets that could be created
+        by_start = np.argsort(hit_ids[:, 0], kind='stable')
+        lo = np.searchsorted(hit_ids[by_start, 0], hit_ids[:, 1], side='left')
+        hi = np.searchsorted(hit_ids[by_start, 0], hit_ids[:, 1], side='right')
+        a = np.repeat(np.arange(len(self.doublets)), hi - lo)
+        b = by_start[np.arange(len(a)) - np.repeat(np.cumsum(hi - lo) - (hi - lo), hi - lo) + np.repeat(lo, hi - lo)]
+
+        delta_rz = np.abs(rz_angles[b] - rz_angles[a])
+        delta_rz = np.where(delta_rz <= np.pi, delta_rz, 2 * np.pi - delta_rz)  # see angle_diff
+        valid = (volayers[b, 1] - volayers[a, 0] <= self.config.max_layer_span + 1) & \
+                (delta_rz <= self.config.tplet_max_drz)
+        a, b = a[valid], b[valid]
+
+        n_inner = np.bincount(b, minlength=len(self.doublets))
+        n_outer = np.bincount(a, minlength=len(self.doublets))
+        middles = (n_inner > 0) & (n_outer > 0)
+        kept = middles.copy()
+        kept[a[middles[b]]] = True
+        kept[b[middles[a]]] = True
+
+        doublets, n_real = [], 0
+        for d, keep, n_in, n_out in zip(self.doublets, kept.tolist(), n_inner.tolist(), n_outer.tolist()):
+            if keep:
+                doublets.append(d)
+            elif self.dataw.is_real_hits(d.hits) == XpletType.REAL:
+                self.hard_cuts_stats.append(f'dblet,{d},pruned,{n_in},{n_out}')
+                n_real += 1
+                if self.config.cheat:
+                    doublets.append(d)
+
+        kept = set(doublets)
+        for h in self.hits.values():
+            h.inner = [d for d in h.inner if d in kept]
+            h.outer = [d for d in h.outer if d in kept]
+
+        self.logger.info(f'pruned {len(self.doublets) - len(doublets)} doublets ({n_real} real).')
+        self.doublets = doublets
+
+    def _create_triplets(self):
+        # outer doublets indexed by direction, see _triplet_candidates
+        self._outer_index = dict()
+        super()._create_triplets()
+        self._outer_index = None
+
+    def _triplet_candidates(self, d1: Doublet) -> List[Doublet]:
+        # Only return the doublets compatible with the triplet cuts (see _is_invalid_triplet) using an index of
+        # each hit's outer doublets sorted by direction in the X-Y plane. Since the curvature is
+        # 2*sin(θ)/|h1h3|, with θ the angle between the two doublets and |h1h3| <= |d1| + |d2|, the triplet is
+        # discarded if |sin(θ)| > tplet_max_curv * (|d1| + max |d2|) / 2. Doublets are also filtered on their
+        # R-Z angle (tplet_max_drz) and layer span.
+        # If d1 is real, all doublets are returned so that the hard cuts stats and the cheat mode are unchanged.
+        outer = d1.h2.outer
+        if len(outer) < 4 or self.dataw.is_real_hits(d1.hits) == XpletType.REAL:
+            return outer
+
+        index = self._outer_index.get(d1.h2)
+        if index is None:
+            angles = [math.atan2(d.coord_2d[1], d.coord_2d[0]) for d in outer]
+            order = sorted(range(len(outer)), key=angles.__getitem__)
+            max_length = max(math.hypot(*d.coord_2d) for d in outer)
+            index = self._outer_index[d1.h2] = ([angles[i] for i in order], order, max_length)
+        angles, order, max_length = index
+
+        # add a small margin, so that rounding errors never discard a valid triplet
+        max_sin = 1.001 * self.config.tplet_max_curv * (math.hypot(*d1.coord_2d) + max_length) / 2
+        if max_sin >= 1:
+            positions = order
+        else:
+            phi, max_angle = math.atan2(d1.coord_2d[1], d1.coord_2d[0]), math.asin(max_sin) + 1e-9
+            positions = []
+            for center in [phi, phi + math.pi]:  # θ close to 0 or to π
+                lo = (center - max_angle + math.pi) % (2 * math.pi) - math.pi
+                hi = lo + 2 * max_angle
+                positions += order[bisect.bisect_left(angles, lo):bisect.bisect_right(angles, hi)]
+                if hi > math.pi:
+                    positions += order[:bisect.bisect_right(angles, hi - 2 * math.pi)]
+
+        max_drz = self.config.tplet_max_drz + 1e-9
+        max_volayer = d1.h1.volayer + self.config.max_layer_span + 1
+        candidates = (outer[i] for i in sorted(set(positions)))
+        return [d2 for d2 in candidates
+                if angle_diff(d1.rz_angle, d2.rz_angle) <= max_drz and d2.h2.volayer <= max_volayer]
+
+    def _create_quadruplets(self, *args, **kwargs):
+        # outer triplets indexed by curvature, see _quadruplet_candidates
+        self._curvature_index, self._curvature_window = dict(), self._max_candidate_dcurv()
+        super()._create_quadruplets(*args, **kwargs)
+        self._curvature_index = None
+
+    def _create_quadruplet_records(self, *args, **kwargs):
+        self._curvature_index, self._curvature_window = dict(), self._max_candidate_dcurv()
+        records = super()._create_quadruplet_records(*args, **kwargs)
+        self._curvature_index = None
+        return records
+
+    def _max_candidate_dcurv(self) -> Optional[float]:
+        # Return a delta curvature above which a fake quadruplet is always discarded by _is_invalid_quadruplet,
+        # or None if it can't be derived from the configuration.
+        # Fake quadruplets are only discarded by the strength cut. With a negative num_multiplier, the strength is
+        # at least num_multiplier * (a * xy_strength + 1 - a), with a = xy_relative_strength, since rz_strength <= 1
+        # and the denominator is >= 1 (doublets always go outwards, except the real ones kept in cheat mode).
+        # This bound exceeds qplet_max_strength as soon as xy_strength < xy_max, i.e. as soon as
+        # delta_curvature > qplet_max_dcurv * (1 - xy_max) ** (1 / xy_power). With the defaults, this is
+        # 1.6 * qplet_max_dcurv.
+        c = self.config
+        if c.cheat or c.strength_bounds is not None or c.num_multiplier >= 0 or c.qplet_max_strength >= 0 or \
+                not 0 < c.xy_relative_strength <= 1 or c.xy_power <= 0 or c.rz_power < 0 or c.volayer_power < 0:
+            return None
+        xy_max = (c.qplet_max_strength / c.num_multiplier - (1 - c.xy_relative_strength)) / c.xy_relative_strength
+        if xy_max >= 1:
+            return None
+        return c.qplet_max_dcurv * (1 - xy_max) ** (1 / c.xy_power)
+
+    def _quadruplet_candidates(self, t1: Triplet) -> List[Triplet]:
+        # Only return the triplets that could form a quadruplet with t1 (see _max_candidate_dcurv), using a binary
+        # search in the outer triplets of t1.d2 sorted by curvature.
+        # If t1 is real, all triplets are returned so that the hard cuts stats and the cheat mode are unchanged.
+        outer = t1.d2.outer
+        if len(outer) < 4 or self._curvature_window is None or \
+                self.dataw.is_real_hits(t1.hits) == XpletType.REAL:
+            return outer
+
+        index = self._curvature_index.get(t1.d2)
+        if index is None:
+            order = sorted(range(len(outer)), key=lambda i: outer[i].curvature)
+            index = self._curvature_index[t1.d2] = ([outer[i].curvature for i in order], order)
+        curvatures, order = index
+
+        # add a small margin, so that rounding errors never discard a valid quadruplet
+        max_dcurv = self._curvature_window * (1 + 1e-9) + 1e-12
+        lo = bisect.bisect_left(curvatures, t1.curvature - max_dcurv)
+        hi = bisect.bisect_right(curvatures, t1.curvature + max_dcurv)
+        return [outer[i] for i in sorted(order[lo:hi])]
+
     def _is_invalid_doublet(self, dblet: Doublet) -> bool:
         # Apply hard cuts on doublets.
         # Currently, doublets are only dropped if they miss more than one layer.
 
         v1, v2 = dblet.h1.volayer, dblet.h2.volayer
         ret = v1 >= v2 or v2 > v1 + self.config.max_layer_span
-        if ret and self.dataw.is_real_doublet(dblet.hit_ids()) == XpletType.REAL:
+        if ret and self.dataw.is_real_hits(dblet.hits) == XpletType.REAL:
             self.hard_cuts_stats.append(f'dblet,{dblet},volayer,{v1},{v2}')
             return not self.config.cheat
         return ret
@@ -111,7 +302,7 @@ class Qallse(QallseBase):
         # * the radius of the curvature formed by the three hits (cut on GeV)
         # * how well are the two doublets aligned in the R-Z plane
 
-        is_real = self.dataw.is_real_xplet(tplet.hit_ids()) == XpletType.REAL
+        is_real = self.dataw.is_real_hits(tplet.hits) == XpletType.REAL
 
         # layer skips
         volayer_skip = tplet.hits[-1].volayer - tplet.hits[0].volayer
@@ -139,7 +330,7 @@ class Qallse(QallseBase):
         # Currently, we discard directly any potential quadruplet between triplets that don't have
         # a very similar curvature in the X-Y plane. Then, we compute the coupling strength (combining
         # layer miss, R-Z plane delta angles and curvature) and apply a cut on it.
-        is_real = self.dataw.is_real_xplet(qplet.hit_ids()) == XpletType.REAL
+        is_real = self.dataw.is_real_hits(qplet.hits) == XpletType.REAL
 
         # delta delta curvature between the two triplets
         ret = qplet.delta_curvature > self.config.qplet_max_dcurv
@@ -196,6 +387,43 @@ class Qallse(QallseBase):
 
         return strength
 
+    def _qubo_conflicts(self) -> TQubo:
+        # Exclusion couplers, using the formulation set in the config (see qubo_conflict_mode).
+        if self.config.qubo_conflict_mode == 'pairs':
+            return super()._qubo_conflicts()
+        if self.config.qubo_conflict_mode != 'star':
+            raise ValueError(f'Unknown conflict mode: {self.config.qubo_conflict_mode}')
+
+        # star: for each triplet t using a conflicting doublet d, the penalty strength * x_t * (1 - x_d) forces
+        # x_d = 1, and strength * x_d1 * x_d2 penalizes two conflicting doublets. The linear terms of the
+        # triplets are added to their weight (see _assemble_qubo).
+        strength = self.config.qubo_conflict_strength
+        Q, aux, n_pairs = {}, set(), 0
+
+        def aux_name(d):
+            return AUXILIARY_PREFIX + str(d)
+
+        for hit in self.qubo_hits.values():
+            for conflicts in [hit.inner_kept, hit.outer_kept]:
+                if len(conflicts) < 2:
+                    continue
+                for (d1, d2) in itertools.combinations(conflicts, 2):
+                    Q[(aux_name(d1), aux_name(d2))] = strength
+                sizes = [len(d.inner_kept | d.outer_kept) for d in conflicts]
+                n_pairs += (sum(sizes) ** 2 - sum(n * n for n in sizes)) // 2
+                aux.update(conflicts)
+
+        for d in aux:
+            Q[(aux_name(d), aux_name(d))] = self.config.qubo_conflict_aux_bias
+            for t in d.inner_kept | d.outer_kept:
+                Q[(str(t), aux_name(d))] = -strength
+                Q[(str(t), str(t))] = Q.get((str(t), str(t)), 0) + strength
+
+        n_couplers = sum(1 for (k1, k2) in Q.keys() if k1 != k2)
+        self.logger.info(f'Star conflicts: {len(aux)} auxiliary variables, {n_couplers} couplers '
+                         f'(pairs mode: up to {n_pairs} couplers).')
+        return Q
+
     def _compute_conflict_strength(self, t1: Triplet, t2: Triplet) -> float:
         # Just return a constant for now.
         # Careful: if too low, the number of remaining conflicts in the QUBO solution will explode.
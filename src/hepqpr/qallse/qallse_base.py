@@ -1,6 +1,8 @@
+import copy
 import itertools
 import logging
 import sys
+import tempfile
 import time
 from abc import ABC, abstractmethod
 from typing import Union
@@ -11,16 +13,24 @@ from .other.stdout_redirect import capture_stdout
 
 from .data_structures import *
 from .data_wrapper import DataWrapper
-from .utils import tracks_to_xplets
+from .utils import tracks_to_xplets, select_chains, is_auxiliary_variable
 
 
 class ConfigBase(ABC):
     """Encapsulate parameters for a model. The parameters can be defined as class attributes."""
 
+    #: Map parameter names to the first model building stage they affect (see :py:attr:`QallseBase.stages`).
+    #: Parameters not listed here are considered to affect all the stages.
+    _stages = dict()
+
+    def __init__(self):
+        # names of the parameters updated since the last call to pop_updated_stages
+        self._updated = set()
+
     def as_dict(self):
         """Return the current configuration as a dictionary."""
         return dict([(k, getattr(self, k)) for k in dir(self)
-                     if not k.startswith('_') and not k in ['as_dict', 'update']])
+                     if not k.startswith('_') and not callable(getattr(self, k))])
 
     def update(self, logger=None, **kwargs):
         """Update this configuration, doing type conversions if necessary."""
@@ -29,6 +39,8 @@ class ConfigBase(ABC):
                 if hasattr(self, k):
                     typ = type(getattr(self, k))
                     if type(v) != typ: v = typ(v)
+                    if v != getattr(self, k):
+                        self._updated = self._updated | {k}
                     setattr(self, k, v)
                 else:
                     logger.warning(f'got an unknown config parameter {k}={v}')
@@ -36,6 +48,20 @@ class ConfigBase(ABC):
                 if logger is not None:
                     logger.warning(f'ignored config {k}={v}, wrong type (should be of {typ})')
 
+    def pop_updated_stages(self, default: str) -> Set[str]:
+        """
+        Return the stages affected by the parameters updated since the last call (see :py:attr:~`_stages`).
+        :param default: the stage to use for parameters with no stage information
+        """
+        stages = set(self._stages.get(k, default) for k in self._updated)
+        self._updated = set()
+        return stages
+
+
+class QuboBudgetExceeded(Exception):
+    """Raised when a QUBO can't fit in the budget given to :py:meth:`QallseBase.build_model`."""
+    pass
+
 
 # ============================================================
 
@@ -54,23 +80,31 @@ class QallseBase(ABC):
         for (k, v) in self.config.as_dict().items(): self.logger.debug(f'    {k}: {v}')
 
         #: All hits generated
-        self.hits: Dict[str, Hit] = {}
+        self.hits: Dict[int, Hit] = {}
         #: All doublets generated
         self.doublets: List[Doublet] = []
         #: All triplets generated
         self.triplets: List[Triplet] = []
         #: All quadruplets generated
         self.quadruplets: List[Quadruplet] = []
+        #: All quadruplets generated, as compact records (see :py:data:`qplet_record_dtype`).
+        #: Only set when quadruplets are generated by chunks, in which case `quadruplets` is a
+        #: :py:class:`QuadrupletRecords` of the quadruplets selected for the QUBO.
+        self.qplet_records: np.ndarray = None
 
         #: Triplets that will figure in the QUBO as variables
         self.qubo_triplets: Set[Triplet] = set()
         #: Doublets used by at least one triplet included in the QUBO
         self.qubo_doublets: Set[Doublet] = set()
         #: Hits used by at least one Xplet in the QUBO
-        self.qubo_hits: Dict[str, Hit] = {}
+        self.qubo_hits: Dict[int, Hit] = {}
+
+        #: Configuration updates applied to fit the QUBO in the budget (see :py:meth:~`build_model`)
+        self.qubo_budget_updates: Dict = {}
+        self._qubo_budget = None
 
-        for row in self.dataw.hits.iterrows():
-            h = Hit(**dict(row[1]))
+        for row in self.dataw.hits.to_dict('records'):
+            h = Hit(**row)
             self.hits[h.hit_id] = h
 
     @abstractmethod
@@ -78,22 +112,79 @@ class QallseBase(ABC):
         # [ABSTRACT] Return an instance of a subclass of `ConfigBase` holding all model parameters
         pass
 
-    def build_model(self, doublets: Union[pd.DataFrame, List, np.array]):
+    #: Ordered stages of model building. Each stage creates structures from the ones of the previous stages:
+    #: doublets, triplets, quadruplets, then the selection of the xplets used in the QUBO.
+    stages = ['doublets', 'triplets', 'quadruplets', 'selection']
+    #: Independent parts of the QUBO: linear weights, exclusion (conflicts) and inclusion couplers.
+    qubo_stages = ['qubo_weights', 'qubo_conflicts', 'qubo_couplers']
+
+    #: Configuration updates applied one after the other (each on top of the previous ones) when the QUBO exceeds
+    #: the budget given to :py:meth:~`build_model`. Each step should tighten the cuts further.
+    qubo_budget_steps: List[Dict] = []
+
+    def build_model(self, doublets: Union[pd.DataFrame, List, np.array], phi_sectors=1, eta_sectors=1, n_jobs=None,
+                    qplet_chunk_size=None, scratch_dir=None, max_qubo_vars=None, max_qubo_couplers=None,
+                    budget_steps=None, early_abort=False):
         """
         Do the preprocessing, i.e. prepare everything so the QUBO can be generated.
         This includes creating the structures (hits, doublets, triplets, quadruplets) and computing the weights.
 
+        If more than one sector is requested, the hits are split into phi (and eta) sectors and the triplets and
+        quadruplets of each sector are built in a pool of processes (see :py:mod:`hepqpr.qallse.sectors`).
+        The resulting model is identical to the one built serially.
+
+        If a chunk size is given, the quadruplets are generated by blocks of triplets and only kept as compact
+        records (see :py:attr:~`qplet_records`). The selection and the QUBO use the records directly, and
+        :py:attr:~`quadruplets` creates the selected quadruplets on access only (see
+        :py:class:`hepqpr.qallse.data_structures.QuadrupletRecords`), so that no quadruplet object is kept.
+        The records can also be written to disk, chunk by chunk, and memory-mapped (see `scratch_dir`).
+        This is ignored when building by sectors.
+
+        If a QUBO budget is given, the cuts are tightened step by step (see :py:attr:~`qubo_budget_steps`) until
+        the QUBO fits. This is first done here, using the number of triplets and quadruplets selected (lower bounds
+        of the QUBO size), then in :py:meth:~`to_qubo` using the actual QUBO size. The updates applied are stored in
+        :py:attr:~`qubo_budget_updates`. If the QUBO still exceeds the budget once all the steps are applied,
+        a warning is logged. With `early_abort`, a :py:class:`QuboBudgetExceeded` is raised instead, as soon as the
+        lower bounds exceed the budget (i.e. before generating the QUBO).
+
         :param doublets: the input doublets
+        :param phi_sectors: the number of sectors in phi
+        :param eta_sectors: the number of sectors in eta
+        :param n_jobs: the number of processes to use when building sectors. Default to the number of CPUs.
+        :param qplet_chunk_size: the number of triplets processed at once when generating quadruplets by chunks
+        :param scratch_dir: if set, the quadruplet records are stored in a temporary file in this directory instead
+            of in memory, and read block by block. The file is deleted automatically. Only used if
+            `qplet_chunk_size` is set.
+        :param max_qubo_vars: the maximum number of variables in the QUBO
+        :param max_qubo_couplers: the maximum number of couplers (inclusion and exclusion) in the QUBO
+        :param budget_steps: the configuration updates to apply when the budget is exceeded. Default to
+            :py:attr:~`qubo_budget_steps`.
+        :param early_abort: if set, raise an exception when the QUBO can't fit in the budget
         :return: self (for chaining)
         """
         start_time = time.process_time()
-        self.hard_cuts_stats = self.hard_cuts_stats[:1]
 
-        initial_doublets = doublets.values if isinstance(doublets, pd.DataFrame) else doublets
+        self._initial_doublets = doublets.values if isinstance(doublets, pd.DataFrame) else doublets
+        self._qplet_chunk_size, self._scratch_dir = qplet_chunk_size, scratch_dir
+        self._qubo_parts = None
+        self._qubo_budget = None
+        if max_qubo_vars is not None or max_qubo_couplers is not None:
+            steps = self.qubo_budget_steps if budget_steps is None else budget_steps
+            self._qubo_budget = (max_qubo_vars, max_qubo_couplers, list(steps), early_abort)
+        self.qubo_budget_updates = dict()
+
+        self.config.pop_updated_stages(default=self.stages[0])
+        if phi_sectors * eta_sectors > 1:
+            self._run_stages_partitioned(phi_sectors, eta_sectors, n_jobs)
+        else:
+            self._run_stages(self.stages[0])
 
-        self._create_doublets(initial_doublets)
-        self._create_triplets()
-        self._create_quadruplets()
+        # inclusion couplers are a lower bound of the number of couplers
+        while self._fit_qubo_budget(len(self.qubo_triplets), len(self.quadruplets), exact=False):
+            stages = self.config.pop_updated_stages(default=self.stages[0])
+            build_stages = [s for s in self.stages if s in stages]
+            if len(build_stages):
+                self._run_stages(build_stages[0])
 
         end_time = time.process_time() - start_time
 
@@ -105,6 +196,251 @@ class QallseBase(ABC):
 
         return self
 
+    def rebuild(self, return_stats=False) -> Union[TQubo, Tuple[TQubo, Tuple[int, int, int]]]:
+        """
+        Update the model and the QUBO after a configuration change (i.e. `model.config.update(...)`),
+        re-running only the stages affected by the updated parameters. For example, updating `qubo_bias_weight`
+        only recomputes the linear weights of the QUBO. The other parts of the QUBO are reused from the last
+        call to :py:meth:~`to_qubo` or :py:meth:~`rebuild`.
+        Attention: ensure that :py:meth:~`build_model` has been called previously.
+
+        :param return_stats: see :py:meth:~`to_qubo`
+        :return: see :py:meth:~`to_qubo`
+        """
+        stages = self.config.pop_updated_stages(default=self.stages[0])
+        build_stages = [s for s in self.stages if s in stages]
+
+        if len(build_stages):
+            start_time = time.process_time()
+            self._run_stages(build_stages[0])
+            stages.update(self.qubo_stages)
+            exec_time = time.process_time() - start_time
+            self.logger.info(f'Model rebuilt from stage {build_stages[0]} in {exec_time:.2f}s.')
+
+        if self._qubo_parts is None:
+            return self.to_qubo(return_stats)
+        return self._assemble_qubo([s for s in self.qubo_stages if s in stages], return_stats)
+
+    def _fit_qubo_budget(self, n_vars: int, n_couplers: int, exact=True) -> bool:
+        # Check the QUBO size against the budget, if any. If it is exceeded, apply the next step of configuration
+        # updates (the caller is responsible for rebuilding the model) and return True.
+        # If no step is left, either log a warning (only if the size is exact) or raise QuboBudgetExceeded.
+        if self._qubo_budget is None:
+            return False
+        max_vars, max_couplers, steps, early_abort = self._qubo_budget
+        if (max_vars is None or n_vars <= max_vars) and (max_couplers is None or n_couplers <= max_couplers):
+            return False
+
+        size = f'{n_vars} vars, {"" if exact else ">= "}{n_couplers} couplers (max: {max_vars}, {max_couplers})'
+        if len(steps) == 0:
+            msg = f'QUBO budget exceeded: {size}, with config updates {self.qubo_budget_updates}.'
+            if early_abort:
+                raise QuboBudgetExceeded(msg)
+            if exact:
+                self.logger.warning(msg)
+            return False
+
+        step = steps.pop(0)
+        self.config.update(logger=self.logger, **step)
+        self.qubo_budget_updates.update(step)
+        self.logger.info(f'QUBO budget exceeded: {size}. Tightening cuts: {step}.')
+        return True
+
+    def _run_stages(self, first_stage: str):
+        # Run the model building stages, starting at first_stage. Structures from the previous stages are kept,
+        # the others are discarded.
+        first = self.stages.index(first_stage)
+        reset_stats = ['dblet', 'tplet', 'qplet'][first:]
+        self.hard_cuts_stats = self.hard_cuts_stats[:1] + [
+            s for s in self.hard_cuts_stats[1:] if s.split(',')[0] not in reset_stats]
+
+        if first <= 0:
+            self._reset_connections(self.hits.values())
+            self._create_doublets(self._initial_doublets)
+            self._prune_doublets()
+        if first <= 1:
+            self._reset_connections(self.doublets)
+            self._create_triplets()
+        if first <= 2:
+            self._reset_connections(self.triplets)
+            if self._qplet_chunk_size:
+                self.quadruplets = []
+                self.qplet_records = self._create_quadruplet_records(self._qplet_chunk_size, self._scratch_dir)
+            else:
+                self.qplet_records = None
+                self._create_quadruplets(register_qubo=False)
+        elif self.qplet_records is None:
+            # recover the quadruplets discarded during the previous selection, if any
+            self.quadruplets = [q for t in self.triplets for q in t.outer]
+        self._run_selection()
+
+    def _run_selection(self):
+        # Run the selection stage on the current quadruplets, discarding the previous selection.
+        for xplets in [self.hits.values(), self.doublets, self.triplets]:
+            for x in xplets: x.inner_kept, x.outer_kept = set(), set()
+        self.qubo_doublets, self.qubo_triplets, self.qubo_hits = set(), set(), {}
+        self._select_qubo_quadruplets()
+
+    def _run_stages_partitioned(self, phi_sectors, eta_sectors, n_jobs=None):
+        # Run all the model building stages, building the triplets and quadruplets by sectors.
+        # Doublets and the selection are handled here, since they are cheap and global respectively.
+        from concurrent.futures import ProcessPoolExecutor
+        from . import sectors
+        from .dumper import _columns_to_attributes, _new_xplet
+
+        # the template model sent to the workers: no xplets, only hits and config
+        template = copy.copy(self)
+        template.logger = None
+        template.hits = dict((hid, h.detached_copy()) for hid, h in self.hits.items())
+        template.doublets, template.triplets, template.quadruplets = [], [], []
+        template.qubo_doublets, template.qubo_triplets, template.qubo_hits = set(), set(), {}
+        template.hard_cuts_stats = self.hard_cuts_stats[:1]
+        template._initial_doublets, template._qubo_parts = None, None
+
+        self.hard_cuts_stats = self.hard_cuts_stats[:1]
+        self.qplet_records = None
+        self._reset_connections(self.hits.values())
+        self._create_doublets(self._initial_doublets)
+        self._prune_doublets()
+
+        doublets = np.array([d.hit_ids() for d in self.doublets], dtype=np.int64).reshape(-1, 2)
+        tasks = []
+        for core in sectors.partition_hits(self.dataw.hits, phi_sectors, eta_sectors):
+            if len(core):
+                tasks.append((core, sectors.sector_doublets(doublets, core)))
+
+        if n_jobs == 1:
+            sectors._init_sector_worker(template)
+            results = [sectors._build_sector(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(n_jobs, initializer=sectors._init_sector_worker,
+                                     initargs=(template,)) as executor:
+                results = list(executor.map(sectors._build_sector, *zip(*tasks)))
+
+        # merge the results, restoring the order of the serial build. The attributes computed by the workers are
+        # attached as-is, without recomputing the geometry.
+        doublets_index = dict(((d.h1.hit_id, d.h2.hit_id), (i, d)) for i, d in enumerate(self.doublets))
+        triplets = []
+        for tplets, tplet_columns, _, _, stats in results:
+            for (h1, h2, h3), attrs in zip(tplets.tolist(), _columns_to_attributes(tplet_columns)):
+                (i1, d1), (i2, d2) = doublets_index[(h1, h2)], doublets_index[(h2, h3)]
+                triplets.append((i1, i2, _new_xplet(Triplet, [d1.h1, d2.h1, d2.h2], attrs, d1=d1, d2=d2)))
+            self.hard_cuts_stats += stats
+        triplets.sort(key=lambda item: item[:2])
+        self.triplets = [t for (_, _, t) in triplets]
+
+        triplets_index = dict((tuple(t.hit_ids()), (i, t)) for i, t in enumerate(self.triplets))
+        for t in self.triplets:
+            t.d1.outer.append(t)
+            t.d2.inner.append(t)
+
+        quadruplets = []
+        for _, _, qplets, qplet_columns, _ in results:
+            for hit_ids, attrs in zip(qplets.tolist(), _columns_to_attributes(qplet_columns)):
+                (i1, t1), (i2, t2) = triplets_index[tuple(hit_ids[:3])], triplets_index[tuple(hit_ids[1:])]
+                quadruplets.append((i1, i2, _new_xplet(Quadruplet, t1.hits + [t2.hits[-1]], attrs, t1=t1, t2=t2)))
+        quadruplets.sort(key=lambda item: item[:2])
+        self.quadruplets = [q for (_, _, q) in quadruplets]
+        for q in self.quadruplets:
+            q.t1.outer.append(q)
+            q.t2.inner.append(q)
+
+        self.logger.info(f'created {len(self.triplets)} triplets and {len(self.quadruplets)} quadruplets '
+                         f'in {len(tasks)} sectors.')
+        self._run_selection()
+
+    @classmethod
+    def _reset_connections(cls, xplets: Iterable[Xplet]):
+        for x in xplets:
+            x.inner, x.outer = [], []
+            x.inner_kept, x.outer_kept = set(), set()
+
+    def slice_model(self, hit_ids: List[int], dataw: DataWrapper = None) -> 'QallseBase':
+        """
+        Create a new model restricted to a subset of hits, i.e. the model one would get by calling
+        :py:meth:~`build_model` on the subsampled event with the same configuration.
+        Since xplets only depend on their own hits, they are copied from this model: no geometry is recomputed and
+        no hard cut is evaluated again. Only the selection of the xplets used in the QUBO is redone
+        (see :py:meth:~`_select_qubo_quadruplets`). This is exact as long as the `cheat` mode is off.
+        Attention: ensure that :py:meth:~`build_model` has been called previously.
+
+        :param hit_ids: the hits to keep
+        :param dataw: the dataset of the new model. If not set, it is derived from the current one
+            (see :py:meth:`hepqpr.qallse.DataWrapper.subset`)
+        :return: a new model, ready for :py:meth:~`to_qubo`
+        """
+        start_time = time.process_time()
+        hit_ids = set(map(int, hit_ids))
+
+        model = copy.copy(self)
+        model.config = copy.copy(self.config)
+        model.dataw = dataw if dataw is not None else self.dataw.subset(sorted(hit_ids))
+        model.hits = dict((hid, h.detached_copy()) for hid, h in self.hits.items() if hid in hit_ids)
+        # the dense indexes are the ones of the new dataset
+        for h, hit_index in zip(model.hits.values(), model.dataw.get_hit_indexes(list(model.hits.keys())).tolist()):
+            h.hit_index = hit_index
+        model.qubo_doublets, model.qubo_triplets, model.qubo_hits = set(), set(), {}
+        model._initial_doublets = [(h1, h2) for (h1, h2) in self._initial_doublets
+                                   if h1 in hit_ids and h2 in hit_ids]
+        model._qubo_parts = None
+        # the budget steps are consumed when the slice is rebuilt: don't share them with this model
+        model._qubo_budget = copy.deepcopy(self._qubo_budget)
+        model.qubo_budget_updates = dict(self.qubo_budget_updates)
+        model.hard_cuts_stats = self.hard_cuts_stats[:1] + [
+            row for row in self.hard_cuts_stats[1:]
+            if hit_ids.issuperset(Xplet.name_to_hit_ids(row.split(',')[1]))]
+
+        # copy the xplets made only of kept hits, keeping the same order
+        doublets = dict()
+        for d in self.doublets:
+            h1, h2 = model.hits.get(d.h1.hit_id), model.hits.get(d.h2.hit_id)
+            if h1 is not None and h2 is not None:
+                doublets[d] = dblet = d.detached_copy(h1, h2)
+                h1.outer.append(dblet)
+                h2.inner.append(dblet)
+
+        triplets = dict()
+        for t in self.triplets:
+            d1, d2 = doublets.get(t.d1), doublets.get(t.d2)
+            if d1 is not None and d2 is not None:
+                triplets[t] = tplet = t.detached_copy(d1, d2)
+                d1.outer.append(tplet)
+                d2.inner.append(tplet)
+
+        # use the triplets' connections, since some implementations filter self.quadruplets
+        quadruplets = []
+        for t in self.triplets:
+            for q in t.outer:
+                t1, t2 = triplets.get(q.t1), triplets.get(q.t2)
+                if t1 is not None and t2 is not None:
+                    qplet = q.detached_copy(t1, t2)
+                    t1.outer.append(qplet)
+                    t2.inner.append(qplet)
+                    quadruplets.append(qplet)
+
+        if self.qplet_records is not None:
+            # quadruplets generated by chunks: only keep the records and update the triplet indexes
+            new_index = dict((t, i) for i, t in enumerate(triplets.keys()))
+            index = np.array([new_index.get(t, -1) for t in self.triplets], dtype=np.int64)
+            t1, t2 = index[self.qplet_records['t1']], index[self.qplet_records['t2']]
+            mask = (t1 >= 0) & (t2 >= 0)
+            model.qplet_records = self.qplet_records[mask].copy()
+            model.qplet_records['t1'], model.qplet_records['t2'] = t1[mask], t2[mask]
+
+        model.doublets = list(doublets.values())
+        model.triplets = list(triplets.values())
+        model.quadruplets = quadruplets
+        model._select_qubo_quadruplets()
+
+        exec_time = time.process_time() - start_time
+        self.logger.info(
+            f'Model sliced in {exec_time:.2f}s. hits: {len(model.hits)}/{len(self.hits)}, '
+            f'doublets: {len(model.doublets)}/{len(model.qubo_doublets)}, '
+            f'triplets: {len(model.triplets)}/{len(model.qubo_triplets)}, '
+            f'quadruplets: {len(model.quadruplets)}')
+
+        return model
+
     def sample_qubo(self, Q: TQubo = None, return_time=False, logfile: str = None, seed: int=None, **qbsolv_params) -> Union[
         object, Tuple[object, float]]:
         """
@@ -137,16 +473,48 @@ class QallseBase(ABC):
 
         return (response, exec_time) if return_time else response
 
+    def auxiliary_variables(self) -> Set[str]:
+        """
+        Return the auxiliary variables of the QUBO, i.e. the variables that are not xplets with a linear weight,
+        such as the doublets of the `star` conflict mode (see :py:class:`hepqpr.qallse.qallse.Config`).
+        Attention: ensure that :py:meth:~`to_qubo` has been called previously.
+
+        :return: the names of the auxiliary variables (empty for most formulations)
+        """
+        weights, conflicts, couplers = [self._qubo_parts[s] for s in self.qubo_stages]
+        return set(k for key in conflicts.keys() for k in key if (k, k) not in weights)
+
+    def initial_state(self, max_strength: float = 0) -> TDimodSample:
+        """
+        Derive a good solution from the model, to use as the initial state of a sampler (warm start).
+        The inclusion couplers (e.g. the quadruplets) are considered from the strongest to the weakest: both their
+        variables are turned on, unless one of them uses a doublet conflicting with a variable already turned on.
+        The auxiliary variables (see :py:meth:~`auxiliary_variables`) are set accordingly. This selects the strong
+        chains of the obvious tracks, leaving the ambiguous parts to the sampler.
+
+        :param max_strength: ignore the inclusion couplers with a strength above (i.e. weaker than) it
+        :return: a sample with all the variables of the QUBO, see :py:meth:~`to_qubo`
+        """
+        if self._qubo_parts is None:
+            self.to_qubo()
+        weights, conflicts, couplers = [self._qubo_parts[s] for s in self.qubo_stages]
+        variables = dict.fromkeys(k for Q in [weights, conflicts, couplers] for key in Q.keys() for k in key)
+        sample = select_chains(variables, couplers, max_strength, self.auxiliary_variables())
+        self.logger.info(f'Initial state: {sum(sample.values())}/{len(sample)} variables turned on.')
+        return sample
+
     @classmethod
     def process_sample(self, sample: TDimodSample) -> List[TXplet]:
         """
-        Convert a QUBO solution into a set of doublets.
+        Convert a QUBO solution into a set of doublets. Auxiliary variables are ignored (see
+        :py:meth:~`auxiliary_variables`).
         The sample needs to behave like a dictionary, but can also be an instance of dimod.SampleView.
 
         :param sample: the QUBO response to process
         :return: the list of final doublets
         """
-        final_triplets = [Triplet.name_to_hit_ids(k) for k, v in sample.items() if v == 1]
+        final_triplets = [Triplet.name_to_hit_ids(k) for k, v in sample.items()
+                          if v == 1 and not is_auxiliary_variable(k)]
         final_doublets = tracks_to_xplets(final_triplets)
         return np.unique(final_doublets, axis=0).tolist()
 
@@ -154,9 +522,16 @@ class QallseBase(ABC):
 
     def _create_doublets(self, initial_doublets):
         # Generate Doublet structures from the initial doublets, calling _is_invalid_doublet to apply early cuts
+        # The hit ids are converted to dense indexes at once, so the hits are fetched from a list
+        hits = [None] * len(self.dataw.hits)
+        for h in self.hits.values():
+            hits[h.hit_index] = h
+        indexes = self.dataw.get_hit_indexes(np.asarray(initial_doublets, dtype=np.int64).reshape(-1, 2))
+        if np.any(indexes < 0):
+            raise KeyError(f'unknown hit ids in the doublets: {np.asarray(initial_doublets)[indexes < 0][:10]}')
         doublets = []
-        for (start_id, end_id) in initial_doublets:
-            start, end = self.hits[start_id], self.hits[end_id]
+        for (start_index, end_index) in indexes.tolist():
+            start, end = hits[start_index], hits[end_index]
             d = Doublet(start, end)
             if not self._is_invalid_doublet(d):
                 start.outer.append(d)
@@ -166,6 +541,11 @@ class QallseBase(ABC):
         self.logger.info(f'created {len(doublets)} doublets.')
         self.doublets = doublets
 
+    def _prune_doublets(self):
+        # Hook called after _create_doublets, before the triplets are created from the whole set of doublets.
+        # Implementations can use it to discard doublets depending on their neighbourhood.
+        pass
+
     @abstractmethod
     def _is_invalid_doublet(self, dblet: Doublet) -> bool:
         # [ABSTRACT] Apply early cuts on doublets, return True if the doublet should be discarded.
@@ -175,7 +555,7 @@ class QallseBase(ABC):
         # Generate Triplet structures from Doublets, calling _is_invalid_triplet to apply early cuts
         triplets = []
         for d1 in self.doublets:
-            for d2 in d1.h2.outer:
+            for d2 in self._triplet_candidates(d1):
                 t = Triplet(d1, d2)
                 if not self._is_invalid_triplet(t):
                     d1.outer.append(t)
@@ -184,6 +564,11 @@ class QallseBase(ABC):
         self.logger.info(f'created {len(triplets)} triplets.')
         self.triplets = triplets
 
+    def _triplet_candidates(self, d1: Doublet) -> List[Doublet]:
+        # Return the doublets that could form a triplet with d1, in the order of d1.h2.outer.
+        # Implementations can use it to skip doublets that would be discarded by _is_invalid_triplet anyway.
+        return d1.h2.outer
+
     @abstractmethod
     def _is_invalid_triplet(self, tplet: Triplet) -> bool:
         # [ABSTRACT] Apply early cuts on triplets, return True if the triplet should be discarded.
@@ -198,7 +583,7 @@ class QallseBase(ABC):
         # in the QUBO (in this case, you have to set the `qubo_*` structures properly)
         quadruplets = []
         for t1 in self.triplets:
-            for t2 in t1.d2.outer:
+            for t2 in self._quadruplet_candidates(t1):
                 qplet = Quadruplet(t1, t2)
                 if not self._is_invalid_quadruplet(qplet):
                     t1.outer.append(qplet)
@@ -211,6 +596,48 @@ class QallseBase(ABC):
         self.logger.info(f'created {len(quadruplets)} quadruplets.')
         self.quadruplets = quadruplets
 
+    def _create_quadruplet_records(self, chunk_size: int, scratch_dir: str = None) -> np.ndarray:
+        # Same as _create_quadruplets, but processing triplets by blocks of chunk_size and only keeping a
+        # compact record of each quadruplet (see qplet_record_dtype). The quadruplets are not connected to
+        # their triplets, and the selection only accesses them through the records (see QuadrupletRecords).
+        # If scratch_dir is set, each chunk is appended to an anonymous temporary file, which is memory-mapped
+        # at the end. The file is deleted once the memory map is garbage collected.
+        triplets_index = dict((t, i) for i, t in enumerate(self.triplets))
+        chunks = [np.zeros(0, dtype=qplet_record_dtype)]
+        spill = None if scratch_dir is None else tempfile.TemporaryFile(dir=scratch_dir, prefix='qplets-')
+        n_records = 0
+
+        for start in range(0, len(self.triplets), chunk_size):
+            records = []
+            for t1 in self.triplets[start:start + chunk_size]:
+                for t2 in self._quadruplet_candidates(t1):
+                    qplet = Quadruplet(t1, t2)
+                    if not self._is_invalid_quadruplet(qplet):
+                        records.append((
+                            triplets_index[t1], triplets_index[t2],
+                            self._compute_strength(qplet), qplet.volayer_span))
+            n_records += len(records)
+            if spill is None:
+                chunks.append(np.array(records, dtype=qplet_record_dtype))
+            else:
+                spill.write(np.array(records, dtype=qplet_record_dtype).tobytes())
+
+        if spill is None:
+            records = np.concatenate(chunks)
+        else:
+            spill.flush()
+            records = np.memmap(spill, dtype=qplet_record_dtype, mode='r', shape=(n_records,)) \
+                if n_records > 0 else chunks[0]
+            spill.close()
+
+        self.logger.info(f'created {len(records)} quadruplets (records).')
+        return records
+
+    def _quadruplet_candidates(self, t1: Triplet) -> List[Triplet]:
+        # Return the triplets that could form a quadruplet with t1, in the order of t1.d2.outer.
+        # Implementations can use it to skip triplets that would be discarded by _is_invalid_quadruplet anyway.
+        return t1.d2.outer
+
     @abstractmethod
     def _is_invalid_quadruplet(self, qplet: Quadruplet) -> bool:
         # [ABSTRACT] Apply early cuts on quadruplets, return True if the quadruplet should be discarded.
@@ -230,6 +657,35 @@ class QallseBase(ABC):
         self.qubo_hits.update(zip(qplet.hit_ids(), qplet.hits))
         self.qubo_triplets.update([qplet.t1, qplet.t2])
 
+    def _register_qubo_records(self, qplets: QuadrupletRecords):
+        # Same as _register_qubo_quadruplet, for all the quadruplets of the records, without creating them.
+        # A quadruplet only registers the structures of its two triplets, so each triplet is registered once.
+        used = np.zeros(len(self.triplets), dtype=bool)
+        for _, block in qplets.iter_blocks():
+            used[block['t1']] = True
+            used[block['t2']] = True
+        for t in [self.triplets[i] for i in np.flatnonzero(used).tolist()]:
+            for d in t.doublets():
+                d.h1.outer_kept.add(d)
+                d.h2.inner_kept.add(d)
+            t.d1.outer_kept.add(t)
+            t.d2.inner_kept.add(t)
+
+            self.qubo_doublets.update(t.doublets())
+            self.qubo_hits.update(zip(t.hit_ids(), t.hits))
+            self.qubo_triplets.add(t)
+
+    def _select_qubo_quadruplets(self):
+        # Register all quadruplets as used in the QUBO (see _register_qubo_quadruplet).
+        # This is the last stage of the model building (see stages). Models applying another pass of
+        # filtering on quadruplets should override this method.
+        if self.qplet_records is not None:
+            self.quadruplets = QuadrupletRecords(self.qplet_records, self.triplets)
+            self._register_qubo_records(self.quadruplets)
+            return
+        for qplet in self.quadruplets:
+            self._register_qubo_quadruplet(qplet)
+
     @abstractmethod
     def _compute_weight(self, tplet: Triplet) -> float:
         # [ABSTRACT] Return the bias weight (linear) that should be associated to this triplet in the QUBO
@@ -258,20 +714,47 @@ class QallseBase(ABC):
         :param return_stats: if set, also return the number of variables and coulpers.
         :return: either the QUBO, or a tuple (QUBO, (n_vars, n_incl_couplers, n_excl_couplers))
         """
+        self._qubo_parts = dict()
+        return self._assemble_qubo(self.qubo_stages, return_stats)
 
-        Q = {}
-        hits, doublets, triplets = self.qubo_hits, self.qubo_doublets, self.qubo_triplets
-        quadruplets = self.quadruplets
-
+    def _assemble_qubo(self, stages: List[str], return_stats=False):
+        # Compute the given parts of the QUBO (see qubo_stages), reuse the others and merge them into one QUBO.
         start_time = time.process_time()
+        for stage in stages:
+            self._qubo_parts[stage] = getattr(self, '_' + stage)()
+
+        weights, conflicts, couplers = [self._qubo_parts[s] for s in self.qubo_stages]
+        # inclusion couplers take precedence over exclusion couplers
+        Q = {**weights, **conflicts, **couplers}
+        # exclusion formulations with auxiliary variables can also have linear terms on the triplets
+        for k in weights.keys() & conflicts.keys():
+            Q[k] = weights[k] + conflicts[k]
+        n_vars = sum(1 for (k1, k2) in Q.keys() if k1 == k2)
+        n_excl_couplers = sum(1 for (k1, k2) in conflicts.keys() if k1 != k2)
+        n_incl_couplers = len(Q) - (n_vars + n_excl_couplers)
+        exec_time = time.process_time() - start_time
+
+        self.logger.info(f'Qubo generated in {exec_time:.2f}s. Size: {len(Q)}. Vars: {n_vars}, '
+                         f'excl. couplers: {n_excl_couplers}, incl. couplers: {n_incl_couplers}')
+        if self._fit_qubo_budget(n_vars, n_incl_couplers + n_excl_couplers):
+            return self.rebuild(return_stats)
+        if return_stats:
+            return Q, (n_vars, n_incl_couplers, n_excl_couplers)
+        else:
+            return Q
+
+    def _qubo_weights(self) -> TQubo:
         # 1: qbits with their weight (doublets with a common weight)
-        for q in triplets:
+        Q = {}
+        for q in self.qubo_triplets:
             q.weight = self._compute_weight(q)
             Q[(str(q), str(q))] = q.weight
-        n_vars = len(Q)
+        return Q
 
+    def _qubo_conflicts(self) -> TQubo:
         # 2a: exclusion couplers (no two triplets can share the same doublet)
-        for hit_id, hit in hits.items():
+        Q = {}
+        for hit_id, hit in self.qubo_hits.items():
             for conflicts in [hit.inner_kept, hit.outer_kept]:
                 for (d1, d2) in itertools.combinations(conflicts, 2):
                     for t1 in d1.inner_kept | d1.outer_kept:
@@ -282,19 +765,18 @@ class QallseBase(ABC):
                             key = (str(t1), str(t2))
                             if key not in Q and tuple(reversed(key)) not in Q:
                                 Q[key] = self._compute_conflict_strength(t1, t2)
+        return Q
 
-        n_excl_couplers = len(Q) - n_vars
+    def _qubo_couplers(self) -> TQubo:
         # 2b: inclusion couplers (consecutive doublets with a good triplet)
-        for q in quadruplets:
+        Q = {}
+        if isinstance(self.quadruplets, QuadrupletRecords):
+            # quadruplets generated by chunks: stream the records (possibly memory-mapped)
+            names = [str(t) for t in self.triplets]
+            for t1, t2, strength in self.quadruplets.iter_records('t1', 't2', 'strength'):
+                Q[(names[t1], names[t2])] = strength
+            return Q
+        for q in self.quadruplets:
             key = (str(q.t1), str(q.t2))
             Q[key] = q.strength
-
-        n_incl_couplers = len(Q) - (n_vars + n_excl_couplers)
-        exec_time = time.process_time() - start_time
-
-        self.logger.info(f'Qubo generated in {exec_time:.2f}s. Size: {len(Q)}. Vars: {n_vars}, '
-                         f'excl. couplers: {n_excl_couplers}, incl. couplers: {n_incl_couplers}')
-        if return_stats:
-            return Q, (n_vars, n_incl_couplers, n_excl_couplers)
-        else:
-            return Q
+        return Q
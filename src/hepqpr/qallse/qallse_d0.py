@@ -4,6 +4,11 @@ from .utils import define_circle
 
 
 class D0Config(MpConfig):
+    _stages = dict(
+        MpConfig._stages,
+        d0_factor='qubo_weights', d0_denom='qubo_weights', z0_factor='qubo_weights', z0_denom='qubo_weights',
+        beamspot_width='qubo_weights', beamspot_center='qubo_weights')
+
     #: multiplier for the d0 part of the weight
     d0_factor = 0.5
     #: denominator in the d0 exponent: exp(d0/d0_denom)
@@ -0,0 +1,82 @@
+"""
+This module contains a compact formulation of the QUBO, where the variables are the doublets instead of the triplets.
+
+The model building (doublets, triplets, quadruplets and selection) and all the cuts are the ones of
+:py:class:`hepqpr.qallse.QallseD0`. Only the QUBO differs:
+
+* each doublet kept in the QUBO is a variable, with a small positive bias (`qubo_doublet_bias`);
+* each kept triplet becomes an inclusion coupler between its two doublets. Its strength is the weight of the
+  triplet, plus half of the strength of every kept quadruplet it is part of. A chain of doublets thus gets the same
+  inclusion energy as the corresponding chain of triplets in the triplet formulation;
+* two doublets starting or ending at the same hit are in conflict (exclusion coupler).
+
+The variables are named after the doublets, so the samples can be processed with
+:py:meth:`hepqpr.qallse.QallseBase.process_sample` and :py:class:`hepqpr.qallse.TrackRecreaterD` as usual.
+
+Compared to the triplet formulation, there are about as many variables (doublets instead of triplets), but far
+fewer couplers: the exclusion couplers only involve the conflicting doublets themselves, not all the pairs of
+triplets using them. The price is that the quadruplet information is folded into pairwise couplers.
+"""
+
+import itertools
+
+from .data_structures import *
+from .qallse_d0 import QallseD0, D0Config
+
+
+class DoubletsConfig(D0Config):
+    # the triplet weights are now part of the inclusion couplers
+    _stages = dict(
+        D0Config._stages,
+        **{k: 'qubo_couplers' for k, v in D0Config._stages.items() if v == 'qubo_weights'},
+        qubo_doublet_bias='qubo_weights')
+
+    #: Linear bias weight associated to doublets in the QUBO. It should be positive, so that doublets
+    #: that are not part of any chain are not in the solution.
+    qubo_doublet_bias = 0.1
+
+
+class QallseDoublets(QallseD0):
+    """Same as QallseD0, but generate a QUBO using doublets as variables."""
+    config: DoubletsConfig
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def _get_base_config(self):
+        return DoubletsConfig()
+
+    def _fit_qubo_budget(self, n_vars: int, n_couplers: int, exact=True) -> bool:
+        # Before the QUBO is generated, the lower bounds are based on the triplets and quadruplets.
+        # Here, there is one variable per doublet and at least one coupler per triplet.
+        if not exact:
+            n_vars, n_couplers = len(self.qubo_doublets), len(self.qubo_triplets)
+        return super()._fit_qubo_budget(n_vars, n_couplers, exact)
+
+    def _qubo_weights(self) -> TQubo:
+        # 1: qbits with their weight (doublets with a common weight)
+        bias = self.config.qubo_doublet_bias
+        return dict(((str(d), str(d)), bias) for d in self.qubo_doublets)
+
+    def _qubo_conflicts(self) -> TQubo:
+        # 2a: exclusion couplers (no two doublets can start or end at the same hit)
+        Q = {}
+        for hit in self.qubo_hits.values():
+            for conflicts in [hit.inner_kept, hit.outer_kept]:
+                for (d1, d2) in itertools.combinations(sorted(conflicts, key=str), 2):
+                    Q[(str(d1), str(d2))] = self.config.qubo_conflict_strength
+        return Q
+
+    def _qubo_couplers(self) -> TQubo:
+        # 2b: inclusion couplers (consecutive doublets with a good triplet). The strength of each quadruplet
+        # is shared by the couplers of its two triplets.
+        strengths = dict((t, self._compute_weight(t)) for t in self.qubo_triplets)
+        if isinstance(self.quadruplets, QuadrupletRecords):
+            qplets = ((self.triplets[t1], self.triplets[t2], strength)
+                      for t1, t2, strength in self.quadruplets.iter_records('t1', 't2', 'strength'))
+        else:
+            qplets = ((q.t1, q.t2, q.strength) for q in self.quadruplets)
+        for t1, t2, strength in qplets:
+            strengths[t1] += strength / 2
+            strengths[t2] += strength / 2
+        return dict(((str(t.d1), str(t.d2)), s) for t, s in strengths.items())
@@ -2,7 +2,6 @@ import time
 
 from .data_structures import *
 from .qallse import Qallse, Config1GeV
-from .qallse_base import QallseBase
 
 
 class MpConfig(Config1GeV):
@@ -12,40 +11,25 @@ class MpConfig(Config1GeV):
     #: likely to not appear in the QUBO.
     min_qplet_path = 2
 
+    _stages = dict(Config1GeV._stages, min_qplet_path='selection')
+
 
 class QallseMp(Qallse):
     """ Same as Qallse, but also applies a *max path* cut in order to discard isolated quadruplets."""
     config: MpConfig
 
+    qubo_budget_steps = Qallse.qubo_budget_steps[:3] + [dict(min_qplet_path=3)] + Qallse.qubo_budget_steps[3:]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     def _get_base_config(self):
         return MpConfig()
 
-    def _find_max_path(self, qplet: Quadruplet, direction=0):
-        # Use recursion to compute the max path, i.e. the longest chain of qplets
-        # this qplet is part of. The return value is always >= 1.
-        # Use direction = 0 to initiate the recursion, then direction = -1 is
-        # "inner", direction = 1 is "outer".
-        inner_length = 0
-        outer_length = 0
-
-        if direction <= 0 and len(qplet.t1.inner):
-            ls = (self._find_max_path(q, direction=-1) for q in qplet.t1.inner)
-            inner_length = max(ls) if len(qplet.t1.inner) > 1 else next(ls)
-        if direction >= 0 and len(qplet.t2.outer):
-            ls = (self._find_max_path(q, direction=1) for q in qplet.t2.outer)
-            outer_length = max(ls) if len(qplet.t2.outer) > 1 else next(ls)
-
-        return 1 + inner_length + outer_length
-
+    def _select_qubo_quadruplets(self):
+        # Apply the max path cut on the current quadruplets, discarding previous max path statistics.
+        self.hard_cuts_stats = [s for s in self.hard_cuts_stats if ',max_path,' not in s]
 
-    def build_model(self, *args, **kwargs):
-        # create the model as usual
-        QallseBase.build_model(self, *args, **kwargs)
-
-        # filter quadruplets
         start_time = time.process_time()
         dropped = self._filter_quadruplets()
         exec_time = time.process_time() - start_time
@@ -54,29 +38,60 @@ class QallseMp(Qallse):
             f'MaxPath done in {exec_time:.2f}s. '
             f'doublets: {len(self.qubo_doublets)}, triplets: {len(self.qubo_triplets)}, ' +
             f'quadruplets: {len(self.quadruplets)} (dropped {dropped})')
-        self.log_build_stats()
 
     def _filter_quadruplets(self) -> int:
         # Here, we compute the max path for each quadruplet and keep only the ones that
         # belong to long tracks (see :py:attr:`~MpConfig.min_qplet_path`).
         # Only triplets part of the kept quadruplet will appear in the QUBO
         # (see :py:meth:`hepqr.qallse.qallse_base.QallseBase._register_qubo_quadruplet`)
-        filtered_qplets = []
-
-        for qplet in self.quadruplets:
-            qplet.max_path = self._find_max_path(qplet)
-            if qplet.max_path >= self.config.min_qplet_path:
-                # keep qplet and register the structures it is made of
-                filtered_qplets.append(qplet)
-                self._register_qubo_quadruplet(qplet)
-            elif self.dataw.is_real_xplet(qplet.hit_ids()) == XpletType.REAL:
+        if self.qplet_records is None:
+            triplets_index = dict((t, i) for i, t in enumerate(self.triplets))
+            t1_index = np.array([triplets_index[q.t1] for q in self.quadruplets], dtype=np.int64)
+            t2_index = np.array([triplets_index[q.t2] for q in self.quadruplets], dtype=np.int64)
+            n_qplets = len(self.quadruplets)
+        else:
+            t1_index, t2_index = self.qplet_records['t1'], self.qplet_records['t2']
+            n_qplets = len(self.qplet_records)
+
+        max_paths = self._compute_max_paths(t1_index, t2_index)
+        keep = max_paths >= self.config.min_qplet_path
+
+        for i in np.flatnonzero(~keep).tolist():
+            hit_ids = self.triplets[t1_index[i]].hit_ids() + [self.triplets[t2_index[i]].hits[-1].hit_id]
+            if self.dataw.is_real_xplet(hit_ids) == XpletType.REAL:
                 # we are dropping a real qplet here, log it !
-                self.hard_cuts_stats.append(f'qplet,{qplet},max_path,{qplet.max_path},')
+                self.hard_cuts_stats.append(f'qplet,{Xplet.hit_ids_to_name(hit_ids)},max_path,{max_paths[i]},')
+
+        if self.qplet_records is None:
+            for qplet, max_path in zip(self.quadruplets, max_paths.tolist()):
+                qplet.max_path = max_path
+            filtered_qplets = [q for q, k in zip(self.quadruplets, keep) if k]
+            # keep qplets and register the structures they are made of
+            for qplet in filtered_qplets:
+                self._register_qubo_quadruplet(qplet)
+        else:
+            filtered_qplets = QuadrupletRecords(self.qplet_records[keep], self.triplets, max_path=max_paths[keep])
+            self._register_qubo_records(filtered_qplets)
 
-        dropped = len(self.quadruplets) - len(filtered_qplets)
         self.quadruplets = filtered_qplets
-
-        return dropped
+        return n_qplets - len(filtered_qplets)
+
+    def _compute_max_paths(self, t1_index: np.ndarray, t2_index: np.ndarray) -> np.ndarray:
+        # Compute the max path of each quadruplet, i.e. the longest chain of quadruplets it is part of (always >= 1),
+        # from the indexes of their triplets.
+        # inner[t] (resp. outer[t]) is the length of the longest chain of quadruplets ending (resp. starting)
+        # at triplet t. They are computed by relaxation: after k iterations, all chains of length <= k are found.
+        n_triplets = len(self.triplets)
+        inner, outer = np.zeros(n_triplets, dtype=np.int64), np.zeros(n_triplets, dtype=np.int64)
+        for _ in range(n_triplets):
+            new_inner, new_outer = np.zeros_like(inner), np.zeros_like(outer)
+            np.maximum.at(new_inner, t2_index, inner[t1_index] + 1)
+            np.maximum.at(new_outer, t1_index, outer[t2_index] + 1)
+            if np.array_equal(new_inner, inner) and np.array_equal(new_outer, outer):
+                break
+            inner, outer = new_inner, new_outer
+
+        return 1 + inner[t1_index] + outer[t2_index]
 
     def _create_quadruplets(self, register_qubo=False):
         # don't register quadruplet now, do it in a second pass
@@ -0,0 +1,210 @@
+"""
+This module contains an on-disk cache of QUBOs, to avoid building the same model again when re-solving a QUBO
+with other seeds or samplers, or when re-running benchmark scripts.
+
+Entries are *content-addressed*: the key is a hash of the hits, the truth, the input doublets, the model class,
+the model configuration and any other argument that changes the result (build arguments, QUBO markers).
+An entry holds the QUBO and the xplets (see :py:meth:`hepqpr.qallse.dumper.serialize_xplets`), kept serialized so
+that loading an entry only takes milliseconds.
+When the cache grows above its maximum size, the least recently used entries are evicted.
+
+Example usage:
+
+.. code::
+
+    cache = QuboCache('/tmp/qubo-cache')
+    model = QallseD0(dw)
+    entry = build_qubo(model, doublets, cache=cache)
+    Q = entry['qubo']
+
+.. warning::
+    The code of the models is not part of the key: clear the cache after modifying a model.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# bump it when the content of the entries changes
+_cache_version = 2
+
+
+class QuboCache:
+    """A directory of pickled QUBOs and xplets, indexed by a hash of everything used to build them."""
+
+    def __init__(self, cache_dir: str, max_size: int = 1 << 30):
+        """
+        :param cache_dir: where to store the entries. It is created if needed.
+        :param max_size: maximum size of the cache in bytes. Least recently used entries are evicted above it.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, model, doublets, **kwargs) -> str:
+        """
+        Compute the key of a model.
+
+        :param model: an implementation of :py:class:`hepqpr.qallse.QallseBase`, built or not
+        :param doublets: the input doublets
+        :param kwargs: any other parameter changing the QUBO or the xplets (build parameters, markers, ...)
+        :return: an hexadecimal hash
+        """
+        h = hashlib.sha256()
+        for df in [model.dataw.hits, model.dataw.truth]:
+            h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        h.update(np.ascontiguousarray(np.asarray(doublets, dtype=np.int64)).tobytes())
+        h.update(self._describe(model, kwargs).encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Load an entry. Corrupt entries or entries stored under another description are deleted.
+
+        :param key: see :py:meth:~`key`
+        :return: the entry, or None if it is not in the cache
+        """
+        fname = self._path(key)
+        if not os.path.exists(fname):
+            return None
+        try:
+            with open(fname, 'rb') as f:
+                entry = pickle.load(f)
+            if entry.get('key') != key or entry.get('version') != _cache_version:
+                raise ValueError('key mismatch')
+        except Exception as err:
+            logger.warning(f'Invalid cache entry {fname} ({err}), deleting it.')
+            self._remove(fname)
+            return None
+        # mark it as recently used
+        os.utime(fname)
+        return entry
+
+    def put(self, key: str, entry: Dict):
+        """
+        Store an entry and evict the least recently used entries if the cache is too big.
+
+        :param key: see :py:meth:~`key`
+        :param entry: a dictionary with (at least) the `qubo` and `xplets` keys
+        """
+        fname = self._path(key)
+        tmp_fname = f'{fname}.{os.getpid()}.tmp'
+        with open(tmp_fname, 'wb') as f:
+            pickle.dump(dict(entry, key=key, version=_cache_version), f, protocol=pickle.HIGHEST_PROTOCOL)
+        # atomic, so that concurrent readers never see a partial entry
+        os.replace(tmp_fname, fname)
+        self._evict(keep=fname)
+
+    def clear(self):
+        """Delete all the entries."""
+        for fname in self._entries():
+            self._remove(fname)
+
+    # ---------------------------------------------
+
+    def _describe(self, model, kwargs) -> str:
+        # Textual description of everything but the data.
+        cls = type(model)
+        return json.dumps(dict(
+            cls=f'{cls.__module__}.{cls.__qualname__}',
+            config=model.config.as_dict(),
+            kwargs=kwargs,
+        ), sort_keys=True, default=repr)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def _entries(self):
+        return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.pickle')]
+
+    def _remove(self, fname):
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+
+    def _evict(self, keep):
+        # Remove the least recently used entries (by modification time) until the cache fits in max_size.
+        entries = []
+        for fname in self._entries():
+            try:
+                st = os.stat(fname)
+                entries.append((st.st_mtime, st.st_size, fname))
+            except OSError:
+                pass  # removed by another process
+        total_size = sum(e[1] for e in entries)
+        for _, size, fname in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if fname != keep:
+                self._remove(fname)
+                total_size -= size
+                logger.debug(f'Evicted {fname} from the QUBO cache.')
+
+
+def build_qubo(model, doublets, cache: QuboCache = None, qubo_kwargs: Dict = None, xplets_format='pickle',
+               **build_kwargs) -> Dict:
+    """
+    Build a model and generate its QUBO, unless they are already in the cache.
+    On a cache hit, the model is left untouched, except for :py:attr:`hepqpr.qallse.QallseBase.qubo_budget_updates`.
+
+    :param model: an implementation of :py:class:`hepqpr.qallse.QallseBase`, not built yet
+    :param doublets: the input doublets
+    :param cache: the cache to use. If None, always build the model.
+    :param qubo_kwargs: markers to use in the QUBO, see :py:meth:`hepqpr.qallse.dumper.use_markers`.
+        Default to the real coefficients.
+    :param xplets_format: the format of the xplets, see :py:meth:`hepqpr.qallse.dumper.serialize_xplets`
+    :param build_kwargs: extra parameters passed to :py:meth:`hepqpr.qallse.QallseBase.build_model`
+    :return: a dictionary with the QUBO (`qubo`), the serialized xplets (`xplets`, see
+        :py:meth:`hepqpr.qallse.dumper.dump_xplets`), the number of doublets, triplets and
+        quadruplets used in the QUBO (`stats`), the configuration updates applied to fit the QUBO budget
+        (`qubo_budget_updates`), the cpu and wall times of :py:meth:`hepqpr.qallse.QallseBase.build_model`
+        (`build_time`) and of the QUBO generation and xplets serialization (`qubo_time`), and whether the entry was
+        loaded from the cache (`cache_hit`). On a cache hit, the times are the ones measured when the entry was
+        built, and the time spent loading the entry is given in `load_time` (wall time).
+    """
+    from .dumper import use_markers, serialize_xplets
+
+    qubo_kwargs = dict(dict(w_marker=None, c_marker=None), **(qubo_kwargs or dict()))
+    if cache is not None:
+        start_time = time.perf_counter()
+        # the build parameters that only change the way the model is built (not the result) are not part of the key
+        key_kwargs = dict((k, v) for k, v in build_kwargs.items()
+                          if k not in ['phi_sectors', 'eta_sectors', 'n_jobs', 'qplet_chunk_size', 'scratch_dir'])
+        key = cache.key(model, doublets, qubo_kwargs=qubo_kwargs, xplets_format=xplets_format, **key_kwargs)
+        entry = cache.get(key)
+        if entry is not None:
+            model.qubo_budget_updates = entry['qubo_budget_updates']
+            exec_time = time.perf_counter() - start_time
+            logger.info(f'QUBO loaded from the cache in {exec_time * 1000:.1f}ms ({key[:12]}). '
+                        f'Size: {len(entry["qubo"])}.')
+            return dict(entry, cache_hit=True, load_time=exec_time)
+
+    start = time.process_time(), time.perf_counter()
+    model.build_model(doublets, **build_kwargs)
+    built = time.process_time(), time.perf_counter()
+    with use_markers(model, **qubo_kwargs) as altered_model:
+        Q = altered_model.to_qubo()
+    entry = dict(
+        qubo=Q,
+        # keep the xplets serialized, so that loading an entry stays fast (they are usually just written to disk)
+        xplets=serialize_xplets(model, xplets_format),
+        stats=dict(n_doublets=len(model.qubo_doublets), n_triplets=len(model.qubo_triplets),
+                   n_qplets=len(model.quadruplets)),
+        qubo_budget_updates=model.qubo_budget_updates)
+    end = time.process_time(), time.perf_counter()
+    entry['build_time'] = [built[0] - start[0], built[1] - start[1]]
+    entry['qubo_time'] = [end[0] - built[0], end[1] - built[1]]
+
+    if cache is not None:
+        cache.put(key, entry)
+    return dict(entry, cache_hit=False)
@@ -0,0 +1,157 @@
+"""
+This module contains QUBO templates, to generate many QUBOs differing only by their bias weight and conflict strength
+without building the model again.
+
+A template is the structure of a QUBO stored as arrays (see :py:meth:`hepqpr.qallse.utils.qubo_to_arrays`), plus a
+category code for each entry: bias (linear weight), conflict (exclusion coupler) or inclusion. A concrete QUBO is
+generated by assigning the new values to all the entries of a category at once, instead of walking the QUBO
+dictionary like :py:meth:`hepqpr.qallse.utils.transform_qubo`.
+
+Example usage:
+
+.. code::
+
+    template = QuboTemplate.from_model(model)
+    for conflict_strength in [0.5, 0.75, 1]:
+        Q = template.instantiate(conflict_strength=conflict_strength)
+        # or, skipping the dictionary altogether:
+        bqm = template.to_bqm(conflict_strength=conflict_strength)
+
+Templates can also be created from QUBOs dumped with markers (see :py:meth:`hepqpr.qallse.dumper.use_markers`).
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+from .type_alias import *
+from .utils import qubo_to_arrays, arrays_to_qubo
+
+
+class QuboTemplate:
+    """Structure of a QUBO, with the category of each entry."""
+
+    #: Category code of the linear weights
+    BIAS = 0
+    #: Category code of the exclusion couplers
+    CONFLICT = 1
+    #: Category code of the inclusion couplers
+    INCLUSION = 2
+
+    def __init__(self, names: np.ndarray, rows: np.ndarray, cols: np.ndarray, codes: np.ndarray,
+                 values: np.ndarray):
+        """
+        :param names: the variable names, see :py:meth:`hepqpr.qallse.utils.qubo_to_arrays`
+        :param rows: the index of the first variable of each entry
+        :param cols: the index of the second variable of each entry
+        :param codes: the category of each entry (:py:attr:`BIAS`, :py:attr:`CONFLICT` or :py:attr:`INCLUSION`)
+        :param values: the default coefficient of each entry, used when no new value is given for its category.
+            NaN if unknown.
+        """
+        self.names, self.rows, self.cols = names, rows, cols
+        self.codes = np.asarray(codes, dtype=np.int8)
+        self.values = np.asarray(values, dtype=np.float64)
+        self._masks = dict((c, self.codes == c) for c in [self.BIAS, self.CONFLICT, self.INCLUSION])
+        # keys of the QUBO dictionary and variable names, computed on the first call to instantiate or to_bqm
+        self._keys, self._variables = None, None
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_model(cls, model) -> 'QuboTemplate':
+        """
+        Create a template from a built model. The default values are the ones of the model's QUBO.
+
+        :param model: an implementation of :py:class:`hepqpr.qallse.QallseBase`, built
+        :return: a template
+        """
+        Q = model.to_qubo()
+        weights, conflicts, couplers = [model._qubo_parts[s] for s in model.qubo_stages]
+        if len(weights.keys() & conflicts.keys()):
+            # e.g. the star mode of Qallse: those entries mix a bias and conflicts
+            raise ValueError('Conflicts with linear terms are not supported by templates')
+
+        names, rows, cols, values = qubo_to_arrays(Q)
+        codes = np.fromiter(
+            (cls.INCLUSION if k in couplers else cls.CONFLICT if k in conflicts else cls.BIAS for k in Q.keys()),
+            dtype=np.int8, count=len(Q))
+        return cls(names, rows, cols, codes, values)
+
+    @classmethod
+    def from_qubo(cls, Q: TQubo, bw_marker=10, cs_marker=20) -> 'QuboTemplate':
+        """
+        Create a template from a QUBO generated with markers (same defaults as
+        :py:meth:`hepqpr.qallse.utils.transform_qubo`). Entries with another value are inclusion couplers.
+        Markers don't have a default value.
+
+        :param Q: the QUBO, with markers
+        :param bw_marker: the marker used for bias weights
+        :param cs_marker: the marker used for conflict strengths
+        :return: a template
+        """
+        codes = np.fromiter(
+            (cls.BIAS if v == bw_marker else cls.CONFLICT if v == cs_marker else cls.INCLUSION for v in Q.values()),
+            dtype=np.int8, count=len(Q))
+        values = [np.nan if c != cls.INCLUSION else v for c, v in zip(codes.tolist(), Q.values())]
+        names, rows, cols, _ = qubo_to_arrays(dict.fromkeys(Q.keys(), 0))
+        return cls(names, rows, cols, codes, values)
+
+    def instantiate_values(self, bias_weight=None, conflict_strength=None) -> np.ndarray:
+        """
+        Compute the coefficients of a concrete QUBO.
+
+        :param bias_weight: the new value of all the bias weights. If None, use the default values.
+        :param conflict_strength: the new value of all the conflict strengths. If None, use the default values.
+        :return: the coefficient of each entry, in the template order
+        """
+        values = self.values.copy()
+        if bias_weight is not None:
+            values[self._masks[self.BIAS]] = bias_weight
+        if conflict_strength is not None:
+            values[self._masks[self.CONFLICT]] = conflict_strength
+        if np.isnan(values).any():
+            raise ValueError('Missing values: set both the bias weight and the conflict strength')
+        return values
+
+    def instantiate(self, bias_weight=None, conflict_strength=None) -> TQubo:
+        """
+        Generate a concrete QUBO dictionary. See :py:meth:`instantiate_values` for the parameters.
+
+        :return: the QUBO, with the same entries in the same order as the original one
+        """
+        values = self.instantiate_values(bias_weight, conflict_strength)
+        if self._keys is None:
+            self._keys = list(arrays_to_qubo(self.names, self.rows, self.cols, values).keys())
+        return dict(zip(self._keys, values.tolist()))
+
+    def to_bqm(self, bias_weight=None, conflict_strength=None):
+        """
+        Generate a concrete QUBO as a `dimod.BinaryQuadraticModel`, that can be passed directly to
+        a dimod sampler. See :py:meth:`instantiate_values` for the parameters.
+
+        :return: a binary quadratic model
+        """
+        import dimod
+        values = self.instantiate_values(bias_weight, conflict_strength)
+        diag = self.rows == self.cols
+        linear = np.bincount(self.rows[diag], weights=values[diag], minlength=len(self.names))
+        quadratic = (self.rows[~diag], self.cols[~diag], values[~diag])
+        if self._variables is None:
+            self._variables = self.names.astype(str).tolist()
+        return dimod.BinaryQuadraticModel.from_numpy_vectors(
+            linear, quadratic, 0.0, dimod.BINARY, variable_order=self._variables)
+
+    def save(self, fname: str):
+        """Save the template as a numpy archive (`.npz`)."""
+        np.savez(fname, names=self.names, rows=self.rows, cols=self.cols, codes=self.codes, values=self.values)
+
+    @classmethod
+    def load(cls, fname: str) -> 'QuboTemplate':
+        """Load a template saved with :py:meth:`save`."""
+        with np.load(fname) as npz:
+            return cls(*[npz[k] for k in ['names', 'rows', 'cols', 'codes', 'values']])
+
+    def to_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Return the names, rows, cols, codes and values arrays (see :py:meth:`__init__`)."""
+        return self.names, self.rows, self.cols, self.codes, self.values
@@ -0,0 +1,98 @@
+"""
+This module contains the helpers used to build a model in parallel, by splitting the hits into sectors
+(see :py:meth:`hepqpr.qallse.QallseBase.build_model`).
+
+Each sector is made of *core* hits, selected using their phi (and optionally eta) coordinates. A sector owns all
+the triplets and quadruplets starting at one of its core hits. To build them, a worker needs the doublets
+reachable from the core hits in up to three hops (towards the outside of the detector): this is the overlap
+between sectors. Since it is derived from the doublets themselves, nothing is lost at the sector borders and the
+merged model is identical to the one built serially.
+"""
+
+import copy
+import logging
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .dumper import _attributes_to_columns
+
+# template model used by the current worker process, see _init_sector_worker
+_sector_model = None
+
+
+def partition_hits(hits: pd.DataFrame, phi_sectors=8, eta_sectors=1) -> List[np.ndarray]:
+    """
+    Split hits into disjoint sectors, using phi slices of equal width and eta slices of equal population.
+
+    :param hits: the hits, with the `r` column (see :py:class:`hepqpr.qallse.DataWrapper`)
+    :param phi_sectors: the number of slices in phi
+    :param eta_sectors: the number of slices in eta
+    :return: a list of hit ids for each sector
+    """
+    phi = np.arctan2(hits.y.values, hits.x.values)
+    phi_bin = np.minimum(((phi + np.pi) / (2 * np.pi) * phi_sectors).astype(int), phi_sectors - 1)
+
+    eta = -np.log(np.tan(np.arctan2(hits.r.values, hits.z.values) / 2))
+    eta_edges = np.percentile(eta, np.linspace(0, 100, eta_sectors + 1)[1:-1])
+    eta_bin = np.searchsorted(eta_edges, eta)
+
+    sectors = phi_bin * eta_sectors + eta_bin
+    hit_ids = hits.hit_id.values
+    return [hit_ids[sectors == s] for s in range(phi_sectors * eta_sectors)]
+
+
+def sector_doublets(doublets: np.ndarray, core: np.ndarray) -> np.ndarray:
+    """
+    Find the doublets a sector needs to build the triplets and quadruplets starting at its core hits.
+
+    :param doublets: the doublets of the event, as an array of hit ids with shape `(n, 2)`
+    :param core: the hit ids of the sector
+    :return: the doublets of the sector
+    """
+    start, end = doublets[:, 0], doublets[:, 1]
+    hop1 = np.union1d(core, end[np.isin(start, core)])
+    hop2 = np.union1d(hop1, end[np.isin(start, hop1)])
+    return doublets[np.isin(start, hop2)]
+
+
+def _init_sector_worker(model):
+    # Store the template model (a model without any xplet) in the worker process.
+    global _sector_model
+    model.logger = logging.getLogger(model.__module__)
+    _sector_model = model
+
+
+def _build_sector(core: np.ndarray, doublets: np.ndarray):
+    # Build the triplets and quadruplets starting at a core hit of the sector.
+    # Return the triplets and the quadruplets as arrays of hit ids and columns of attributes (so that the parent
+    # process doesn't have to recompute them, see hepqpr.qallse.dumper), and the hard cuts stats.
+    core = set(core.tolist())
+
+    model = copy.copy(_sector_model)
+    model.hits = dict((hid, _sector_model.hits[hid].detached_copy()) for hid in np.unique(doublets).tolist())
+    model.hard_cuts_stats = _sector_model.hard_cuts_stats[:1]
+    model._create_doublets(doublets.tolist())
+    doublets = model.doublets
+
+    # the triplets of the sector
+    model.doublets = [d for d in doublets if d.h1.hit_id in core]
+    model._create_triplets()
+    triplets = model.triplets
+    # the outer triplets they are connected to, only needed to build the quadruplets
+    outer = set(t.d2 for t in triplets)
+    model.doublets = [d for d in doublets if d in outer and d.h1.hit_id not in core]
+    model._create_triplets()
+
+    model.triplets = triplets
+    model._create_quadruplets(register_qubo=False)
+
+    stats = [row for row in model.hard_cuts_stats[1:]
+             if not row.startswith('dblet') and int(row.split(',')[1].split('_')[0]) in core]
+
+    return np.array([t.hit_ids() for t in model.triplets], dtype=np.int64).reshape(-1, 3), \
+           _attributes_to_columns(model.triplets), \
+           np.array([q.hit_ids() for q in model.quadruplets], dtype=np.int64).reshape(-1, 4), \
+           _attributes_to_columns(model.quadruplets), \
+           stats
@@ -1,5 +1,5 @@
 import math
-from typing import Union
+from typing import Union, Iterable, Set
 
 import numpy as np
 import pandas as pd
@@ -223,3 +223,143 @@ def transform_qubo(Q, bias_weight, conflict_strength, bw_marker=10, cs_marker=20
         else:
             Q2[k] = v
     return Q2
+
+
+def split_qubo(Q: TQubo) -> List[TQubo]:
+    """
+    Split a QUBO into its connected components, i.e. into sub-QUBOs sharing no variable that can be solved
+    independently. The energy of a sample is the sum of the energies of its restrictions to the components.
+
+    :param Q: the QUBO
+    :return: the list of components, ordered by decreasing number of entries
+    """
+    parent = dict()
+
+    def find(v):
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]  # path halving
+            v = parent[v]
+        return v
+
+    for (k1, k2) in Q.keys():
+        parent.setdefault(k1, k1)
+        parent.setdefault(k2, k2)
+        r1, r2 = find(k1), find(k2)
+        if r1 != r2:
+            parent[r1] = r2
+
+    components = dict()
+    for (k1, k2), v in Q.items():
+        components.setdefault(find(k1), dict())[(k1, k2)] = v
+    return sorted(components.values(), key=len, reverse=True)
+
+
+#: Prefix of the names of the auxiliary variables of a QUBO, i.e. the variables that are not xplets, such as the
+#: doublets of the `star` conflict mode (see :py:class:`hepqpr.qallse.qallse.Config`). The rest of the name is the
+#: name of the xplet the variable stands for.
+AUXILIARY_PREFIX = 'aux_'
+
+
+def is_auxiliary_variable(name: str) -> bool:
+    """Return True if `name` is the name of an auxiliary variable (see :py:data:`AUXILIARY_PREFIX`)."""
+    return name.startswith(AUXILIARY_PREFIX)
+
+
+def find_auxiliary_variables(keys: Iterable[Tuple[str, str]]) -> Set[str]:
+    """
+    Find the auxiliary variables of a QUBO, i.e. the variables named with :py:data:`AUXILIARY_PREFIX`. Those are the
+    auxiliary variables of the `star` conflict mode (see :py:class:`hepqpr.qallse.qallse.Config`).
+
+    :param keys: the keys of the QUBO, or only the ones of its couplers
+    :return: the names of the auxiliary variables
+    """
+    return set(k for key in keys for k in key if is_auxiliary_variable(k))
+
+
+def select_chains(variables, couplers: TQubo, max_strength: float = 0, auxiliary: Set[str] = None) -> TDimodSample:
+    """
+    Build a sample by turning on the variables of the strongest inclusion couplers without conflicts. The couplers
+    are considered from the strongest (most negative) to the weakest: both their variables are turned on, unless one
+    of them is in conflict with a variable already turned on.
+
+    Conflicts are derived from the names of the variables, so that they don't depend on the formulation of the
+    exclusion couplers: two variables are in conflict if they use two different doublets starting or ending at the
+    same hit (a variable named like a doublet uses itself, a variable named like a triplet its two doublets).
+    The auxiliary variables are then turned on if their doublet is used by a variable turned on.
+
+    :param variables: all the variables of the sample
+    :param couplers: the inclusion couplers (entries with a negative coefficient)
+    :param max_strength: ignore the inclusion couplers with a coefficient above (i.e. weaker than) it
+    :param auxiliary: the auxiliary variables, never part of the couplers considered
+    :return: a sample, with all the variables
+    """
+    sample = dict.fromkeys(variables, 0)
+    auxiliary = set() if auxiliary is None else auxiliary
+    doublets = dict()
+    for k in sample.keys():
+        hits = k[len(AUXILIARY_PREFIX):].split('_') if k in auxiliary else k.split('_')
+        doublets[k] = [(hits[i], hits[i + 1]) for i in range(len(hits) - 1)]
+    # the doublet used by the variables turned on, indexed by their start and end hit
+    used_start, used_end = dict(), dict()
+
+    def _is_free(k):
+        return all(used_start.get(d[0], d) == d and used_end.get(d[1], d) == d for d in doublets[k])
+
+    for (k1, k2), strength in sorted(couplers.items(), key=lambda kv: kv[1]):
+        if strength >= max_strength:
+            break
+        if k1 in auxiliary or k2 in auxiliary or sample[k1] and sample[k2]:
+            continue
+        if _is_free(k1) and _is_free(k2):
+            for k in (k1, k2):
+                sample[k] = 1
+                for d in doublets[k]:
+                    used_start[d[0]], used_end[d[1]] = d, d
+
+    for k in auxiliary:
+        d = doublets[k][0]
+        sample[k] = int(used_start.get(d[0]) == d)
+    return sample
+
+
+def qubo_initial_state(Q: TQubo, max_strength: float = 0) -> TDimodSample:
+    """
+    Same as :py:meth:`hepqpr.qallse.QallseBase.initial_state`, but using only the QUBO: the couplers with a negative
+    coefficient are considered inclusions, except the ones of the auxiliary variables (see
+    :py:meth:`find_auxiliary_variables` and :py:meth:`select_chains`).
+
+    :param Q: the QUBO
+    :param max_strength: ignore the inclusion couplers with a coefficient above it
+    :return: a sample, with all the variables of the QUBO
+    """
+    variables = dict.fromkeys(k for key in Q.keys() for k in key)
+    couplers = dict((k, v) for k, v in Q.items() if k[0] != k[1] and v < 0)
+    return select_chains(variables, couplers, max_strength, find_auxiliary_variables(couplers.keys()))
+
+
+def qubo_to_arrays(Q: TQubo, dtype=np.float64) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convert a QUBO to arrays, storing each variable name only once. The order of the entries is preserved.
+
+    :param Q: the QUBO, with numeric coefficients
+    :param dtype: the type of the coefficients, usually `np.float64` or `np.float32`
+    :return: the variable names (as ascii bytes), the indexes of the first and second variable of each entry (int32)
+        and the coefficients
+    """
+    index = dict()
+    for (k1, k2) in Q.keys():
+        index.setdefault(k1, len(index))
+        index.setdefault(k2, len(index))
+    names = np.array(list(index.keys()), dtype=bytes)
+    rows = np.fromiter((index[k1] for (k1, _) in Q.keys()), dtype=np.int32, count=len(Q))
+    cols = np.fromiter((index[k2] for (_, k2) in Q.keys()), dtype=np.int32, count=len(Q))
+    values = np.fromiter(Q.values(), dtype=dtype, count=len(Q))
+    return names, rows, cols, values
+
+
+def arrays_to_qubo(names: np.ndarray, rows: np.ndarray, cols: np.ndarray, values: np.ndarray) -> TQubo:
+    """Inverse of :py:meth:`qubo_to_arrays`."""
+    names = names.astype(str).tolist()
+    return dict(zip(
+        zip([names[i] for i in rows.tolist()], [names[j] for j in cols.tolist()]),
+        values.tolist()))
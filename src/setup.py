@@ -45,7 +45,7 @@ setuptools.setup(
         'pandas>=0.23,<0.24',
         'trackml',
         'dwave-qbsolv==0.2.10',
-        'dwave-neal==0.4.5',
+        'dwave-neal==0.4.5',  # newer versions also support warm starts and interruptions, see cli.func
         'click==7.0',
         'jsonschema<3.0.0',
         'plotly>=3.4,<3.5'
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hepqpr.qallse import DataWrapper, Qallse
+
+#: Barrel layers: volume_id, layer_id, radius
+LAYERS = [(8, 2, 32), (8, 4, 72), (8, 6, 116), (8, 8, 172), (13, 2, 260), (13, 4, 360), (13, 6, 500),
+          (13, 8, 660), (17, 2, 820), (17, 4, 1020)]
+
+
+def make_event(n_tracks=60, n_noise=100, seed=0):
+    """Create a small synthetic event: helix tracks (high pt) crossing the barrel layers, plus noise hits."""
+    rng = np.random.RandomState(seed)
+    hits, truth = [], []
+    for particle_id in range(1, n_tracks + 1):
+        phi0, radius = rng.uniform(-np.pi, np.pi), rng.uniform(3000, 20000) * rng.choice([-1, 1])
+        cot, z0 = rng.uniform(-1, 1), rng.uniform(-20, 20)
+        for (volume_id, layer_id, r) in LAYERS:
+            if rng.rand() < 0.05: continue  # missing hit
+            phi = phi0 + np.arcsin(r / (2 * radius))
+            hits.append((r * np.cos(phi), r * np.sin(phi), z0 + cot * r, volume_id, layer_id))
+            truth.append((particle_id, 1 / 30))
+    for _ in range(n_noise):
+        volume_id, layer_id, r = LAYERS[rng.randint(len(LAYERS))]
+        phi = rng.uniform(-np.pi, np.pi)
+        hits.append((r * np.cos(phi), r * np.sin(phi), rng.uniform(-500, 500), volume_id, layer_id))
+        truth.append((0, 0.))
+
+    hits = pd.DataFrame(hits, columns=['x', 'y', 'z', 'volume_id', 'layer_id'])
+    hits.insert(0, 'hit_id', np.arange(1, len(hits) + 1))
+    hits['module_id'] = 0
+    truth = pd.DataFrame(truth, columns=['particle_id', 'weight'])
+    truth.insert(0, 'hit_id', hits.hit_id.values)
+
+    # doublets: hits one to three layers apart, close in phi and roughly pointing to the origin in R-Z
+    layer = np.array([[l[:2] for l in LAYERS].index(vl) for vl in zip(hits.volume_id, hits.layer_id)])
+    r, phi, z = np.hypot(hits.x.values, hits.y.values), np.arctan2(hits.y.values, hits.x.values), hits.z.values
+    start, end = np.nonzero((layer[None, :] - layer[:, None] >= 1) & (layer[None, :] - layer[:, None] <= 3))
+    dphi = np.abs((phi[end] - phi[start] + np.pi) % (2 * np.pi) - np.pi)
+    keep = (dphi < 0.08) & (np.abs((z[end] - z[start]) / (r[end] - r[start])) < 3)
+    doublets = pd.DataFrame(dict(start=hits.hit_id.values[start[keep]], end=hits.hit_id.values[end[keep]]))
+    return hits, truth, doublets
+
+
+@pytest.fixture(scope='session')
+def event():
+    """A synthetic event, as a DataWrapper and a dataframe of doublets."""
+    hits, truth, doublets = make_event()
+    return DataWrapper(hits, truth), doublets
+
+
+@pytest.fixture(scope='module')
+def qubo(event):
+    """The QUBO of :py:func:`event`, built with the default Qallse model."""
+    dw, doublets = event
+    return Qallse(dw).build_model(doublets).to_qubo()
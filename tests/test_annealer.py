@@ -0,0 +1,68 @@
+import dimod
+import numpy as np
+import pytest
+
+from hepqpr.qallse.annealer import CsrQubo, VectorizedAnnealer
+from hepqpr.qallse.cli.func import solve_neal
+
+
+def test_csr_qubo(qubo):
+    csr = CsrQubo.from_qubo(qubo)
+    bqm = dimod.BinaryQuadraticModel.from_qubo(qubo)
+    rng = np.random.RandomState(0)
+    X = rng.randint(0, 2, size=(5, len(csr)))
+    expected = [bqm.energy(dict(zip(csr.variables, x))) for x in X.tolist()]
+    assert csr.energies(X) == pytest.approx(expected)
+
+    # no coupler between two variables of the same colour
+    colors = np.zeros(len(csr), dtype=np.int64)
+    for c, variables in enumerate(csr.colors):
+        colors[variables] = c
+    rows = np.repeat(np.arange(len(csr)), np.diff(csr.indptr))
+    assert not np.any(colors[rows] == colors[csr.indices])
+    assert sum(len(c) for c in csr.colors) == len(csr)
+
+    # the columns of a colour cover all its couplers
+    colored, _, bounds = csr.colored()
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        columns = colored._coupler_columns(start, end)
+        assert sum(k for k, _, _ in columns) == colored.indptr[end] - colored.indptr[start]
+        weights = np.zeros(end - start)
+        for k, _, w in columns:
+            weights[:k] += w.ravel()
+        rows = np.repeat(np.arange(end - start), np.diff(colored.indptr[start:end + 1]))
+        expected = np.bincount(rows, colored.data[colored.indptr[start]:colored.indptr[end]], end - start)
+        assert weights == pytest.approx(expected, rel=1e-5, abs=1e-5)
+
+
+def test_reproducible(qubo):
+    r1 = VectorizedAnnealer().sample_qubo(qubo, num_reads=4, num_sweeps=200, seed=42)
+    r2 = VectorizedAnnealer().sample_qubo(qubo, num_reads=4, num_sweeps=200, seed=42)
+    assert np.array_equal(r1.record.sample, r2.record.sample)
+    assert np.array_equal(r1.record.energy, r2.record.energy)
+
+
+def test_energies(event, qubo):
+    dw, _ = event
+    response = VectorizedAnnealer().sample_qubo(qubo, num_reads=4, seed=42)
+    bqm = dimod.BinaryQuadraticModel.from_qubo(qubo)
+    for sample, energy in response.data(['sample', 'energy']):
+        assert energy == pytest.approx(bqm.energy(sample))
+    assert list(response.record.energy) == sorted(response.record.energy)
+    # as good as neal on an easy QUBO
+    neal_energy = solve_neal(qubo, seed=42, num_reads=4).first.energy
+    assert response.first.energy <= neal_energy + 0.01 * abs(neal_energy)
+    assert response.first.energy == pytest.approx(dw.compute_energy(qubo), rel=0.01)
+
+
+def test_warm_start(qubo):
+    csr = CsrQubo.from_qubo(qubo)
+    initial = dict((v, 0) for v in csr.variables)
+    response = VectorizedAnnealer().sample(csr, num_reads=2, num_sweeps=100, seed=1, initial_states=initial)
+    assert response.first.energy <= 0
+    assert response.info['beta_range'] == pytest.approx(csr.beta_range(warm=True))
+
+
+def test_invalid_schedule(qubo):
+    with pytest.raises(ValueError):
+        VectorizedAnnealer().sample_qubo(qubo, beta_schedule_type='unknown')
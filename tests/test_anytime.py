@@ -0,0 +1,39 @@
+import pytest
+
+from hepqpr.qallse.cli.func import solve_anytime, solve_annealer
+
+
+@pytest.mark.parametrize('solver', ['neal', 'annealer'])
+def test_plateau(qubo, solver):
+    response = solve_anytime(qubo, solver, time_budget=600, max_stall=2, seed=42, num_reads=1)
+    info = response.info
+    assert info['stop_reason'] == 'plateau'
+    trace = info['trace']
+    assert len(trace['timestamp']) == len(trace['energy']) == len(trace['best_energy']) == info['rounds'] >= 3
+    assert trace['timestamp'] == sorted(trace['timestamp'])
+    # the best energy is the minimum so far, and the last rounds did not improve it
+    assert trace['best_energy'] == sorted(trace['best_energy'], reverse=True)
+    assert all(b <= e for b, e in zip(trace['best_energy'], trace['energy']))
+    assert trace['best_energy'][-3] == trace['best_energy'][-1] == response.first.energy
+
+    # the rounds only depend on the seed
+    again = solve_anytime(qubo, solver, time_budget=600, max_stall=2, seed=42, num_reads=1)
+    assert again.info['trace']['energy'] == trace['energy']
+
+
+def test_deadline(qubo):
+    # a round is always run, the next one only if it can end before the deadline
+    response = solve_anytime(qubo, 'neal', time_budget=0, seed=42, num_reads=1)
+    assert response.info['stop_reason'] == 'deadline' and response.info['rounds'] == 1
+    assert response.info['trace']['best_energy'] == [response.first.energy]
+
+
+def test_deadline_no_interrupt(qubo, monkeypatch):
+    # older versions of neal cannot be interrupted: the rounds are only stopped between them
+    calls = []
+    monkeypatch.setattr('hepqpr.qallse.cli.func._neal_supports', lambda parameter: False)
+    monkeypatch.setattr('hepqpr.qallse.cli.func.solve_neal', lambda Q, **kwargs: calls.append(kwargs) or
+                        solve_annealer(Q, **kwargs))
+    response = solve_anytime(qubo, 'neal', time_budget=0, seed=42, num_reads=1)
+    assert response.info['stop_reason'] == 'deadline' and response.info['rounds'] == 1
+    assert calls == [dict(seed=42, num_reads=1)]
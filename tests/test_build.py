@@ -0,0 +1,176 @@
+import numpy as np
+import pytest
+
+from hepqpr.qallse import Qallse, QallseMp, QallseD0
+from hepqpr.qallse.data_structures import XpletType, Quadruplet, QuadrupletRecords
+from hepqpr.qallse.qallse_base import QuboBudgetExceeded
+
+
+def _norm(Q):
+    # conflicts can be stored as (t1, t2) or (t2, t1)
+    return dict((frozenset(k), v) for k, v in Q.items())
+
+
+@pytest.mark.parametrize('model_class', [Qallse, QallseMp, QallseD0])
+def test_slice_model(event, model_class):
+    # slicing a model gives the model of the subsampled event
+    dw, doublets = event
+    hit_ids = dw.hits.hit_id.values[dw.hits.hit_id.values % 3 != 0]
+    model = model_class(dw)
+    model.build_model(doublets)
+    sliced = model.slice_model(hit_ids)
+
+    sub_dw = dw.subset(sorted(hit_ids))
+    sub_doublets = doublets[doublets.start.isin(hit_ids) & doublets.end.isin(hit_ids)]
+    model = model_class(sub_dw)
+    model.build_model(sub_doublets)
+    # (the hard cuts stats can differ: removing hits from a track creates new real doublets in the subset)
+    assert _norm(sliced.to_qubo()) == _norm(model.to_qubo())
+    assert sorted(sliced.dataw.hits.hit_id) == sorted(hit_ids)
+
+
+@pytest.mark.parametrize('model_class,update', [
+    (Qallse, dict(qubo_bias_weight=1)),
+    (Qallse, dict(qubo_conflict_strength=2)),
+    (Qallse, dict(xy_power=2)),
+    (Qallse, dict(tplet_max_drz=0.15)),
+    (Qallse, dict(max_layer_span=1)),
+    (QallseMp, dict(min_qplet_path=3)),
+])
+def test_rebuild(event, model_class, update):
+    # rebuilding after a configuration update gives the model built from scratch with this configuration
+    dw, doublets = event
+    model = model_class(dw).build_model(doublets)
+    model.to_qubo()
+    model.config.update(**update)
+    Q = model.rebuild()
+    expected = model_class(dw, **update).build_model(doublets)
+    assert _norm(Q) == _norm(expected.to_qubo())
+    assert sorted(model.hard_cuts_stats) == sorted(expected.hard_cuts_stats)
+
+
+def test_rebuild_stages(event):
+    # only the linear weights are recomputed when the bias weight changes
+    dw, doublets = event
+    model = Qallse(dw).build_model(doublets)
+    Q = model.to_qubo()
+    stages = []
+    model._run_stages = stages.append
+    model.config.update(qubo_bias_weight=1)
+    assert model.rebuild() == dict((k, v + 1 if k[0] == k[1] else v) for k, v in Q.items())
+    assert stages == []
+    model.config.update(xy_power=2)
+    model.rebuild()
+    assert stages == ['quadruplets']
+
+
+@pytest.mark.parametrize('model_class', [Qallse, QallseMp])
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_sectors(event, model_class, n_jobs):
+    # the model built by sectors is the one built serially, xplets in the same order
+    dw, doublets = event
+    model = model_class(dw).build_model(doublets)
+    sectors = model_class(dw).build_model(doublets, phi_sectors=4, eta_sectors=2, n_jobs=n_jobs)
+    assert _norm(sectors.to_qubo()) == _norm(model.to_qubo())
+    assert sorted(sectors.hard_cuts_stats) == sorted(model.hard_cuts_stats)
+    for xplets in ['doublets', 'triplets', 'quadruplets']:
+        assert list(map(str, getattr(sectors, xplets))) == list(map(str, getattr(model, xplets)))
+    assert [t.curvature for t in sectors.triplets] == [t.curvature for t in model.triplets]
+
+
+@pytest.mark.parametrize('model_class', [Qallse, QallseMp, QallseD0])
+@pytest.mark.parametrize('chunk_size', [1, 50, 10 ** 6])
+def test_quadruplet_records(event, model_class, chunk_size):
+    # the quadruplets generated by chunks as records give the same QUBO
+    dw, doublets = event
+    model = model_class(dw).build_model(doublets)
+    chunked = model_class(dw).build_model(doublets, qplet_chunk_size=chunk_size)
+    assert len(chunked.qplet_records) == sum(len(t.outer) for t in model.triplets)
+    assert _norm(chunked.to_qubo()) == _norm(model.to_qubo())
+    assert sorted(chunked.hard_cuts_stats) == sorted(model.hard_cuts_stats)
+
+
+@pytest.mark.parametrize('model_class', [Qallse, QallseMp, QallseD0])
+def test_quadruplet_records_lazy(event, monkeypatch, model_class):
+    # the selection and the QUBO use the records, quadruplets are only created on access
+    dw, doublets = event
+    model = model_class(dw).build_model(doublets)
+    chunked = model_class(dw).build_model(doublets, qplet_chunk_size=100)
+
+    created = []
+    init = Quadruplet.__init__
+    monkeypatch.setattr(Quadruplet, '__init__', lambda self, *args: created.append(self) or init(self, *args))
+    chunked.config.update(qubo_bias_weight=1)
+    chunked.rebuild()
+    chunked._run_selection()
+    chunked.to_qubo()
+    assert created == []
+
+    assert isinstance(chunked.quadruplets, QuadrupletRecords)
+    assert len(chunked.quadruplets) == len(model.quadruplets)
+    assert [(str(q), q.strength) for q in chunked.quadruplets] == [(str(q), q.strength) for q in model.quadruplets]
+    assert str(chunked.quadruplets[-1]) == str(model.quadruplets[-1])
+
+
+@pytest.mark.parametrize('model_class', [Qallse, QallseMp])
+def test_scratch_dir(tmpdir, monkeypatch, event, model_class):
+    # the records are memory-mapped from an anonymous file, deleted right away, and read by blocks
+    dw, doublets = event
+    monkeypatch.setattr(QuadrupletRecords, 'block_size', 7)
+    model = model_class(dw).build_model(doublets)
+    scratch = model_class(dw).build_model(doublets, qplet_chunk_size=100, scratch_dir=str(tmpdir))
+    assert isinstance(scratch.qplet_records, np.memmap)
+    if model_class is Qallse:
+        # all the quadruplets are selected: the QUBO is streamed from the memory map
+        assert scratch.quadruplets.records is scratch.qplet_records
+    assert tmpdir.listdir() == []
+    assert _norm(scratch.to_qubo()) == _norm(model.to_qubo())
+    assert [str(q) for q in scratch.quadruplets] == [str(q) for q in model.quadruplets]
+
+
+@pytest.mark.parametrize('model_class', [Qallse, QallseMp, QallseD0])
+@pytest.mark.parametrize('cheat', [False, True])
+def test_prune_doublets(event, model_class, cheat):
+    # the pruned doublets can't be part of a quadruplet
+    dw, doublets = event
+    model = model_class(dw, cheat=cheat).build_model(doublets)
+    pruned = model_class(dw, cheat=cheat, prune_doublets=True).build_model(doublets)
+    assert len(pruned.doublets) < len(model.doublets)
+    assert _norm(pruned.to_qubo()) == _norm(model.to_qubo())
+    # real doublets are reported, and kept in cheat mode
+    stats = [s for s in pruned.hard_cuts_stats if ',pruned,' in s]
+    assert set(pruned.hard_cuts_stats) - set(stats) <= set(model.hard_cuts_stats)
+    real = set(str(d) for d in model.doublets if dw.is_real_hits(d.hits) == XpletType.REAL)
+    assert set(s.split(',')[1] for s in stats) <= real
+    if cheat:
+        assert real <= set(str(d) for d in pruned.doublets)
+
+
+@pytest.mark.parametrize('budget', [dict(max_qubo_vars=1000), dict(max_qubo_couplers=4000)])
+def test_qubo_budget(event, budget):
+    # the QUBO is the one built with the config updates applied, detected either while building the model
+    # (lower bounds) or while generating the QUBO (exact size, with the exclusion couplers)
+    dw, doublets = event
+    steps = [dict(qplet_max_strength=-0.25), dict(qplet_max_strength=-0.5)]
+    model = Qallse(dw).build_model(doublets, budget_steps=steps, **budget)
+    Q, (n_vars, n_incl, n_excl) = model.to_qubo(return_stats=True)
+    assert model.qubo_budget_updates == steps[0]
+    assert n_vars <= budget.get('max_qubo_vars', n_vars) and n_incl + n_excl <= budget.get('max_qubo_couplers', 10 ** 6)
+    expected = Qallse(dw, **steps[0]).build_model(doublets).to_qubo()
+    assert _norm(Q) == _norm(expected)
+
+    # a budget that is never exceeded doesn't change anything
+    model = Qallse(dw).build_model(doublets, max_qubo_vars=10 ** 6, budget_steps=steps)
+    assert model.qubo_budget_updates == {}
+    assert _norm(model.to_qubo()) == _norm(Qallse(dw).build_model(doublets).to_qubo())
+
+
+def test_qubo_budget_exceeded(event):
+    # once all the steps are applied, the QUBO is returned anyway unless early_abort is set
+    dw, doublets = event
+    steps = [dict(qplet_max_strength=-0.25), dict(qplet_max_strength=-0.5)]
+    model = Qallse(dw).build_model(doublets, max_qubo_vars=10, budget_steps=steps)
+    assert model.qubo_budget_updates == steps[-1]
+    assert _norm(model.to_qubo()) == _norm(Qallse(dw, **steps[-1]).build_model(doublets).to_qubo())
+    with pytest.raises(QuboBudgetExceeded):
+        Qallse(dw).build_model(doublets, max_qubo_vars=10, budget_steps=steps, early_abort=True)
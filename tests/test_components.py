@@ -0,0 +1,39 @@
+import dimod
+import numpy as np
+import pytest
+
+from hepqpr.qallse.cli.func import solve_components
+from hepqpr.qallse.utils import split_qubo
+
+
+def _energy(Q, sample):
+    return dimod.BinaryQuadraticModel.from_qubo(Q).energy(sample)
+
+
+def _variables(Q):
+    return set(k for key in Q.keys() for k in key)
+
+
+def test_split_qubo(qubo):
+    components = split_qubo(qubo)
+    assert len(components) > 1
+    assert [len(c) for c in components] == sorted((len(c) for c in components), reverse=True)
+    # the components are a partition of the QUBO entries, with no shared variable
+    assert sum(len(c) for c in components) == len(qubo)
+    assert dict((k, v) for c in components for k, v in c.items()) == qubo
+    assert sum(len(_variables(c)) for c in components) == len(_variables(qubo))
+
+    # the energy is the sum of the energies of the components
+    rng = np.random.RandomState(0)
+    sample = dict((v, int(rng.randint(2))) for v in _variables(qubo))
+    assert sum(_energy(c, dict((v, sample[v]) for v in _variables(c))) for c in components) == \
+        pytest.approx(_energy(qubo, sample))
+
+
+def test_solve_components(qubo):
+    # the batches only depend on min_batch_size and the seed, not on the number of processes
+    serial = solve_components(qubo, n_jobs=1, min_batch_size=50, seed=42, num_reads=2)
+    parallel = solve_components(qubo, n_jobs=2, min_batch_size=50, seed=42, num_reads=2)
+    assert serial.first.sample == parallel.first.sample
+    assert set(serial.first.sample.keys()) == _variables(qubo)
+    assert serial.first.energy == pytest.approx(_energy(qubo, serial.first.sample))
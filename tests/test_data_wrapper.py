@@ -0,0 +1,33 @@
+import numpy as np
+
+from hepqpr.qallse import Qallse
+
+
+def test_hit_indexes(event):
+    dw, _ = event
+    hit_ids = dw.hits.hit_id.values
+    assert dw.get_hit_indexes(hit_ids).tolist() == list(range(len(hit_ids)))
+    assert dw.get_hit_indexes(hit_ids[[3, 1]].reshape(1, 2)).tolist() == [[3, 1]]
+    assert dw.get_hit_indexes([-1]).tolist() == [-1]
+
+
+def test_is_real_hits(event):
+    dw, doublets = event
+    model = Qallse(dw, cheat=True).build_model(doublets)
+    for xplets in [model.doublets, model.triplets, model.quadruplets]:
+        assert [dw.is_real_hits(x.hits) for x in xplets] == [dw.is_real_xplet(x.hit_ids()) for x in xplets]
+
+
+def test_sliced_hit_indexes(event):
+    dw, doublets = event
+    model = Qallse(dw).build_model(doublets)
+    sliced = model.slice_model(dw.hits.hit_id.values[::-2])
+    hit_ids = np.array(list(sliced.hits.keys()))
+    assert [h.hit_index for h in sliced.hits.values()] == sliced.dataw.get_hit_indexes(hit_ids).tolist()
+
+
+def test_sample_variables(event):
+    dw, doublets = event
+    Q = Qallse(dw).build_model(doublets).to_qubo()
+    sample = dw.sample_qubo(Q)
+    assert dw.sample_variables(sample.keys()) == sample
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from hepqpr.qallse import Qallse, QallseMp, dumper
+from hepqpr.qallse.annealer import CsrQubo
+from hepqpr.qallse.qallse_base import QallseBase
+
+
+def _norm(Q):
+    # conflicts can be stored as (t1, t2) or (t2, t1)
+    return dict((frozenset(k), v) for k, v in Q.items())
+
+
+@pytest.mark.parametrize('model_class', [Qallse, QallseMp])
+@pytest.mark.parametrize('qplet_chunk_size', [None, 100])
+def test_load_model(tmpdir, event, model_class, qplet_chunk_size):
+    dw, doublets = event
+    model = model_class(dw, tplet_max_drz=0.15, qubo_bias_weight=1)
+    model.build_model(doublets, qplet_chunk_size=qplet_chunk_size)
+    Q = model.to_qubo()
+    fname = str(tmpdir.join('xplets.npz'))
+    dumper.dump_xplets(model, output_path=str(tmpdir), format='npz')
+
+    loaded = dumper.load_model(fname, dw)
+    assert type(loaded) == model_class
+    assert loaded.config.as_dict() == model.config.as_dict()
+    assert loaded.hard_cuts_stats == model.hard_cuts_stats
+    assert _norm(loaded.to_qubo()) == _norm(Q)
+
+
+def test_rebuild_loaded_model(tmpdir, event):
+    # the non-default parameters of the saved configuration are not pending updates
+    dw, doublets = event
+    model = Qallse(dw, tplet_max_drz=0.15, qubo_bias_weight=1).build_model(doublets)
+    model.to_qubo()
+    dumper.dump_xplets(model, output_path=str(tmpdir), format='npz')
+    loaded = dumper.load_model(str(tmpdir.join('xplets.npz')), dw)
+    loaded.to_qubo()
+
+    stages = []
+    loaded._run_stages = stages.append
+    loaded.config.update(qubo_bias_weight=2)
+    Q = loaded.rebuild()
+    assert stages == []
+    model.config.update(qubo_bias_weight=2)
+    assert _norm(Q) == _norm(model.rebuild())
+
+
+@pytest.mark.parametrize('qubo_format', ['pickle', 'npz', 'raw'])
+def test_dump_model_async(tmpdir, event, qubo_format):
+    # the writer only gets serialized data, and writes the same files
+    dw, doublets = event
+    model = Qallse(dw).build_model(doublets)
+    sync_dir, async_dir = tmpdir.mkdir('sync'), tmpdir.mkdir('async')
+    kwargs = dict(qubo_kwargs=dict(format=qubo_format, c_marker=None), xplets_kwargs=dict(format='npz'))
+    Q = dumper.dump_model(model, str(sync_dir), **kwargs)
+    with dumper.AsyncWriter() as writer:
+        submitted, submit = [], writer.submit
+        writer.submit = lambda fn, *args, **kw: submitted.append(args) or submit(fn, *args, **kw)
+        assert dumper.dump_model(model, str(async_dir), writer=writer, **kwargs) == Q
+    assert len(submitted) == 2 and not any(isinstance(a, QallseBase) for args in submitted for a in args)
+    for path in [sync_dir, async_dir]:
+        assert dumper.load_qubo(str(path.join(f'qubo.{qubo_format}'))) == Q
+        assert _norm(dumper.load_model(str(path.join('xplets.npz')), dw).to_qubo()) == _norm(model.to_qubo())
+
+
+@pytest.fixture(scope='module')
+def qubo(event):
+    dw, doublets = event
+    return Qallse(dw, qubo_bias_weight=1).build_model(doublets).to_qubo()
+
+
+@pytest.mark.parametrize('qubo_format,kwargs', [
+    ('pickle', dict()),
+    ('npz', dict()),
+    ('npz', dict(compress=True)),
+    ('raw', dict()),
+])
+def test_save_qubo(tmpdir, qubo, qubo_format, kwargs):
+    fname = str(tmpdir.join(f'qubo.{qubo_format}'))
+    dumper.save_qubo(qubo, fname, **kwargs)
+    loaded = dumper.load_qubo(fname)
+    # same entries, in the same order
+    assert list(loaded.items()) == list(qubo.items())
+
+
+def test_save_qubo_raw(tmpdir, qubo):
+    fname = dumper.write_qubo(qubo, str(tmpdir), prefix='evt-', format='raw', dtype=np.float32)
+    assert fname == str(tmpdir.join('evt-qubo.raw'))
+    assert sorted(f.basename for f in tmpdir.join('evt-qubo.raw').listdir()) == \
+        ['cols.npy', 'names.npy', 'rows.npy', 'values.npy']
+    loaded = dumper.load_qubo(fname)
+    assert list(loaded.keys()) == list(qubo.keys())
+    assert list(loaded.values()) == [float(np.float32(v)) for v in qubo.values()]
+
+    # the arrays can be memory-mapped and used without the dictionary
+    arrays = dumper.load_qubo_arrays(fname, mmap_mode='r')
+    assert all(isinstance(a, np.memmap) for a in arrays)
+    csr, expected = CsrQubo.from_arrays(*arrays), CsrQubo.from_qubo(loaded)
+    assert csr.variables == expected.variables
+    X = np.random.RandomState(0).randint(0, 2, size=(3, len(csr)))
+    assert csr.energies(X) == pytest.approx(expected.energies(X))
+
+
+def test_save_qubo_errors(tmpdir, event, qubo):
+    dw, doublets = event
+    with pytest.raises(ValueError):
+        dumper.save_qubo(qubo, str(tmpdir.join('qubo.csv')))
+    with pytest.raises(ValueError):
+        dumper.save_qubo(qubo, str(tmpdir.join('qubo.raw')), compress=True)
+    # markers can only be stored in pickles
+    model = Qallse(dw).build_model(doublets)
+    with pytest.raises(ValueError):
+        dumper.dump_qubo(model, str(tmpdir), format='npz', c_marker='c')
+    Q = dumper.dump_qubo(model, str(tmpdir), format='pickle', c_marker='c')
+    assert dumper.load_qubo(str(tmpdir.join('qubo.pickle'))) == Q
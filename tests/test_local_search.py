@@ -0,0 +1,45 @@
+import pytest
+
+from hepqpr.qallse import Qallse
+from hepqpr.qallse.cli.func import process_response
+from hepqpr.qallse.local_search import LocalSearchSolver, GreedySolver, TabuSolver
+from hepqpr.qallse.qallse_doublets import QallseDoublets
+from hepqpr.qallse.utils import find_auxiliary_variables
+
+
+def test_abstract_solver():
+    with pytest.raises(TypeError):
+        LocalSearchSolver()
+
+
+@pytest.mark.parametrize('conflict_mode', ['pairs', 'star'])
+def test_greedy(event, conflict_mode):
+    dw, doublets = event
+    Q = Qallse(dw, qubo_conflict_mode=conflict_mode).build_model(doublets).to_qubo()
+    response = GreedySolver().sample_qubo(Q)
+    # the auxiliary variables of the star mode are turned on along with their triplets
+    assert response.info['num_auxiliary'] == len(find_auxiliary_variables(Q.keys()))
+    assert response.first.energy == pytest.approx(dw.compute_energy(Q), abs=1e-6)
+    precision, recall, _ = dw.compute_score(process_response(response)[0])
+    assert precision == 1 and recall > 0.95
+
+    # tabu search keeps the greedy solution if it is already optimal
+    assert TabuSolver().sample_qubo(Q).first.energy <= response.first.energy + 1e-9
+
+
+def test_greedy_doublets_model(event):
+    # the variables are doublets, none of them is auxiliary
+    dw, doublets = event
+    Q = QallseDoublets(dw).build_model(doublets).to_qubo()
+    response = GreedySolver().sample_qubo(Q)
+    assert response.info['num_auxiliary'] == 0
+    assert response.first.energy == pytest.approx(dw.compute_energy(Q), rel=0.02)
+
+
+def test_greedy_explicit_auxiliary(event):
+    dw, doublets = event
+    model = Qallse(dw, qubo_conflict_mode='star').build_model(doublets)
+    Q = model.to_qubo()
+    response = GreedySolver().sample_qubo(Q, auxiliary=model.auxiliary_variables())
+    assert response.info['num_auxiliary'] == len(model.auxiliary_variables())
+    assert response.first.energy == pytest.approx(GreedySolver().sample_qubo(Q).first.energy)
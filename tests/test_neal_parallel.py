@@ -0,0 +1,21 @@
+import pytest
+
+from hepqpr.qallse.cli.func import solve_neal_parallel
+
+
+def test_reproducible(qubo):
+    # the seeds of the runs only depend on the seed, not on the number of processes
+    serial = solve_neal_parallel(qubo, n_runs=3, seed=42, n_jobs=1, num_reads=2)
+    parallel = solve_neal_parallel(qubo, n_runs=3, seed=42, n_jobs=2, num_reads=2)
+    assert serial.info['runs'] == [dict(r, cpu_time=s['cpu_time'], wall_time=s['wall_time'])
+                                   for r, s in zip(parallel.info['runs'], serial.info['runs'])]
+    assert all(0 <= r['seed'] < 1 << 31 for r in serial.info['runs'])
+    assert len(set(r['seed'] for r in serial.info['runs'])) == 3
+    assert len(serial) == 6
+    assert serial.first.energy == min(r['energy'] for r in serial.info['runs'])
+
+
+def test_split_reads(qubo):
+    assert len(solve_neal_parallel(qubo, n_runs=3, seed=42, n_jobs=1, split_reads=True, num_reads=4)) == 4
+    with pytest.raises(ValueError):
+        solve_neal_parallel(qubo, n_runs=3, split_reads=True, num_reads=2)
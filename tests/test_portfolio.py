@@ -0,0 +1,23 @@
+import pytest
+
+from hepqpr.qallse.cli.func import solve_portfolio
+
+
+def test_failure_does_not_end_the_race(qubo):
+    # the unknown solver fails right away, the greedy solver succeeds after the deadline
+    response = solve_portfolio(qubo, [('unknown', dict()), ('greedy', dict())], deadline=1e-3, timeout=60)
+    portfolio = response.info['portfolio']
+    assert portfolio['winner'] == ('greedy', 1)
+    assert [r['status'] for r in portfolio['results']] == ['failed', 'done']
+
+
+def test_best_response(qubo):
+    response = solve_portfolio(qubo, [('greedy', dict()), ('tabu', dict())], deadline=60, seed=42)
+    results = response.info['portfolio']['results']
+    assert [r['status'] for r in results] == ['done', 'done']
+    assert response.first.energy == pytest.approx(min(r['energy'] for r in results))
+
+
+def test_all_failed(qubo):
+    with pytest.raises(RuntimeError):
+        solve_portfolio(qubo, [('unknown', dict()), ('unknown', dict())], deadline=60)
@@ -0,0 +1,57 @@
+import dimod
+import numpy as np
+import pytest
+
+from hepqpr.qallse import Qallse, QallseMp, QallseD0
+from hepqpr.qallse.cli.func import solve_neal, solve_presolved
+from hepqpr.qallse.presolve import QuboPresolver
+
+
+def _energy(Q, sample):
+    return dimod.BinaryQuadraticModel.from_qubo(Q).energy(sample)
+
+
+def test_toy_qubo():
+    # b has only an inclusion coupler: it is always set. c conflicts with a and is then fixed to 0.
+    Q = {('a', 'a'): -1, ('b', 'b'): 0, ('a', 'b'): -1, ('a', 'c'): 2, ('c', 'c'): -0.5}
+    presolver = QuboPresolver(Q)
+    residual = presolver.presolve()
+    assert residual == {}
+    assert presolver.fixed == dict(a=1, b=1, c=0)
+    assert presolver.offset == _energy(Q, dict(a=1, b=1, c=0))
+    assert presolver.stats == dict(variables=3, removed=3, fixed=3, merged=0)
+
+
+@pytest.mark.parametrize('model_class', [Qallse, QallseMp, QallseD0])
+def test_model_qubo(event, model_class):
+    dw, doublets = event
+    Q = model_class(dw).build_model(doublets).to_qubo()
+    presolver = QuboPresolver(Q)
+    residual = presolver.presolve()
+
+    variables = set(k for key in Q.keys() for k in key)
+    residual_variables = set(k for key in residual.keys() for k in key)
+    stats = presolver.stats
+    assert stats['variables'] == len(variables)
+    assert stats['removed'] == stats['fixed'] + stats['merged'] > 0
+    assert len(residual_variables) == len(variables) - stats['removed']
+    assert residual_variables.isdisjoint(presolver.fixed.keys()) and residual_variables.isdisjoint(presolver.merged)
+
+    # expanded samples keep the energy of the residual samples (plus the offset)
+    rng = np.random.RandomState(0)
+    for _ in range(5):
+        sample = dict((v, int(rng.randint(2))) for v in residual_variables)
+        full = presolver.expand_sample(sample)
+        assert set(full.keys()) == variables
+        assert _energy(Q, full) == pytest.approx(_energy(residual, sample) + presolver.offset)
+
+
+def test_solve_presolved(event):
+    dw, doublets = event
+    Q = QallseMp(dw).build_model(doublets).to_qubo()
+    response = solve_presolved(Q, solve_neal, seed=42)
+    presolver = QuboPresolver(Q)
+    presolver.presolve()
+    assert response.info['presolve'] == presolver.stats
+    sample, energy = next(iter(response.data(['sample', 'energy'])))
+    assert energy == pytest.approx(_energy(Q, sample))
@@ -0,0 +1,109 @@
+import math
+
+import dimod
+import numpy as np
+import pytest
+
+from hepqpr.qallse import Qallse
+from hepqpr.qallse.cli.func import process_response
+from hepqpr.qallse.data_structures import Xplet
+from hepqpr.qallse.qallse_base import QallseBase
+from hepqpr.qallse.utils import AUXILIARY_PREFIX
+
+
+def _triplets(model):
+    return [str(t) for t in model.triplets]
+
+
+def test_triplet_candidates(event):
+    # the candidates index only skips doublets that would fail the triplet cuts
+    dw, doublets = event
+    model = Qallse(dw).build_model(doublets)
+    triplets = _triplets(model)
+    model._triplet_candidates = lambda d1: QallseBase._triplet_candidates(model, d1)
+    model._create_triplets()
+    assert _triplets(model) == triplets
+
+
+def test_triplet_candidates_wrap(event):
+    # the R-Z angles are compared modulo 2π, like in the triplet cuts: rotating all of them changes nothing
+    dw, doublets = event
+    model = Qallse(dw).build_model(doublets)
+    triplets = _triplets(model)
+    for d in model.doublets:
+        d.rz_angle = (d.rz_angle + 2 * math.pi) % (2 * math.pi) - math.pi
+    model._reset_connections(model.doublets)
+    model._create_triplets()
+    assert _triplets(model) == triplets
+
+
+def _quadruplets(model):
+    return [(str(q.t1), str(q.t2), q.strength) for q in model.quadruplets]
+
+
+def test_quadruplet_candidates(event):
+    # the curvature index only skips triplets that would fail the quadruplet cuts
+    dw, doublets = event
+    model = Qallse(dw).build_model(doublets)
+    assert model._max_candidate_dcurv() is not None
+    quadruplets, stats = _quadruplets(model), list(model.hard_cuts_stats)
+    model = Qallse(dw)
+    model._quadruplet_candidates = lambda t1: QallseBase._quadruplet_candidates(model, t1)
+    model.build_model(doublets)
+    assert _quadruplets(model) == quadruplets
+    assert model.hard_cuts_stats == stats
+
+
+def test_sliced_budget(event):
+    # the slice has its own budget: tightening its cuts leaves the model untouched
+    dw, doublets = event
+    model = Qallse(dw).build_model(doublets, max_qubo_vars=1200)
+    steps, updates = list(model._qubo_budget[2]), dict(model.qubo_budget_updates)
+    assert len(steps) > 0
+    sliced = model.slice_model(dw.hits.hit_id.values[:len(dw.hits) // 2])
+    assert sliced._fit_qubo_budget(10 ** 6, 10 ** 6)
+    assert sliced._qubo_budget[2] == steps[1:]
+    assert model._qubo_budget[2] == steps and model.qubo_budget_updates == updates
+    assert model.config.qplet_max_strength != sliced.config.qplet_max_strength
+
+
+def test_star_conflicts(event):
+    # conflict-free samples have the same energy in both conflict modes, plus the bias of the auxiliary variables
+    # set for the doublets of the selected triplets
+    dw, doublets = event
+    pairs = Qallse(dw).build_model(doublets)
+    star = Qallse(dw, qubo_conflict_mode='star').build_model(doublets)
+    Q_pairs, (n_vars, n_incl, n_excl) = pairs.to_qubo(return_stats=True)
+    Q_star, (n_star_vars, n_star_incl, n_star_excl) = star.to_qubo(return_stats=True)
+    # the auxiliary variables are the ones only found in the star QUBO
+    auxiliary = set(k for key in Q_star.keys() for k in key) - set(k for key in Q_pairs.keys() for k in key)
+    assert n_star_vars == n_vars + len(auxiliary) and n_star_incl == n_incl and n_star_excl < n_excl
+
+    bqm_pairs, bqm_star = [dimod.BinaryQuadraticModel.from_qubo(Q) for Q in [Q_pairs, Q_star]]
+    # subsets of the real triplets are conflict-free
+    selected = [k for k, v in dw.sample_qubo(Q_pairs).items() if v]
+    rng = np.random.RandomState(0)
+    for _ in range(5):
+        sample = dict((k, 0) for k in bqm_pairs.variables)
+        sample.update((k, 1) for k in selected if rng.rand() < 0.7)
+        used = set(f'{AUXILIARY_PREFIX}{h1}_{h2}'
+                   for k, v in sample.items() if v for (h1, h2) in zip(k.split('_'), k.split('_')[1:]))
+        star_sample = dict(sample, **dict((k, int(k in used)) for k in auxiliary))
+        assert bqm_star.energy(star_sample) == pytest.approx(
+            bqm_pairs.energy(sample) + len(used & auxiliary) * star.config.qubo_conflict_aux_bias)
+
+
+def test_star_stray_auxiliary(event):
+    # auxiliary variables left on by a sampler are not turned into doublets
+    dw, doublets = event
+    model = Qallse(dw, qubo_conflict_mode='star').build_model(doublets)
+    Q = model.to_qubo()
+    sample = dw.sample_qubo(Q)
+    stray = next(k for k in sorted(model.auxiliary_variables()) if not sample[k])
+    sample[stray] = 1
+
+    final_doublets, _ = process_response(dimod.SampleSet.from_samples(sample, 'BINARY', 0))
+    assert Xplet.name_to_hit_ids(stray[len(AUXILIARY_PREFIX):]) not in [list(d) for d in final_doublets]
+    precision, _, _ = dw.compute_score(final_doublets)
+    assert precision == 1
+    assert model.process_sample(sample) == model.process_sample(dict(sample, **{stray: 0}))
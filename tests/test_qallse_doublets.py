@@ -0,0 +1,52 @@
+import pytest
+
+from hepqpr.qallse import QallseD0
+from hepqpr.qallse.cli.func import solve_neal
+from hepqpr.qallse.qallse_doublets import QallseDoublets
+
+
+@pytest.fixture(scope='module')
+def models(event):
+    dw, doublets = event
+    return QallseD0(dw).build_model(doublets), QallseDoublets(dw).build_model(doublets)
+
+
+def test_qubo(models):
+    # one variable per doublet and one inclusion coupler per triplet of the triplet formulation
+    d0, model = models
+    Q_d0, Q = d0.to_qubo(), model.to_qubo()
+    linear = dict((k1, v) for (k1, k2), v in Q.items() if k1 == k2)
+    assert set(linear.keys()) == set(str(d) for d in d0.qubo_doublets)
+    assert all(v == model.config.qubo_doublet_bias for v in linear.values())
+
+    couplers = model._qubo_parts['qubo_couplers']
+    assert len(couplers) == len(d0.qubo_triplets)
+    assert set(couplers.keys()) == set((str(t.d1), str(t.d2)) for t in d0.qubo_triplets)
+    # the inclusion energy of the whole QUBO is unchanged
+    weights = sum(v for (k1, k2), v in Q_d0.items() if k1 == k2)
+    strengths = sum(q.strength for q in d0.quadruplets)
+    assert sum(couplers.values()) == pytest.approx(weights + strengths)
+
+    conflicts = model._qubo_parts['qubo_conflicts']
+    assert all(k1.split('_')[0] == k2.split('_')[0] or k1.split('_')[1] == k2.split('_')[1]
+               for (k1, k2) in conflicts.keys())
+
+
+def test_solve(event, models):
+    # the doublet samples can be processed as usual, and find the same tracks
+    dw, _ = event
+    scores = []
+    for m in models:
+        response = solve_neal(m.to_qubo(), seed=42)
+        scores.append(dw.compute_score(m.process_sample(response.first.sample))[:2])
+    assert scores[1] == pytest.approx(scores[0], abs=0.02)
+    assert scores[1][0] > 0.95 and scores[1][1] > 0.95
+
+
+@pytest.mark.parametrize('update', [dict(qubo_doublet_bias=1), dict(qubo_bias_weight=1), dict(xy_power=2)])
+def test_rebuild(event, update):
+    dw, doublets = event
+    model = QallseDoublets(dw).build_model(doublets)
+    model.to_qubo()
+    model.config.update(**update)
+    assert model.rebuild() == QallseDoublets(dw, **update).build_model(doublets).to_qubo()
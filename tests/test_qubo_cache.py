@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from hepqpr.qallse import Qallse
+from hepqpr.qallse.qubo_cache import QuboCache, build_qubo
+
+
+def _norm(Q):
+    # conflicts can be stored as (t1, t2) or (t2, t1)
+    return dict((frozenset(k), v) for k, v in Q.items())
+
+
+def _key(cache, model, doublets):
+    # the key used by build_qubo with the default arguments
+    return cache.key(model, doublets, qubo_kwargs=dict(w_marker=None, c_marker=None), xplets_format='pickle')
+
+
+def _not_built(*args, **kwargs):
+    raise AssertionError('the model should not be built on a cache hit')
+
+
+def test_hit_miss(tmpdir, event):
+    dw, doublets = event
+    cache = QuboCache(str(tmpdir))
+    entry = build_qubo(Qallse(dw), doublets, cache=cache, max_qubo_vars=1000)
+    assert not entry['cache_hit'] and len(os.listdir(str(tmpdir))) == 1
+    assert _norm(entry['qubo']) == _norm(Qallse(dw).build_model(doublets, max_qubo_vars=1000).to_qubo())
+
+    model = Qallse(dw)
+    model.build_model = _not_built
+    hit = build_qubo(model, doublets, cache=cache, max_qubo_vars=1000, n_jobs=2, qplet_chunk_size=100)
+    assert hit['cache_hit']
+    for k in ['qubo', 'xplets', 'stats', 'qubo_budget_updates', 'build_time', 'qubo_time']:
+        assert hit[k] == entry[k]
+    assert model.qubo_budget_updates == entry['qubo_budget_updates'] != {}
+
+    # anything changing the QUBO is part of the key
+    for model, kwargs in [
+        (Qallse(dw, qubo_bias_weight=1), dict()),
+        (Qallse(dw), dict(max_qubo_vars=800)),
+        (Qallse(dw), dict(qubo_kwargs=dict(w_marker=1))),
+        (Qallse(dw), dict(xplets_format='npz')),
+    ]:
+        assert not build_qubo(model, doublets, cache=cache, **kwargs)['cache_hit']
+    assert not build_qubo(Qallse(dw), doublets[:-1], cache=cache, max_qubo_vars=1000)['cache_hit']
+
+
+def test_corrupt_entry(tmpdir, event):
+    dw, doublets = event
+    cache = QuboCache(str(tmpdir))
+    key = _key(cache, Qallse(dw), doublets)
+    with open(cache._path(key), 'wb') as f:
+        f.write(b'not a pickle')
+    assert cache.get(key) is None and not os.path.exists(cache._path(key))
+
+    # an entry stored under another key is never returned
+    entry = build_qubo(Qallse(dw), doublets, cache=cache)
+    os.rename(cache._path(key), cache._path('0' * len(key)))
+    assert cache.get('0' * len(key)) is None and os.listdir(str(tmpdir)) == []
+    assert not build_qubo(Qallse(dw), doublets, cache=cache)['cache_hit']
+    assert _norm(cache.get(key)['qubo']) == _norm(entry['qubo'])
+
+
+def test_eviction(tmpdir, event):
+    # the least recently used entries are evicted, the last one is always kept
+    dw, doublets = event
+    cache = QuboCache(str(tmpdir), max_size=0)
+    keys = []
+    for bias in [0, 1]:
+        model = Qallse(dw, qubo_bias_weight=bias)
+        keys.append(_key(cache, model, doublets))
+        build_qubo(model, doublets, cache=cache)
+    assert cache.get(keys[0]) is None and cache.get(keys[1]) is not None
+
+    cache.clear()
+    assert cache.get(keys[1]) is None
@@ -0,0 +1,58 @@
+import dimod
+import numpy as np
+import pytest
+
+from hepqpr.qallse import Qallse, QallseMp, dumper
+from hepqpr.qallse.qubo_template import QuboTemplate
+
+
+def _norm(Q):
+    # conflicts can be stored as (t1, t2) or (t2, t1)
+    return dict((frozenset(k), v) for k, v in Q.items())
+
+
+@pytest.mark.parametrize('model_class', [Qallse, QallseMp])
+def test_from_model(event, model_class):
+    # substituting the coefficients gives the QUBO rebuilt with the new configuration
+    dw, doublets = event
+    model = model_class(dw).build_model(doublets)
+    template = QuboTemplate.from_model(model)
+    assert list(template.instantiate().items()) == list(model.to_qubo().items())
+
+    for update in [dict(qubo_bias_weight=1), dict(qubo_conflict_strength=2),
+                   dict(qubo_bias_weight=1, qubo_conflict_strength=2)]:
+        Q = template.instantiate(bias_weight=update.get('qubo_bias_weight'),
+                                 conflict_strength=update.get('qubo_conflict_strength'))
+        expected = model_class(dw, **update).build_model(doublets).to_qubo()
+        assert _norm(Q) == _norm(expected)
+
+
+def test_from_qubo(tmpdir, event):
+    dw, doublets = event
+    model = Qallse(dw).build_model(doublets)
+    with dumper.use_markers(model, w_marker=10, c_marker=20) as altered_model:
+        template = QuboTemplate.from_qubo(altered_model.to_qubo())
+    with pytest.raises(ValueError):
+        template.instantiate(bias_weight=1)
+
+    model.config.update(qubo_bias_weight=1, qubo_conflict_strength=2)
+    Q = template.instantiate(bias_weight=1, conflict_strength=2)
+    assert _norm(Q) == _norm(model.rebuild())
+
+    # the BQM has the same energies, and saved templates give the same QUBOs
+    bqm = template.to_bqm(bias_weight=1, conflict_strength=2)
+    expected = dimod.BinaryQuadraticModel.from_qubo(Q)
+    rng = np.random.RandomState(0)
+    for _ in range(3):
+        sample = dict((v, int(rng.randint(2))) for v in expected.variables)
+        assert bqm.energy(sample) == pytest.approx(expected.energy(sample))
+
+    fname = str(tmpdir.join('template.npz'))
+    template.save(fname)
+    assert QuboTemplate.load(fname).instantiate(bias_weight=1, conflict_strength=2) == Q
+
+
+def test_star_mode(event):
+    dw, doublets = event
+    with pytest.raises(ValueError):
+        QuboTemplate.from_model(Qallse(dw, qubo_conflict_mode='star').build_model(doublets))
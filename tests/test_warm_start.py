@@ -0,0 +1,66 @@
+import dimod
+import pytest
+
+from hepqpr.qallse import Qallse
+from hepqpr.qallse.cli.func import solve_neal
+from hepqpr.qallse.qallse_doublets import QallseDoublets
+from hepqpr.qallse.utils import qubo_initial_state, find_auxiliary_variables, is_auxiliary_variable, \
+    AUXILIARY_PREFIX
+
+
+def _energy(Q, sample):
+    return dimod.BinaryQuadraticModel.from_qubo(Q).energy(sample)
+
+
+@pytest.fixture(scope='module', params=['pairs', 'star'])
+def model(request, event):
+    dw, doublets = event
+    return Qallse(dw, qubo_conflict_mode=request.param).build_model(doublets)
+
+
+def test_initial_state(event, model):
+    dw, _ = event
+    Q = model.to_qubo()
+    ideal = dw.compute_energy(Q)
+    for sample in [model.initial_state(), qubo_initial_state(Q)]:
+        assert set(sample.keys()) == set(k for key in Q.keys() for k in key)
+        # no conflict, and the auxiliary variables are set exactly for the doublets of the selected triplets
+        final_doublets = model.process_sample(sample)
+        assert len(set(d[0] for d in final_doublets)) == len(final_doublets)
+        assert len(set(d[1] for d in final_doublets)) == len(final_doublets)
+        assert set(k for k, v in sample.items() if v and is_auxiliary_variable(k)) == \
+            set(f'{AUXILIARY_PREFIX}{h1}_{h2}' for (h1, h2) in final_doublets) & model.auxiliary_variables()
+        assert _energy(Q, sample) == pytest.approx(ideal, rel=0.05)
+
+
+def test_auxiliary_variables(event, model):
+    Q = model.to_qubo()
+    auxiliary = model.auxiliary_variables()
+    if model.config.qubo_conflict_mode == 'pairs':
+        assert auxiliary == set()
+    else:
+        assert len(auxiliary) > 0 and auxiliary == find_auxiliary_variables(Q.keys())
+
+
+def test_doublets_model(event):
+    dw, doublets = event
+    model = QallseDoublets(dw).build_model(doublets)
+    Q = model.to_qubo()
+    assert model.auxiliary_variables() == set()
+    assert _energy(Q, model.initial_state()) == pytest.approx(dw.compute_energy(Q), rel=0.05)
+
+
+def test_warm_neal(event, model):
+    dw, _ = event
+    Q = model.to_qubo()
+    response = solve_neal(Q, seed=42, initial_state=model.initial_state(), num_reads=2)
+    assert response.first.energy <= _energy(Q, model.initial_state()) + 1e-6
+
+
+def test_warm_neal_unsupported(event, model, monkeypatch, caplog):
+    # older versions of neal do not support initial states: start from random states
+    monkeypatch.setattr('hepqpr.qallse.cli.func._neal_supports', lambda parameter: False)
+    Q = model.to_qubo()
+    response = solve_neal(Q, seed=42, initial_state=model.initial_state(), num_reads=2)
+    assert 'ignoring the warm start' in caplog.text
+    assert response.first.energy == solve_neal(Q, seed=42, num_reads=2).first.energy